@@ -3,87 +3,280 @@ Character Image Studio — Web UI
 A retro-styled web interface for NeukoAI Character Image Studio API.
 """
 
+import gzip
 import json
+import logging
 import os
 import re
 import shutil
 import subprocess
 import time
 import webbrowser
+import zlib
 import threading
 from pathlib import Path
+from urllib.parse import quote, urlencode
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import requests as http_requests
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+from werkzeug.security import safe_join
+
+from assets import AssetManifest
+from batches import BatchManager
+from compression import CompressionEngine
+from credentials import CredentialStore
+from downloader import download_references
+from gallery import GalleryStore
+from jobs import JobManager, RetryLater, backoff_delay
+from ledger import TransactionLedger
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from packs import FORMATS as PACK_FORMATS, PackError, PackImporter, export_pack
+from poller import PollScheduler
+from ratelimit import AdaptiveRateLimiter
+from refcache import RefPayloadCache
+from refselect import RefSelector
+from respcache import ResponseCache
+from seeds import SeedStore, UnreadableImage, UploadTooLarge
+from registry import CharacterRegistry, SqliteRegistryStore
+from thumbnails import ThumbnailCache
+from upstream import StreamingJSON, UpstreamClient
 
 # ──────────────────────────────────────────────
 # Configuration
 # ──────────────────────────────────────────────
 
-API_BASE_URL = "https://api-imagegen.neuko.ai"
-CONFIG_PATH = Path(__file__).parent / "user_credentials.json"
-CHARACTERS_DIR = Path(__file__).parent / "characters"
+# The API and the data directory can be pointed elsewhere, e.g. at the local
+# stand-in and a scratch directory used by bench/run.py
+API_BASE_URL = os.environ.get("CIS_API_BASE_URL", "https://api-imagegen.neuko.ai")
+DATA_DIR = Path(os.environ.get("CIS_DATA_DIR") or Path(__file__).parent)
+CONFIG_PATH = DATA_DIR / "user_credentials.json"
+CHARACTERS_DIR = DATA_DIR / "characters"
+REF_CACHE_DIR = CHARACTERS_DIR / ".cache" / "refs"  # on-disk tier of the reference cache
+THUMB_CACHE_DIR = CHARACTERS_DIR / ".cache" / "thumbs"  # resized copies for cards and previews
+REF_INDEX_DIR = CHARACTERS_DIR / ".cache" / "refindex"  # per-character image features
+SEED_DIR = CHARACTERS_DIR / ".cache" / "seeds"  # uploaded seed images, by SHA-256
+STATIC_DIR = Path(__file__).parent / "static"
+STATIC_CACHE_DIR = CHARACTERS_DIR / ".cache" / "static"  # gzip/brotli copies of static assets
+# Character registry storage: "json" (registry.json) or "sqlite" (WAL-mode database,
+# migrated from registry.json on first start)
+REGISTRY_BACKEND = os.environ.get("CIS_REGISTRY_BACKEND", "json")
+REGISTRY_DB_PATH = CHARACTERS_DIR / "registry.sqlite3"
+# Local mirror of generated images (content-addressed) and its size quota
+GALLERY_DIR = DATA_DIR / "gallery"
+GALLERY_MAX_BYTES = int(os.environ.get("CIS_GALLERY_MAX_MB", "2048")) * 1024 * 1024
+# Local mirror of the account's credit transactions
+LEDGER_PATH = DATA_DIR / "ledger.sqlite3"
 PORT = 5777
-
+# JSON responses at least this large are gzipped for clients that accept it
+JSON_GZIP_MIN_BYTES = 2048
+# Starting request rate (per second) for upstream admission control; it adapts
+# to the API's 429s from there (see ratelimit.py)
+UPSTREAM_RATE = float(os.environ.get("CIS_UPSTREAM_RATE", "5"))
+# Largest request body the app accepts (a seed image as a base64 data URL plus
+# prompts); bigger uploads are rejected with 413 before they are read
+MAX_BODY_BYTES = int(os.environ.get("CIS_MAX_BODY_MB", "24")) * 1024 * 1024
+# Character pack imports are streamed to disk, so they get a limit of their own
+MAX_PACK_BYTES = int(os.environ.get("CIS_MAX_PACK_MB", "16384")) * 1024 * 1024
+
+# Response cache policy per endpoint: (fresh seconds, extra seconds served stale
+# while a background refresh runs). Balance is also invalidated explicitly.
+RESPONSE_CACHE_POLICIES = {
+    "pricing": (3600, 86400),
+    "bundles": (3600, 86400),
+    "me": (300, 3600),
+    "balance": (15, 300),
+}
+# Batch generation has its own executor, so the worker count bounds how many
+# batch submissions are in flight at once (see batches.py)
+BATCH_CONCURRENCY = 4
+
+log = logging.getLogger(__name__)
+
+# Static files are served by `static_asset` below (fingerprinted, precompressed),
+# not by Flask's default handler
 app = Flask(
     __name__,
-    static_folder="static",
+    static_folder=None,
     template_folder="templates",
 )
+app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES
 CORS(app)
 
 
+@app.errorhandler(413)
+def body_too_large(e):
+    return jsonify({"error": f"Request body too large (max {MAX_BODY_BYTES // (1024 * 1024)} MB)"}), 413
+
+
+# ──────────────────────────────────────────────
+# Request metrics (served at /metrics)
+# ──────────────────────────────────────────────
+
+HTTP_SECONDS = Histogram("cis_http_request_duration_seconds",
+                         "Time to produce a response, by route template", ("route", "method", "status"))
+HTTP_RECEIVED = Counter("cis_http_request_bytes_total", "Request body bytes received", ("route",))
+HTTP_SENT = Counter("cis_http_response_bytes_total", "Response body bytes sent (when the length is known)",
+                    ("route",))
+HTTP_IN_FLIGHT = Gauge("cis_http_requests_in_flight", "Requests currently being handled")
+
+
+def observe_request(route, method, status, start, received=None, sent=None):
+    """Record one handled request; shared with the async routes in asgi.py."""
+    HTTP_SECONDS.observe(time.perf_counter() - start, route=route, method=method, status=status)
+    if received:
+        HTTP_RECEIVED.inc(received, route=route)
+    if sent:
+        HTTP_SENT.inc(sent, route=route)
+
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+
+@app.after_request
+def _record_request(response):
+    # Route templates ("/api/asset/status/<generation_id>"), not paths, keep the
+    # label set bounded
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    observe_request(route, request.method, response.status_code, g.request_start,
+                    request.content_length, response.content_length)
+    return response
+
+
+@app.teardown_request
+def _finish_request(exc):
+    if "request_start" in g:
+        HTTP_IN_FLIGHT.dec()
+
+
+@app.after_request
+def _gzip_json(response):
+    if (response.mimetype != "application/json" or response.status_code in (204, 304)
+            or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or not request.accept_encodings["gzip"]):
+        return response
+    body = response.get_data()
+    if len(body) < JSON_GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def _json_body() -> dict:
+    """Parse the JSON request body without keeping the raw bytes around, so a
+    large upload is only held once (as the parsed document)."""
+    body = request.get_json(silent=True, cache=False)
+    return body if isinstance(body, dict) else {}
+
+
 # ──────────────────────────────────────────────
 # Credential helpers
 # ──────────────────────────────────────────────
 
 def load_credentials() -> dict:
-    """Load saved credentials from disk."""
-    if CONFIG_PATH.exists():
-        try:
-            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            return {}
-    return {}
+    """Return saved credentials (cached in memory)."""
+    return credentials.load()
 
 
 def save_credentials(data: dict):
     """Persist credentials to disk."""
-    existing = load_credentials()
-    existing.update(data)
-    with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-        json.dump(existing, f, indent=2)
+    credentials.save(data)
+
+
+def _login_request(client_id, client_secret) -> dict | None:
+    """POST /auth/login. Returns the token response or None."""
+    try:
+        resp = upstream.post(
+            "/api/v1/auth/login",
+            endpoint="auth",
+            auth=False,
+            json={"client_id": client_id, "client_secret": client_secret},
+        )
+        if resp.status_code == 200:
+            return resp.json()
+    except Exception:
+        pass
+    return None
 
 
 def get_auth_header() -> dict:
     """Return Authorization header from stored token."""
-    creds = load_credentials()
-    token = creds.get("access_token", "")
+    credentials.refresh_soon(_login_request)  # proactive refresh near expiry
+    token = credentials.access_token
     return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
 
-def auto_login() -> dict | None:
-    """Try to login with stored credentials. Returns token data or None."""
-    creds = load_credentials()
-    cid = creds.get("client_id")
-    csecret = creds.get("client_secret")
-    if not cid or not csecret:
-        return None
+def auto_login(stale_token=None) -> dict | None:
+    """Try to login with stored credentials. Returns token data or None.
+
+    Concurrent callers are coalesced into one login; pass the token that was
+    rejected as `stale_token` so callers that lost the race reuse the new one.
+    """
+    return credentials.refresh(_login_request, stale_token=stale_token)
+
+
+def _relay(resp):
+    """Pass an upstream JSON response through to the browser unchanged."""
+    return jsonify(resp.json()), resp.status_code
+
+
+def _cached_upstream_json(name, path, auth=True):
+    """Serve an upstream GET from the response cache, with ETag/304 support.
+
+    Per-account endpoints are keyed by client_id."""
+    def fetch():
+        resp = upstream.get(path, endpoint=name, auth=auth)
+        return resp.status_code, resp.json()
+
+    key = load_credentials().get("client_id") if auth else None
+    entry = response_cache.get(name, fetch, key=key)
+    resp = Response(entry.body, status=entry.status, mimetype="application/json")
+    if entry.status == 200:
+        resp.set_etag(entry.etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        resp.make_conditional(request)
+    return resp
+
+
+def _invalidate_balance():
+    """Forget cached balance/account info after anything that spends or adds credits."""
+    response_cache.invalidate("balance")
+    response_cache.invalidate("me")
+
+
+def _note_generations(data, kind, **meta):
+    """Record new generation IDs (and what produced them) in the gallery index."""
+    inner = data.get("data", data) if isinstance(data, dict) else {}
+    gens = inner.get("images") or [inner]
+    for gen in gens:
+        if isinstance(gen, dict):
+            gallery.add(gen.get("generation_id") or gen.get("id"), kind=kind, **meta)
+
+
+def _relay_generation(resp, kind, **meta):
+    """Relay a generate/* response; non-JSON bodies become a 502.
+    Submissions spend credits, so the cached balance is dropped."""
+    _invalidate_balance()
     try:
-        resp = http_requests.post(
-            f"{API_BASE_URL}/api/v1/auth/login",
-            json={"client_id": cid, "client_secret": csecret},
-            timeout=15,
-        )
-        if resp.status_code == 200:
-            data = resp.json()
-            save_credentials({"access_token": data["access_token"]})
-            return data
+        data = resp.json()
+        if resp.ok:
+            _note_generations(data, kind, **meta)
+        return jsonify(data), resp.status_code
     except Exception:
-        pass
-    return None
+        # Keep 402 (insufficient credits) and 429 (rate limit) visible to the UI
+        if resp.status_code in (402, 429):
+            return jsonify({"error": f"HTTP {resp.status_code}"}), resp.status_code
+        return jsonify({"error": f"API returned non-JSON (HTTP {resp.status_code})"}), 502
 
 
 # ──────────────────────────────────────────────
@@ -92,7 +285,30 @@ def auto_login() -> dict | None:
 
 @app.route("/")
 def index():
-    return render_template("index.html")
+    # The page itself is revalidated (304 while the asset URLs in it are unchanged)
+    resp = Response(render_template("index.html"), mimetype="text/html")
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+
+@app.route("/static/<path:filename>")
+def static_asset(filename):
+    """Serve a static file, precompressed when the browser accepts it.
+    Fingerprinted URLs (from `asset_url`) are cached for good."""
+    asset, immutable = assets.resolve(filename)
+    if asset is None:
+        return jsonify({"error": "not found"}), 404
+    path, encoding = assets.variant(asset, request.accept_encodings)
+    resp = send_file(path, mimetype=asset.mimetype, conditional=True,
+                     etag=f"{asset.digest}-{encoding}" if encoding else asset.digest,
+                     max_age=31536000 if immutable else None)
+    if immutable:
+        resp.cache_control.immutable = True
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if asset.variants:
+        resp.vary.add("Accept-Encoding")
+    return resp
 
 
 # ──────────────────────────────────────────────
@@ -103,7 +319,7 @@ def index():
 def register():
     """Register a new account."""
     try:
-        resp = http_requests.post(f"{API_BASE_URL}/api/v1/auth/register", timeout=15)
+        resp = upstream.post("/api/v1/auth/register", endpoint="auth", auth=False)
         if resp.status_code in (200, 201):
             data = resp.json()
             save_credentials({
@@ -111,10 +327,11 @@ def register():
                 "client_secret": data["client_secret"],
             })
             # Immediately login
-            login_resp = http_requests.post(
-                f"{API_BASE_URL}/api/v1/auth/login",
+            login_resp = upstream.post(
+                "/api/v1/auth/login",
+                endpoint="auth",
+                auth=False,
                 json={"client_id": data["client_id"], "client_secret": data["client_secret"]},
-                timeout=15,
             )
             if login_resp.status_code == 200:
                 login_data = login_resp.json()
@@ -146,10 +363,11 @@ def login():
     if not client_id or not client_secret:
         return jsonify({"success": False, "error": "client_id and client_secret required"}), 400
     try:
-        resp = http_requests.post(
-            f"{API_BASE_URL}/api/v1/auth/login",
+        resp = upstream.post(
+            "/api/v1/auth/login",
+            endpoint="auth",
+            auth=False,
             json={"client_id": client_id, "client_secret": client_secret},
-            timeout=15,
         )
         if resp.status_code == 200:
             data = resp.json()
@@ -179,12 +397,7 @@ def try_auto_login():
 def me():
     """Get current user info."""
     try:
-        resp = http_requests.get(f"{API_BASE_URL}/api/v1/auth/me", headers=get_auth_header(), timeout=10)
-        if resp.status_code == 401:
-            # Try auto-login
-            if auto_login():
-                resp = http_requests.get(f"{API_BASE_URL}/api/v1/auth/me", headers=get_auth_header(), timeout=10)
-        return jsonify(resp.json()), resp.status_code
+        return _cached_upstream_json("me", "/api/v1/auth/me")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -213,8 +426,8 @@ def export_credentials():
 @app.route("/api/logout", methods=["POST"])
 def logout():
     """Clear stored credentials."""
-    if CONFIG_PATH.exists():
-        CONFIG_PATH.unlink()
+    credentials.clear()
+    _invalidate_balance()
     return jsonify({"success": True})
 
 
@@ -225,11 +438,7 @@ def logout():
 @app.route("/api/balance", methods=["GET"])
 def balance():
     try:
-        resp = http_requests.get(f"{API_BASE_URL}/api/v1/credits/balance", headers=get_auth_header(), timeout=10)
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.get(f"{API_BASE_URL}/api/v1/credits/balance", headers=get_auth_header(), timeout=10)
-        return jsonify(resp.json()), resp.status_code
+        return _cached_upstream_json("balance", "/api/v1/credits/balance")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -237,34 +446,61 @@ def balance():
 @app.route("/api/pricing", methods=["GET"])
 def pricing():
     try:
-        resp = http_requests.get(f"{API_BASE_URL}/api/v1/credits/pricing", timeout=10)
-        return jsonify(resp.json()), resp.status_code
+        return _cached_upstream_json("pricing", "/api/v1/credits/pricing", auth=False)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _synced_ledger():
+    """Bring the ledger up to date (at most once a minute unless ?refresh=1).
+    Returns False when nobody is logged in."""
+    account = load_credentials().get("client_id")
+    if not account:
+        return False
+    if request.args.get("refresh"):
+        ledger.sync(account)
+    else:
+        ledger.sync_if_stale(account)
+    return True
+
+
+def _ledger_filters():
+    return {
+        "since": request.args.get("from") or None,
+        "until": request.args.get("to") or None,
+        "type": request.args.get("type") or None,
+        "character": request.args.get("character") or None,
+    }
+
+
 @app.route("/api/transactions", methods=["GET"])
 def transactions():
-    page = request.args.get("page", 1)
-    limit = request.args.get("limit", 50)
+    """Credit history, newest first, from the local ledger:
+    ?page=&limit=&from=&to=&type=&character= (from inclusive, to exclusive;
+    ISO dates, UTC unless they carry a zone, or epoch seconds)"""
+    if not _synced_ledger():
+        return jsonify({"error": "Not logged in"}), 401
+    page = max(1, request.args.get("page", 1, type=int))
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
     try:
-        resp = http_requests.get(
-            f"{API_BASE_URL}/api/v1/credits/transactions",
-            headers=get_auth_header(),
-            params={"page": page, "limit": limit},
-            timeout=10,
-        )
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.get(
-                    f"{API_BASE_URL}/api/v1/credits/transactions",
-                    headers=get_auth_header(),
-                    params={"page": page, "limit": limit},
-                    timeout=10,
-                )
-        return jsonify(resp.json()), resp.status_code
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        result = ledger.query(limit=limit, offset=(page - 1) * limit, **_ledger_filters())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({**result, "page": page, "limit": limit, "ledger": ledger.stats()})
+
+
+@app.route("/api/transactions/summary", methods=["GET"])
+def transactions_summary():
+    """Counts and credits in/out per ?group=day|month|type|character, with the
+    same filters as /api/transactions."""
+    if not _synced_ledger():
+        return jsonify({"error": "Not logged in"}), 401
+    group = request.args.get("group", "day")
+    try:
+        groups = ledger.summary(group, **_ledger_filters())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"group": group, "groups": groups, "ledger": ledger.stats()})
 
 
 # ──────────────────────────────────────────────
@@ -274,8 +510,7 @@ def transactions():
 @app.route("/api/bundles", methods=["GET"])
 def bundles():
     try:
-        resp = http_requests.get(f"{API_BASE_URL}/api/v1/payments/bundles", timeout=10)
-        return jsonify(resp.json()), resp.status_code
+        return _cached_upstream_json("bundles", "/api/v1/payments/bundles", auth=False)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -284,21 +519,13 @@ def bundles():
 def checkout():
     body = request.json or {}
     try:
-        resp = http_requests.post(
-            f"{API_BASE_URL}/api/v1/payments/checkout",
-            headers=get_auth_header(),
+        resp = upstream.post(
+            "/api/v1/payments/checkout",
+            endpoint="checkout",
             json={"bundle_id": body.get("bundle_id")},
-            timeout=15,
         )
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.post(
-                    f"{API_BASE_URL}/api/v1/payments/checkout",
-                    headers=get_auth_header(),
-                    json={"bundle_id": body.get("bundle_id")},
-                    timeout=15,
-                )
-        return jsonify(resp.json()), resp.status_code
+        _invalidate_balance()
+        return _relay(resp)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -306,19 +533,9 @@ def checkout():
 @app.route("/api/payment-status/<int:payment_id>", methods=["GET"])
 def payment_status(payment_id):
     try:
-        resp = http_requests.get(
-            f"{API_BASE_URL}/api/v1/payments/status/{payment_id}",
-            headers=get_auth_header(),
-            timeout=10,
-        )
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.get(
-                    f"{API_BASE_URL}/api/v1/payments/status/{payment_id}",
-                    headers=get_auth_header(),
-                    timeout=10,
-                )
-        return jsonify(resp.json()), resp.status_code
+        resp = upstream.get(f"/api/v1/payments/status/{payment_id}", endpoint="payment_status")
+        _invalidate_balance()  # a completed payment adds credits
+        return _relay(resp)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -327,128 +544,168 @@ def payment_status(payment_id):
 # Routes — Characters (local storage)
 # ──────────────────────────────────────────────
 
-def _load_characters():
-    """Load characters registry from disk."""
-    reg = CHARACTERS_DIR / "registry.json"
-    if reg.exists():
-        try:
-            with open(reg, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            pass
-    return {"characters": []}
+def _character_folder_changed(folder):
+    """A character's files changed on disk: drop cached payloads, re-index features."""
+    ref_cache.invalidate_dir(folder)
+    ref_selector.schedule(folder.name)
 
 
-def _save_characters(data):
-    """Save characters registry to disk."""
-    CHARACTERS_DIR.mkdir(exist_ok=True)
-    with open(CHARACTERS_DIR / "registry.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def _download_character_images(slug, reference_urls, on_file=None):
+    """Download reference images to characters/<slug>/ folder in parallel.
+    Returns (list of filenames, per-file report)."""
+    report = download_references(upstream, reference_urls, CHARACTERS_DIR / slug, on_file=on_file)
+    failed = [r for r in report if not r["ok"]]
+    if failed:
+        log.warning("[DOWNLOAD] %s: %d/%d reference downloads failed", slug, len(failed), len(report))
+    return [r["filename"] for r in report if r["ok"]], report
 
 
-def _scan_character_folders():
-    """Scan characters/ for manually added folders and register them.
-    
-    Detects subfolders that contain image files but aren't in registry.json,
-    and adds them automatically. Also refreshes local_files for existing entries.
-    """
-    if not CHARACTERS_DIR.exists():
-        return
-    
-    IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp'}
-    data = _load_characters()
-    chars = data.get("characters", [])
-    known_slugs = {c.get("slug") for c in chars}
-    changed = False
-
-    for entry in CHARACTERS_DIR.iterdir():
-        if not entry.is_dir():
-            continue
-        slug = entry.name
-        if slug.startswith('.') or slug == '__pycache__':
-            continue
-
-        # Gather image files in this folder
-        image_files = sorted([
-            f.name for f in entry.iterdir()
-            if f.is_file() and f.suffix.lower() in IMAGE_EXTS
-        ])
-
-        if not image_files:
-            continue  # empty folder — skip
-
-        if slug not in known_slugs:
-            # New manually-added folder — register it
-            display_name = slug.replace('-', ' ').replace('_', ' ').title()
-            print(f"[SCAN] Found new character folder: {slug} ({len(image_files)} images)")
-            char_entry = {
-                "name": display_name,
-                "slug": slug,
-                "seed_url": "",
-                "reference_urls": [],  # no remote URLs for manual imports
-                "local_files": image_files,
-                "reference_count": len(image_files),
-                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-                "local_dir": str(CHARACTERS_DIR / slug),
-            }
-            chars.append(char_entry)
-            known_slugs.add(slug)
-            changed = True
-        else:
-            # Existing entry — refresh local_files in case user added/removed images
-            for c in chars:
-                if c.get("slug") == slug:
-                    old_files = c.get("local_files", [])
-                    if sorted(old_files) != sorted(image_files):
-                        print(f"[SCAN] Updated files for {slug}: {len(old_files)} → {len(image_files)}")
-                        c["local_files"] = image_files
-                        c["reference_count"] = max(len(image_files), len(c.get("reference_urls", [])))
-                        changed = True
-                    break
-
-    if changed:
-        data["characters"] = chars
-        _save_characters(data)
-
-
-def _download_character_images(slug, reference_urls):
-    """Download reference images to characters/<slug>/ folder. Returns list of filenames."""
-    char_dir = CHARACTERS_DIR / slug
-    char_dir.mkdir(parents=True, exist_ok=True)
-    local_files = []
-    for i, url in enumerate(reference_urls):
-        try:
-            resp = http_requests.get(url, timeout=60, stream=True)
-            if resp.status_code == 200:
-                ct = resp.headers.get('content-type', '')
-                ext = '.png'
-                if 'jpeg' in ct or 'jpg' in ct:
-                    ext = '.jpg'
-                elif 'webp' in ct:
-                    ext = '.webp'
-                filename = f"ref_{i+1:02d}{ext}"
-                filepath = char_dir / filename
-                with open(filepath, 'wb') as f:
-                    for chunk in resp.iter_content(8192):
-                        f.write(chunk)
-                local_files.append(filename)
-        except Exception:
-            pass
-    return local_files
+def _character_download_job(job, slug, reference_urls):
+    """Background job: download a new character's references, then mark it ready."""
+    finished = []
+
+    def on_file(report):
+        finished.append(report)
+        job.set_progress(done=len(finished), total=len(reference_urls),
+                         failed=sum(1 for r in finished if not r["ok"]))
+
+    job.set_progress(done=0, total=len(reference_urls), failed=0)
+    try:
+        local_files, report = _download_character_images(slug, reference_urls, on_file=on_file)
+    except Exception:
+        registry.update(slug, status="failed")
+        raise
+    char = registry.update(slug, local_files=local_files, status="ready")
+    ref_cache.invalidate_dir(CHARACTERS_DIR / slug)
+    ref_selector.index(slug, local_files)
+    if char:
+        _warm_character_refs(char)
+    return {"character": char, "downloads": report}
+
+
+CHARACTER_PAGE_MAX = 500
+
+
+def _image_version(slug, filename):
+    """Cache-busting `v=` for a character image: changes whenever the file is
+    replaced or edited, even under the same name ("" if it is missing)."""
+    try:
+        st = (CHARACTERS_DIR / slug / filename).stat()
+    except OSError:
+        return ""
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def _character_thumbnail(char):
+    """URL of the card image: a resized local reference, else the first remote one."""
+    local = char.get("local_files") or []
+    if local:
+        params = urlencode({"w": 256, "fmt": "webp", "v": _image_version(char["slug"], local[0])})
+        return f"/api/characters/{quote(char['slug'], safe='')}/images/{quote(local[0], safe='')}?{params}"
+    refs = char.get("reference_urls") or []
+    return refs[0] if refs else (char.get("seed_url") or "")
+
+
+# Computed fields a listing can select instead of the full lists they summarise
+CHARACTER_DERIVED_FIELDS = {
+    "thumbnail": _character_thumbnail,
+    "local_count": lambda c: len(c.get("local_files") or []),
+    "remote_count": lambda c: len(c.get("reference_urls") or []),
+}
 
 
 @app.route("/api/characters", methods=["GET"])
 def list_characters():
-    _scan_character_folders()  # auto-detect manually added folders
-    return jsonify(_load_characters())
+    """The registry: ?limit=&cursor=&sort=name|-created_at|reference_count&fields=slug,name,thumbnail
+    Without parameters every entry is returned in full. Revalidates against the
+    registry version, and the image versions in thumbnail URLs when those are
+    selected (304 while nothing changed)."""
+    registry.scan()  # auto-detect manually added folders (changed folders only)
+    etag = f"{registry.instance}-{registry.version}"
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    if "thumbnail" not in fields and request.if_none_match.contains_weak(etag):
+        return _not_modified(etag)
+
+    limit = request.args.get("limit", type=int)
+    if limit is not None:
+        limit = max(1, min(limit, CHARACTER_PAGE_MAX))
+    try:
+        page = registry.page(limit=limit, cursor=request.args.get("cursor"), sort=request.args.get("sort"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if fields:
+        page["characters"] = [
+            {f: CHARACTER_DERIVED_FIELDS[f](c) if f in CHARACTER_DERIVED_FIELDS else c[f]
+             for f in fields if f in CHARACTER_DERIVED_FIELDS or f in c}
+            for c in page["characters"]
+        ]
+    if "thumbnail" in fields:
+        # An image replaced under the same name changes its URL but not the registry
+        thumbs = "\n".join(c.get("thumbnail", "") for c in page["characters"])
+        etag += f"-{zlib.crc32(thumbs.encode()):08x}"
+        if request.if_none_match.contains_weak(etag):
+            return _not_modified(etag)
+
+    resp = jsonify(page)
+    resp.set_etag(etag, weak=True)
+    resp.cache_control.no_cache = True
+    return resp
+
+
+def _not_modified(etag):
+    resp = Response(status=304)
+    resp.set_etag(etag, weak=True)
+    return resp
 
 
 @app.route("/api/characters/rescan", methods=["POST"])
 def rescan_characters():
     """Force rescan of characters/ folder and return updated list."""
-    _scan_character_folders()
-    data = _load_characters()
-    return jsonify({"success": True, "characters": data.get("characters", []), "count": len(data.get("characters", []))})
+    registry.scan(force=True)
+    chars = registry.all()
+    return jsonify({"success": True, "characters": chars, "count": len(chars)})
+
+
+@app.route("/api/characters/export", methods=["GET"])
+def export_characters():
+    """Download characters as a pack: ?slugs=a,b (default: all) &format=zip|tar.
+    The archive is written while it is sent (see packs.py)."""
+    fmt = request.args.get("format", "zip")
+    if fmt not in PACK_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(PACK_FORMATS)}"}), 400
+    registry.scan()
+    slugs = [s for s in request.args.get("slugs", "").split(",") if s]
+    if slugs:
+        entries = [registry.get(s) for s in slugs]
+        missing = [s for s, c in zip(slugs, entries) if c is None]
+        if missing:
+            return jsonify({"error": f"unknown characters: {', '.join(missing)}"}), 404
+    else:
+        entries = registry.all()
+    log.info("[PACK] Exporting %d characters (%s)", len(entries), fmt)
+    resp = Response(stream_with_context(export_pack(CHARACTERS_DIR, entries, fmt)),
+                    mimetype=PACK_FORMATS[fmt])
+    filename = f"characters-{time.strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return resp
+
+
+@app.route("/api/characters/import", methods=["POST"])
+def import_characters():
+    """Import a pack sent as the raw request body (zip or tar, optionally
+    gzipped). ?on_conflict=skip (default) keeps characters that already exist,
+    ?on_conflict=replace takes the pack's version."""
+    request.max_content_length = MAX_PACK_BYTES
+    try:
+        report = pack_importer.import_pack(request.stream, request.args.get("on_conflict", "skip"))
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Pack too large (max {MAX_PACK_BYTES // (1024 * 1024)} MB)"}), 413
+    except PackError as e:
+        return jsonify({"error": str(e)}), 400
+    log.info("[PACK] Imported %d characters (%d skipped): %d files written, %d unchanged",
+             len(report["imported"]), len(report["skipped"]), report["files_written"],
+             report["files_unchanged"])
+    return jsonify({"success": True, **report})
 
 
 @app.route("/api/characters", methods=["POST"])
@@ -463,56 +720,78 @@ def create_character_entry():
     seed_url = body.get("seed_url", "")
     reference_urls = body.get("reference_urls", [])
 
-    # Download images locally
-    local_files = _download_character_images(slug, reference_urls)
-
-    data = _load_characters()
-    chars = data.get("characters", [])
-    chars = [c for c in chars if c.get("slug") != slug]
+    # Register right away; references are downloaded by a background job
     char_entry = {
         "name": name,
         "slug": slug,
         "seed_url": seed_url,
         "reference_urls": reference_urls,
-        "local_files": local_files,
+        "local_files": [],
         "reference_count": len(reference_urls),
         "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "local_dir": str(CHARACTERS_DIR / slug),
+        "status": "downloading",
     }
-    chars.append(char_entry)
-    data["characters"] = chars
-    _save_characters(data)
-    return jsonify({"success": True, "character": char_entry}), 201
+    registry.upsert(char_entry)
+
+    job = jobs.submit("character_download", _character_download_job, slug, reference_urls,
+                      meta={"slug": slug})
+    return jsonify({"success": True, "character": char_entry, "job": job.to_dict()}), 202
 
 
 @app.route("/api/characters/<slug>", methods=["GET"])
 def get_character(slug):
-    data = _load_characters()
-    for c in data.get("characters", []):
-        if c.get("slug") == slug:
-            return jsonify(c)
+    """One registry entry, plus `image_versions` ({filename: v}) for building
+    cacheable image URLs."""
+    char = registry.get(slug)
+    if char:
+        versions = {f: _image_version(slug, f) for f in char.get("local_files") or []}
+        return jsonify({**char, "image_versions": versions})
     return jsonify({"error": "not found"}), 404
 
 
 @app.route("/api/characters/<slug>", methods=["DELETE"])
 def delete_character_entry(slug):
-    data = _load_characters()
-    data["characters"] = [c for c in data.get("characters", []) if c.get("slug") != slug]
-    _save_characters(data)
+    registry.delete(slug)
     # Remove local image folder
     char_dir = CHARACTERS_DIR / slug
     if char_dir.exists():
         shutil.rmtree(char_dir, ignore_errors=True)
+    ref_cache.invalidate_dir(char_dir)
+    thumbnails.invalidate(slug)
+    ref_selector.forget(slug)
     return jsonify({"success": True})
 
 
+@app.route("/api/characters/<slug>/warm", methods=["POST"])
+def warm_character(slug):
+    """Pre-encode a character's references in the background (called on select)."""
+    char = registry.get(slug)
+    if not char:
+        return jsonify({"error": "not found"}), 404
+    _warm_character_refs(char)
+    return jsonify({"success": True}), 202
+
+
 @app.route("/api/characters/<slug>/images/<filename>")
 def serve_character_image(slug, filename):
-    """Serve locally stored reference images."""
-    char_dir = CHARACTERS_DIR / slug
-    if not char_dir.exists():
+    """Serve locally stored reference images.
+
+    `?w=256&fmt=webp` returns a resized copy from the thumbnail cache instead of
+    the original. Responses carry ETag/Last-Modified and support Range requests;
+    `?v=` marks a versioned URL that the browser may cache for a day.
+    """
+    path = safe_join(str(CHARACTERS_DIR), slug, filename)
+    if path is None or not os.path.isfile(path):
         return jsonify({"error": "not found"}), 404
-    return send_from_directory(str(char_dir), filename)
+    max_age = 86400 if request.args.get("v") else 60
+
+    width = request.args.get("w", type=int)
+    if width and width > 0:
+        thumb = thumbnails.get(slug, Path(path), width, request.args.get("fmt", "webp"))
+        if thumb:
+            return send_file(thumb[0], mimetype=thumb[1], conditional=True, max_age=max_age)
+    return send_file(path, conditional=True, max_age=max_age)
 
 
 @app.route("/api/characters/<slug>/open-folder", methods=["POST"])
@@ -533,51 +812,108 @@ def open_character_folder(slug):
     return jsonify({"error": "folder not found", "path": str(char_dir)}), 404
 
 
+# ──────────────────────────────────────────────
+# Routes — Background jobs
+# ──────────────────────────────────────────────
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    """A finished job's result: 202 while it is still running, 502 if it failed.
+    Jobs that wrap an API call return that call's body and status code."""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    if not job.done:
+        return jsonify({"state": job.state, "progress": job.progress}), 202
+    if job.state == "failed":
+        return jsonify({"error": job.error or "job failed"}), 502
+    result = job.result
+    if isinstance(result, dict) and "status_code" in result:
+        return jsonify(result["data"]), result["status_code"]
+    return jsonify(result)
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Server-Sent Events stream of a job's progress; ends when the job finishes."""
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "not found"}), 404
+
+    def stream():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"event: job\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.done:
+                    return
+            if jobs.wait_for_change(job, version, timeout=15) == version:
+                yield ": keep-alive\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # ──────────────────────────────────────────────
 # Routes — Image Generation
 # ──────────────────────────────────────────────
 
 
-def _get_local_refs_as_base64(slug, max_refs=8):
-    """Read local reference images for a character and return as base64 data URIs.
-    Aggressively compresses images to keep payload small and avoid API failures.
-    max_refs=8 to keep total payload under ~10MB."""
-    import base64 as b64mod
-    data = _load_characters()
-    char = None
-    for c in data.get("characters", []):
-        if c.get("slug") == slug:
-            char = c
-            break
-    if not char:
-        return []
+REF_MAX_BYTES = 1_000_000  # compress each reference to max 1MB to keep payload small
+REF_MAX_COUNT = 8          # keeps total payload under ~10MB
 
-    local_files = char.get("local_files", [])
-    if not local_files:
-        return []
 
+def _encode_ref_file(fpath, max_bytes=REF_MAX_BYTES):
+    """Read one reference image and return it as a compressed base64 data URI."""
     MIME_MAP = {
         '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
         '.webp': 'image/webp', '.gif': 'image/gif', '.bmp': 'image/bmp',
     }
+    mime = MIME_MAP.get(Path(fpath).suffix.lower(), 'image/png')
+    return _compress_image_bytes(Path(fpath).read_bytes(), mime, max_bytes=max_bytes)
+
+
+def _ref_paths(char, max_refs=REF_MAX_COUNT):
+    """Paths of the reference files that would be uploaded for a character:
+    the (up to) `max_refs` most distinct ones, see refselect.py."""
+    slug = char.get("slug", "")
     char_dir = CHARACTERS_DIR / slug
+    paths = [char_dir / fname for fname in ref_selector.select(slug, char.get("local_files", []), max_refs)]
+    return [p for p in paths if p.is_file()]
+
+
+def _warm_character_refs(char):
+    """Encode a character's references into the cache on a background thread."""
+    ref_cache.warm(_ref_paths(char), REF_MAX_BYTES, _encode_ref_file)
+
+
+def _get_local_refs_as_base64(slug, max_refs=REF_MAX_COUNT):
+    """Read local reference images for a character and return as base64 data URIs.
+    Aggressively compresses images to keep payload small and avoid API failures.
+    Encoded payloads are served from `ref_cache` when the files are unchanged."""
+    char = registry.get(slug)
+    if not char or not char.get("local_files"):
+        return []
+
     result = []
-    for fname in local_files[:max_refs]:
-        fpath = char_dir / fname
-        if not fpath.is_file():
-            continue
-        ext = fpath.suffix.lower()
-        mime = MIME_MAP.get(ext, 'image/png')
+    for fpath in _ref_paths(char, max_refs):
         try:
-            raw = fpath.read_bytes()
-            b64 = b64mod.b64encode(raw).decode('ascii')
-            data_uri = f"data:{mime};base64,{b64}"
-            # Compress to max 1MB per image to keep payload small
-            data_uri = _compress_base64_image(data_uri, max_bytes=1_000_000)
-            result.append(data_uri)
+            result.append(ref_cache.get(fpath, REF_MAX_BYTES, lambda p=fpath: _encode_ref_file(p)))
         except Exception as e:
-            print(f"[BASE64] Error reading {fpath}: {e}")
-    print(f"[BASE64] Converted {len(result)} local images for character '{slug}' (max {max_refs})")
+            log.warning("[BASE64] Error reading %s: %s", fpath, e)
+    log.debug("[BASE64] Prepared %d local images for character '%s' (max %d)", len(result), slug, max_refs)
     return result
 
 
@@ -585,43 +921,22 @@ def _get_local_refs_as_base64(slug, max_refs=8):
 def generate_seed():
     body = request.json or {}
     try:
-        resp = http_requests.post(
-            f"{API_BASE_URL}/api/v1/generate/seed",
-            headers=get_auth_header(),
+        resp = upstream.post(
+            "/api/v1/generate/seed",
+            endpoint="seed",
             json={
                 "prompt": body.get("prompt", ""),
                 "aspect_ratio": body.get("aspect_ratio", "1:1"),
             },
-            timeout=60,
         )
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.post(
-                    f"{API_BASE_URL}/api/v1/generate/seed",
-                    headers=get_auth_header(),
-                    json={
-                        "prompt": body.get("prompt", ""),
-                        "aspect_ratio": body.get("aspect_ratio", "1:1"),
-                    },
-                    timeout=60,
-                )
-        # Pass through 402 (insufficient credits) and 429 (rate limit)
-        if resp.status_code in (402, 429):
-            try:
-                return jsonify(resp.json()), resp.status_code
-            except Exception:
-                return jsonify({"error": f"HTTP {resp.status_code}"}), resp.status_code
-        try:
-            return jsonify(resp.json()), resp.status_code
-        except Exception:
-            return jsonify({"error": f"API returned non-JSON (HTTP {resp.status_code})"}), 502
+        return _relay_generation(resp, "seed", prompt=body.get("prompt"))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/generate/create", methods=["POST"])
 def generate_create():
-    body = request.json or {}
+    body = _json_body()
     ref_urls = body.get("reference_image_urls", [])
     char_slug = body.get("character_slug", "")
     uses_base64 = False
@@ -632,42 +947,30 @@ def generate_create():
         if not ref_urls:
             return jsonify({"error": "Character has no reference images (local or remote)"}), 400
     timeout = 120 if uses_base64 else 60  # more time for large base64 payloads
+    try:
+        input_image_url = _input_image_url(body)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
     try:
         payload = {
             "prompt": body.get("prompt", ""),
             "reference_image_urls": ref_urls,
-            "input_image_url": body.get("input_image_url", None),
+            "input_image_url": input_image_url,
         }
-        resp = http_requests.post(
-            f"{API_BASE_URL}/api/v1/generate/create",
-            headers=get_auth_header(),
-            json=payload,
+        resp = upstream.post(
+            "/api/v1/generate/create",
+            endpoint="create",
+            data=StreamingJSON(payload),  # serialised while uploading
             timeout=timeout,
         )
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.post(
-                    f"{API_BASE_URL}/api/v1/generate/create",
-                    headers=get_auth_header(),
-                    json=payload,
-                    timeout=timeout,
-                )
-        if resp.status_code in (402, 429):
-            try:
-                return jsonify(resp.json()), resp.status_code
-            except Exception:
-                return jsonify({"error": f"HTTP {resp.status_code}"}), resp.status_code
-        try:
-            return jsonify(resp.json()), resp.status_code
-        except Exception:
-            return jsonify({"error": f"API returned non-JSON (HTTP {resp.status_code})"}), 502
+        return _relay_generation(resp, "create", character=char_slug, prompt=payload["prompt"])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/generate/random", methods=["POST"])
 def generate_random():
-    body = request.json or {}
+    body = _json_body()
     ref_urls = body.get("reference_image_urls", [])
     char_slug = body.get("character_slug", "")
     uses_base64 = False
@@ -682,158 +985,312 @@ def generate_random():
             "reference_image_urls": ref_urls,
             "character_description": body.get("character_description", ""),
         }
-        resp = http_requests.post(
-            f"{API_BASE_URL}/api/v1/generate/random",
-            headers=get_auth_header(),
-            json=payload,
+        resp = upstream.post(
+            "/api/v1/generate/random",
+            endpoint="random",
+            data=StreamingJSON(payload),
             timeout=timeout,
         )
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.post(
-                    f"{API_BASE_URL}/api/v1/generate/random",
-                    headers=get_auth_header(),
-                    json=payload,
-                    timeout=timeout,
-                )
-        if resp.status_code in (402, 429):
-            try:
-                return jsonify(resp.json()), resp.status_code
-            except Exception:
-                return jsonify({"error": f"HTTP {resp.status_code}"}), resp.status_code
-        try:
-            return jsonify(resp.json()), resp.status_code
-        except Exception:
-            return jsonify({"error": f"API returned non-JSON (HTTP {resp.status_code})"}), 502
+        return _relay_generation(resp, "random", character=char_slug,
+                                 prompt=payload["character_description"])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _compress_image_bytes(img_bytes: bytes, mime: str, max_bytes: int = 4_000_000) -> str:
+    """Compress raw image bytes if they're over `max_bytes`. Returns a data URL."""
+    import base64 as b64mod
+    size = len(img_bytes)
+    try:
+        out, out_mime, timings = compressor.compress(img_bytes, max_bytes)
+        if timings:
+            log.info("[COMPRESS] %.1f MB → %d bytes (quality=%s, decode %sms, resize %sms, "
+                     "encode %sms ×%s, total %sms)", size / 1024 / 1024, len(out), timings["quality"],
+                     timings["decode"], timings["resize"], timings["encode"], timings["encodes"], timings["wall"])
+        img_bytes, mime = out, out_mime or mime
+    except ImportError:
+        log.warning("[COMPRESS] PIL not available, sending as-is (may be too large)")
+    except Exception as e:
+        log.warning("[COMPRESS] Error: %s", e)
+    return f"data:{mime};base64,{b64mod.b64encode(img_bytes).decode('ascii')}"
+
+
 def _compress_base64_image(data_url: str, max_bytes: int = 4_000_000) -> str:
     """If the base64 image is too large, compress it. Returns data URL."""
     import base64 as b64mod
     try:
         header, b64data = data_url.split(",", 1)
         img_bytes = b64mod.b64decode(b64data)
-        size = len(img_bytes)
-        print(f"[COMPRESS] Image size: {size} bytes ({size/1024/1024:.1f} MB)")
-        if size <= max_bytes:
-            return data_url  # no compression needed
-
-        # Compress using PIL if available
-        try:
-            from PIL import Image
-            import io
-            img = Image.open(io.BytesIO(img_bytes))
-            # Resize if very large
-            max_dim = 2048
-            if max(img.size) > max_dim:
-                img.thumbnail((max_dim, max_dim), Image.LANCZOS)
-                print(f"[COMPRESS] Resized to {img.size}")
-            # Save as JPEG with quality reduction
-            buf = io.BytesIO()
-            img = img.convert("RGB")
-            quality = 85
-            img.save(buf, format="JPEG", quality=quality)
-            while buf.tell() > max_bytes and quality > 30:
-                quality -= 10
-                buf = io.BytesIO()
-                img.save(buf, format="JPEG", quality=quality)
-            compressed = buf.getvalue()
-            print(f"[COMPRESS] Compressed: {len(compressed)} bytes (quality={quality})")
-            b64 = b64mod.b64encode(compressed).decode()
-            return f"data:image/jpeg;base64,{b64}"
-        except ImportError:
-            print("[COMPRESS] PIL not available, sending as-is (may be too large)")
-            return data_url
     except Exception as e:
-        print(f"[COMPRESS] Error: {e}")
+        log.warning("[COMPRESS] Error: %s", e)
         return data_url
+    log.debug("[COMPRESS] Image size: %d bytes (%.1f MB)", len(img_bytes), len(img_bytes) / 1024 / 1024)
+    if len(img_bytes) <= max_bytes:
+        return data_url  # no compression needed
+    mime = header.removeprefix("data:").split(";")[0] or "image/png"
+    return _compress_image_bytes(img_bytes, mime, max_bytes=max_bytes)
+
+
+def _input_image_url(body):
+    """`input_image_url` for create: an uploaded seed when `input_image_handle`
+    is given. Raises LookupError for an unknown handle."""
+    handle = body.get("input_image_handle")
+    if not handle:
+        return body.get("input_image_url")
+    url = seeds.data_url(handle)
+    if url is None:
+        raise LookupError("Unknown seed handle — upload the image again")
+    return url
+
+
+@app.route("/api/seeds", methods=["POST"])
+def upload_seed():
+    """Upload a seed image as multipart/form-data (field "seed"). The file is
+    spooled to disk and hashed while it streams in; the response's `handle`
+    goes in turnaround's `seed_handle` or create's `input_image_handle`."""
+    spools = []
+
+    def stream_factory(*_args, **_kwargs):
+        spool = seeds.spool()
+        spools.append(spool)
+        return spool
+
+    try:
+        _, _, files = parse_form_data(request.environ, stream_factory=stream_factory,
+                                      max_content_length=MAX_BODY_BYTES, silent=False)
+        upload = files.get("seed")
+        if upload is None:
+            return jsonify({"error": "Multipart field 'seed' required"}), 400
+        info = seeds.ingest(upload.stream, upload.filename)
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return body_too_large(None)
+    except UnreadableImage as e:
+        return jsonify({"error": str(e)}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 415
+    finally:
+        for spool in spools:
+            spool.discard()
+    log.info("[SEED] %s… %s (%d bytes)", info["handle"][:8],
+             "already stored" if info["deduplicated"] else "stored", info["bytes"])
+    return jsonify({"success": True, **info})
+
+
+TURNAROUND_MAX_ATTEMPTS = 5
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+
+def _retry_or_fail(job, reason, max_attempts, tag, resp=None):
+    """Raise RetryLater with exponential backoff (at least the response's
+    Retry-After), or RuntimeError once the job has used `max_attempts`."""
+    if job.attempts >= max_attempts:
+        raise RuntimeError(f"{reason} — gave up after {job.attempts} attempts")
+    delay = backoff_delay(job.attempts)
+    if resp is not None:
+        try:
+            delay = max(delay, float(resp.headers.get("Retry-After", "")))
+        except ValueError:
+            pass
+    log.info("[%s] %s — retrying in %.0fs (attempt %d/%d)", tag, reason, delay, job.attempts, max_attempts)
+    raise RetryLater(delay, reason)
+
+
+def _turnaround_job(job, payload):
+    """Background job: submit a turnaround, retrying gateway errors, timeouts and
+    non-JSON responses with exponential backoff. Waits between attempts are
+    timers in the job manager, not sleeping worker threads."""
+    attempt = job.attempts
+    job.set_progress(attempt=attempt, max_attempts=TURNAROUND_MAX_ATTEMPTS)
+
+    def retry(reason, resp=None):
+        _retry_or_fail(job, reason, TURNAROUND_MAX_ATTEMPTS, "TURNAROUND", resp)
+
+    try:
+        resp = upstream.post(
+            "/api/v1/generate/turnaround",
+            endpoint="turnaround",
+            data=StreamingJSON(payload),
+        )
+    except http_requests.exceptions.Timeout:
+        retry("API request timed out")
+    except http_requests.exceptions.RequestException as e:
+        retry(f"Request failed: {e}")
+    _invalidate_balance()
+    log.info("[TURNAROUND] Attempt %d — API response status: %d", attempt, resp.status_code)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("[TURNAROUND] API response body: %s", resp.text[:500])
+
+    # Gateway errors / rate limits are the API being overloaded, not a real failure
+    if resp.status_code in RETRYABLE_STATUSES:
+        retry(f"Got HTTP {resp.status_code}", resp)
+    try:
+        data = resp.json()
+    except ValueError:
+        retry(f"API returned non-JSON response (HTTP {resp.status_code})")
+    if resp.ok:
+        _note_generations(data, "turnaround")
+    return {"status_code": resp.status_code, "data": data}
 
 
 @app.route("/api/generate/turnaround", methods=["POST"])
 def generate_turnaround():
-    body = request.json or {}
-    seed_url = body.get("seed_image_url", "")
+    """Queue a turnaround submission. Returns 202 with a job; follow it via
+    /api/jobs/<id> (or /events) and read the API response from /api/jobs/<id>/result."""
+    body = _json_body()
+    seed_url = body.pop("seed_image_url", "")  # only one reference to the (large) data URL
+    seed_handle = body.get("seed_handle")
     prompts = body.get("prompts", [])
     ref_urls = body.get("reference_image_urls", [])
 
-    print(f"[TURNAROUND] seed_image_url length: {len(seed_url)}, starts_with: {seed_url[:80] if seed_url else '(empty)'}")
-    print(f"[TURNAROUND] prompts count: {len(prompts)}, ref_urls count: {len(ref_urls)}")
-
-    # API accepts base64 data URLs directly — no external hosting needed
-    # Just compress if over 4MB
-    if seed_url.startswith("data:"):
-        print("[TURNAROUND] Detected base64 seed image — checking size...")
+    log.debug("[TURNAROUND] seed_image_url length: %d, starts_with: %s",
+              len(seed_url), seed_url[:80] if seed_url else "(empty)")
+    log.debug("[TURNAROUND] prompts count: %d, ref_urls count: %d", len(prompts), len(ref_urls))
+
+    # API accepts base64 data URLs directly — no external hosting needed.
+    # An uploaded seed (POST /api/seeds) was already compressed when it arrived;
+    # an inline one is compressed here if over 4MB
+    if seed_handle:
+        seed_url = seeds.data_url(seed_handle)
+        if seed_url is None:
+            return jsonify({"error": "Unknown seed handle — upload the image again"}), 404
+    elif seed_url.startswith("data:"):
+        log.debug("[TURNAROUND] Detected base64 seed image — checking size...")
         seed_url = _compress_base64_image(seed_url)
-        print(f"[TURNAROUND] Final data URL length: {len(seed_url)} chars")
+        log.debug("[TURNAROUND] Final data URL length: %d chars", len(seed_url))
 
     payload = {
         "seed_image_url": seed_url,
         "prompts": prompts,
         "reference_image_urls": ref_urls,
     }
+    job = jobs.submit("turnaround", _turnaround_job, payload, meta={"prompts": len(prompts)})
+    return jsonify({"success": True, "job": job.to_dict()}), 202
 
-    # Retry logic for 502/504 gateway errors (API overloaded)
-    max_retries = 3
-    for attempt in range(1, max_retries + 1):
-        try:
-            resp = http_requests.post(
-                f"{API_BASE_URL}/api/v1/generate/turnaround",
-                headers=get_auth_header(),
-                json=payload,
-                timeout=180,
-            )
-            print(f"[TURNAROUND] Attempt {attempt} — API response status: {resp.status_code}")
-            print(f"[TURNAROUND] API response body: {resp.text[:500]}")
-
-            if resp.status_code == 401:
-                if auto_login():
-                    resp = http_requests.post(
-                        f"{API_BASE_URL}/api/v1/generate/turnaround",
-                        headers=get_auth_header(),
-                        json=payload,
-                        timeout=180,
-                    )
-                    print(f"[TURNAROUND] Retry-auth response status: {resp.status_code}")
-                    print(f"[TURNAROUND] Retry-auth response body: {resp.text[:500]}")
-
-            # Retry on 502/504 gateway errors (API gateway overloaded, not a real failure)
-            if resp.status_code in (502, 503, 504) and attempt < max_retries:
-                wait = attempt * 10  # 10s, 20s
-                print(f"[TURNAROUND] Got {resp.status_code} — retrying in {wait}s (attempt {attempt}/{max_retries})...")
-                time.sleep(wait)
-                continue
-
-            try:
-                return jsonify(resp.json()), resp.status_code
-            except Exception:
-                print(f"[TURNAROUND] Failed to parse JSON response: {resp.text[:500]}")
-                # On last attempt, return error; otherwise retry
-                if attempt < max_retries:
-                    wait = attempt * 10
-                    print(f"[TURNAROUND] Non-JSON response — retrying in {wait}s...")
-                    time.sleep(wait)
-                    continue
-                return jsonify({"error": f"API returned non-JSON response (HTTP {resp.status_code}): {resp.text[:200]}"}), 502
-
-        except http_requests.exceptions.Timeout:
-            print(f"[TURNAROUND] Timeout on attempt {attempt}/{max_retries}")
-            if attempt < max_retries:
-                wait = attempt * 10
-                print(f"[TURNAROUND] Retrying in {wait}s...")
-                time.sleep(wait)
-                continue
-            return jsonify({"error": "API request timed out after multiple retries"}), 504
 
-        except Exception as e:
-            print(f"[TURNAROUND] Exception on attempt {attempt}: {e}")
-            if attempt < max_retries:
-                time.sleep(5)
-                continue
-            return jsonify({"error": str(e)}), 500
+BATCH_MAX_PROMPTS = 500
+BATCH_MAX_ATTEMPTS = 5
+
 
-    return jsonify({"error": "All retry attempts failed"}), 502
+def _batch_item_job(job, batch, index, ref_urls):
+    """Background job: submit one prompt of a batch. `ref_urls` is the batch's
+    shared list of references, encoded once for all of its prompts."""
+    if batch.cancelled:
+        raise RuntimeError(batch.cancelled)
+    prompt = batch.prompts[index]
+
+    def retry(reason, resp=None):
+        _retry_or_fail(job, reason, BATCH_MAX_ATTEMPTS, "BATCH", resp)
+
+    payload = {"prompt": prompt, "reference_image_urls": ref_urls, "input_image_url": None}
+    try:
+        resp = upstream.post("/api/v1/generate/create", endpoint="create",
+                             data=StreamingJSON(payload), timeout=120)
+    except http_requests.exceptions.Timeout:
+        retry("API request timed out")
+    except http_requests.exceptions.RequestException as e:
+        retry(f"Request failed: {e}")
+    if resp.status_code in RETRYABLE_STATUSES:
+        retry(f"Got HTTP {resp.status_code}", resp)
+    _invalidate_balance()
+    try:
+        data = resp.json()
+    except ValueError:
+        retry(f"API returned non-JSON response (HTTP {resp.status_code})")
+    if resp.status_code == 402:
+        # Out of credits — don't submit the rest of the batch
+        batches.cancel(batch, "insufficient credits")
+    if not resp.ok:
+        error = data.get("error") if isinstance(data, dict) else None
+        raise RuntimeError(str(error or f"HTTP {resp.status_code}"))
+
+    _note_generations(data, "create", character=batch.character, prompt=prompt)
+    inner = data.get("data", data) if isinstance(data, dict) else {}
+    gid = inner.get("generation_id") or inner.get("id")
+    if not gid:
+        raise RuntimeError("API response has no generation_id")
+    poller.track([gid])
+    return {"generation_id": gid}
+
+
+@app.route("/api/generate/batch", methods=["POST"])
+def generate_batch():
+    """Queue one generation per prompt for a character: {character_slug, prompts: [...]}.
+    Returns 202 with a batch; follow it via /api/generate/batch/<id> (or /events)."""
+    body = _json_body()
+    char_slug = body.get("character_slug", "")
+    prompts = body.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        return jsonify({"error": "prompts must be a non-empty list"}), 400
+    prompts = [str(p).strip() for p in prompts]
+    if not all(prompts):
+        return jsonify({"error": "prompts must not be empty"}), 400
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return jsonify({"error": f"at most {BATCH_MAX_PROMPTS} prompts per batch"}), 400
+
+    ref_urls = body.get("reference_image_urls") or []
+    if not ref_urls:
+        if not registry.get(char_slug):
+            return jsonify({"error": "Character not found"}), 404
+        ref_urls = _get_local_refs_as_base64(char_slug)
+        if not ref_urls:
+            return jsonify({"error": "Character has no reference images (local or remote)"}), 400
+
+    batch = batches.submit(char_slug, prompts, _batch_item_job, ref_urls)
+    log.info("[BATCH] %s — %d prompts for '%s', %d references", batch.id[:8], len(prompts), char_slug, len(ref_urls))
+    return jsonify({"success": True, "batch": batches.to_dict(batch, items=False)}), 202
+
+
+@app.route("/api/generate/batch/<batch_id>", methods=["GET"])
+def get_batch(batch_id):
+    """A batch's aggregated progress plus per-item state, generation ID and status.
+    `?items=0` leaves out the per-item list."""
+    batch = batches.get(batch_id)
+    if not batch:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(batches.to_dict(batch, items=request.args.get("items") != "0"))
+
+
+@app.route("/api/generate/batch/<batch_id>", methods=["DELETE"])
+def cancel_batch(batch_id):
+    """Stop submitting a batch's remaining prompts."""
+    batch = batches.get(batch_id)
+    if not batch:
+        return jsonify({"error": "not found"}), 404
+    batches.cancel(batch)
+    return jsonify({"success": True, "batch": batches.to_dict(batch, items=False)})
+
+
+@app.route("/api/generate/batch/<batch_id>/events", methods=["GET"])
+def batch_events(batch_id):
+    """Server-Sent Events stream of a batch's progress; ends when every item is finished."""
+    batch = batches.get(batch_id)
+    if not batch:
+        return jsonify({"error": "not found"}), 404
+
+    def stream():
+        last = None
+        idle = 0.0
+        while True:
+            state = batches.to_dict(batch)
+            encoded = json.dumps(state)
+            if encoded != last:
+                last, idle = encoded, 0.0
+                yield f"event: batch\ndata: {encoded}\n\n"
+                if state["done"]:
+                    return
+            elif idle >= 15:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            # Generation status changes wake us early; submissions are picked up within a second
+            started = time.monotonic()
+            poller.wait_for_change(poller.version, timeout=1.0)
+            idle += time.monotonic() - started
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ──────────────────────────────────────────────
@@ -843,77 +1300,299 @@ def generate_turnaround():
 @app.route("/api/asset/status/<generation_id>", methods=["GET"])
 def asset_status(generation_id):
     try:
-        resp = http_requests.get(
-            f"{API_BASE_URL}/api/v1/asset/status/{generation_id}",
-            headers=get_auth_header(),
-            timeout=30,
-        )
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.get(
-                    f"{API_BASE_URL}/api/v1/asset/status/{generation_id}",
-                    headers=get_auth_header(),
-                    timeout=30,
-                )
+        resp = upstream.get(f"/api/v1/asset/status/{generation_id}", endpoint="status")
         # Pass 429 through to frontend for rate-limit backoff
         if resp.status_code == 429:
-            print(f"[STATUS] {generation_id[:8]}... RATE LIMITED (429)")
+            log.info("[STATUS] %s... RATE LIMITED (429)", generation_id[:8])
             return jsonify({"error": "rate_limited"}), 429
         try:
             data = resp.json()
         except Exception:
-            print(f"[STATUS] {generation_id[:8]}... non-JSON response (HTTP {resp.status_code}): {resp.text[:200]}")
+            log.warning("[STATUS] %s... non-JSON response (HTTP %d): %s", generation_id[:8], resp.status_code, resp.text[:200])
             # Return a temporary-error marker so JS knows to retry
             return jsonify({"data": {"status": "pending"}, "_retry": True}), 200
         inner = data.get('data', data)
         status = inner.get('status', '?')
-        print(f"[STATUS] {generation_id[:8]}... → {status}")
+        log.debug("[STATUS] %s... → %s", generation_id[:8], status)
         return jsonify(data), resp.status_code
     except http_requests.exceptions.Timeout:
-        print(f"[STATUS] {generation_id[:8]}... TIMEOUT")
+        log.warning("[STATUS] %s... TIMEOUT", generation_id[:8])
         return jsonify({"data": {"status": "pending"}, "_retry": True}), 200
     except Exception as e:
-        print(f"[STATUS] {generation_id[:8]}... ERROR: {e}")
+        log.warning("[STATUS] %s... ERROR: %s", generation_id[:8], e)
         return jsonify({"data": {"status": "pending"}, "_retry": True}), 200
 
 
 @app.route("/api/asset/download/<generation_id>", methods=["GET"])
 def asset_download(generation_id):
     try:
-        resp = http_requests.get(
-            f"{API_BASE_URL}/api/v1/asset/download/{generation_id}",
-            headers=get_auth_header(),
-            timeout=30,
-        )
-        if resp.status_code == 401:
-            if auto_login():
-                resp = http_requests.get(
-                    f"{API_BASE_URL}/api/v1/asset/download/{generation_id}",
-                    headers=get_auth_header(),
-                    timeout=30,
-                )
+        resp = upstream.get(f"/api/v1/asset/download/{generation_id}", endpoint="download")
         # Pass 429 (rate limit) and 409 (not ready) through to frontend
         if resp.status_code == 429:
-            print(f"[DOWNLOAD] {generation_id[:8]}... RATE LIMITED (429)")
+            log.info("[DOWNLOAD] %s... RATE LIMITED (429)", generation_id[:8])
             return jsonify({"error": "rate_limited"}), 429
         if resp.status_code == 409:
-            print(f"[DOWNLOAD] {generation_id[:8]}... NOT READY (409)")
+            log.debug("[DOWNLOAD] %s... NOT READY (409)", generation_id[:8])
             return jsonify({"error": "not_ready"}), 409
         try:
             data = resp.json()
         except Exception:
-            print(f"[DOWNLOAD] {generation_id[:8]}... non-JSON response (HTTP {resp.status_code}): {resp.text[:200]}")
+            log.warning("[DOWNLOAD] %s... non-JSON response (HTTP %d): %s", generation_id[:8], resp.status_code, resp.text[:200])
             return jsonify({"error": "temporary", "_retry": True}), 503
-        print(f"[DOWNLOAD] {generation_id[:8]}... → HTTP {resp.status_code}, body: {str(data)[:200]}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("[DOWNLOAD] %s... → HTTP %d, body: %s", generation_id[:8], resp.status_code, str(data)[:200])
+        if resp.status_code == 200 and isinstance(data, dict):
+            inner = data.get("data", data)
+            gallery.add(generation_id, inner.get("download_url") or inner.get("url"))
         return jsonify(data), resp.status_code
     except http_requests.exceptions.Timeout:
-        print(f"[DOWNLOAD] {generation_id[:8]}... TIMEOUT")
+        log.warning("[DOWNLOAD] %s... TIMEOUT", generation_id[:8])
         return jsonify({"error": "temporary", "_retry": True}), 503
     except Exception as e:
-        print(f"[DOWNLOAD] {generation_id[:8]}... ERROR: {e}")
+        log.warning("[DOWNLOAD] %s... ERROR: %s", generation_id[:8], e)
         return jsonify({"error": str(e), "_retry": True}), 503
 
 
+def _requested_ids():
+    """Generation IDs from a JSON body ({"ids": [...]}) or ?ids=a,b,c."""
+    if request.method == "POST":
+        ids = (request.json or {}).get("ids", [])
+    else:
+        ids = request.args.get("ids", "").split(",")
+    return [str(i).strip() for i in ids if str(i).strip()][:200]
+
+
+@app.route("/api/asset/status/batch", methods=["POST"])
+def asset_status_batch():
+    """Track a set of generation IDs server-side and return their current state."""
+    ids = _requested_ids()
+    if not ids:
+        return jsonify({"error": "ids required"}), 400
+    poller.track(ids)
+    return jsonify({"statuses": poller.snapshot(ids), "done": poller.all_terminal(ids)})
+
+
+@app.route("/api/asset/events", methods=["GET"])
+def asset_events():
+    """Server-Sent Events stream of status changes for ?ids=a,b,c.
+
+    Sends a `status` event with the full snapshot whenever any of the IDs
+    changes, and a final `done` event once every ID has completed or failed.
+    """
+    ids = _requested_ids()
+    if not ids:
+        return jsonify({"error": "ids required"}), 400
+    poller.track(ids)
+
+    def stream():
+        version = -1
+        while True:
+            current = poller.version
+            if current != version:
+                version = current
+                yield f"event: status\ndata: {json.dumps(poller.snapshot(ids))}\n\n"
+                if poller.all_terminal(ids):
+                    yield "event: done\ndata: {}\n\n"
+                    return
+            if poller.wait_for_change(version, timeout=15) == version:
+                yield ": keep-alive\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ──────────────────────────────────────────────
+# Routes — Gallery
+# ──────────────────────────────────────────────
+
+@app.route("/api/gallery", methods=["GET"])
+def list_gallery():
+    """One page of the gallery, newest first: ?limit=&cursor=&kind=&character=&q="""
+    limit = max(1, min(request.args.get("limit", 60, type=int), 200))
+    return jsonify(gallery.page(
+        limit=limit,
+        cursor=request.args.get("cursor"),
+        kind=request.args.get("kind"),
+        character=request.args.get("character"),
+        q=request.args.get("q"),
+    ))
+
+
+@app.route("/api/gallery", methods=["POST"])
+def add_to_gallery():
+    """Add generations to the gallery: {id, url} or {items: [{id, url, date}, ...]}
+    (the latter imports the old browser-side gallery)."""
+    body = request.json or {}
+    items = body.get("items") if isinstance(body.get("items"), list) else [body]
+    added = 0
+    for item in items[:1000]:
+        if isinstance(item, dict) and item.get("id") and item.get("url"):
+            gallery.add(str(item["id"]), str(item["url"]), created_at=item.get("date"))
+            added += 1
+    return jsonify({"success": True, "added": added}), 202
+
+
+@app.route("/api/gallery/<generation_id>", methods=["DELETE"])
+def delete_gallery_item(generation_id):
+    if not gallery.delete(generation_id):
+        return jsonify({"error": "not found"}), 404
+    return jsonify({"success": True})
+
+
+@app.route("/api/gallery", methods=["DELETE"])
+def clear_gallery():
+    gallery.clear()
+    return jsonify({"success": True})
+
+
+@app.route("/api/gallery/blobs/<sha256>", methods=["GET"])
+def serve_gallery_image(sha256):
+    """A mirrored image (or `?w=256&fmt=webp` thumbnail). Content-addressed, so immutable."""
+    if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+        return jsonify({"error": "not found"}), 404
+    found = gallery.open_blob(sha256, request.args.get("w", type=int), request.args.get("fmt", "webp"))
+    if found is None:
+        return jsonify({"error": "not found"}), 404
+    resp = send_file(found[0], mimetype=found[1], conditional=True, max_age=31536000)
+    resp.cache_control.immutable = True
+    return resp
+
+
+# ──────────────────────────────────────────────
+# Routes — Diagnostics
+# ──────────────────────────────────────────────
+
+@app.route("/api/upstream/stats", methods=["GET"])
+def upstream_stats():
+    """Per-endpoint call counts, latency and connection reuse for the shared client."""
+    return jsonify({**upstream.stats(), "poller": poller.stats(), "ref_cache": ref_cache.stats(),
+                    "thumbnails": thumbnails.stats(), "gallery": gallery.stats(),
+                    "compression": compressor.stats(), "ref_selection": ref_selector.stats(),
+                    "jobs": jobs.stats(), "batches": batches.stats(), "auth": credentials.stats(),
+                    "response_cache": response_cache.stats(), "static": assets.stats(),
+                    "ledger": ledger.stats(), "seeds": seeds.stats(), "packs": pack_importer.stats()})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text exposition of the request, upstream, job and cache metrics."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@REGISTRY.collector
+def _component_metrics():
+    """Read at scrape time from the counters the components already keep."""
+    refs, responses, thumbs = ref_cache.stats(), response_cache.stats(), thumbnails.stats()
+    yield ("cis_cache_hits_total", "counter", "Cache hits by cache",
+           [({"cache": "ref_payload"}, refs["hits"] + refs["disk_hits"]),
+            ({"cache": "response"}, responses["hits"] + responses["stale_hits"]),
+            ({"cache": "thumbnail"}, thumbs["hits"])])
+    yield ("cis_cache_misses_total", "counter", "Cache misses by cache",
+           [({"cache": "ref_payload"}, refs["misses"]),
+            ({"cache": "response"}, responses["misses"]),
+            ({"cache": "thumbnail"}, thumbs["rendered"])])
+    yield ("cis_jobs", "gauge", "Retained background jobs by executor and state",
+           [({"executor": name, "state": state}, count)
+            for name, counts in (("jobs", jobs.stats()), ("batch", batches.jobs.stats()))
+            for state, count in counts.items()])
+
+    up = upstream.stats()
+    admission, circuit = up["admission"], up["circuit"]
+    yield ("cis_upstream_rate_limit", "gauge", "Current admission rate (requests per second)",
+           [({}, admission["rate"])])
+    yield ("cis_upstream_throttled_total", "counter", "Requests that waited for an admission token",
+           [({}, admission["throttled"])])
+    yield ("cis_upstream_429_total", "counter", "429 responses received from the API",
+           [({}, admission["rate_limited"])])
+    yield ("cis_upstream_circuit_open", "gauge", "1 while the circuit breaker is open or half-open",
+           [({}, 0 if circuit["state"] == "closed" else 1)])
+    yield ("cis_upstream_reauths_total", "counter", "Token refreshes after a 401",
+           [({}, up["reauths"])])
+
+    polls = poller.stats()
+    yield ("cis_poller_pending", "gauge", "Generations still being polled", [({}, polls["pending"])])
+    yield ("cis_gallery_bytes", "gauge", "Bytes of mirrored images on disk", [({}, gallery.stats()["bytes"])])
+    compression = compressor.stats()
+    yield ("cis_compression_calls_total", "counter", "Compression requests, by whether re-encoding was needed",
+           [({"skipped": "false"}, compression["calls"]),
+            ({"skipped": "true"}, compression["skipped"])])
+
+
+# ──────────────────────────────────────────────
+# Components
+# ──────────────────────────────────────────────
+
+# The routes above use these through module globals. A compression worker
+# started with "spawn" re-imports this file as "__mp_main__" and needs none of
+# it, so the stores, pools, threads and logging setup are only built in the
+# server process (and when asgi.py imports the module).
+if __name__ != "__mp_main__":
+    # INFO logs retries, submissions and failures; DEBUG adds every proxied status
+    # poll and the request/response details of each generation
+    logging.basicConfig(level=os.environ.get("CIS_LOG_LEVEL", "INFO").upper(), format="%(message)s")
+
+    assets = AssetManifest(STATIC_DIR, STATIC_CACHE_DIR)
+    assets.build()
+    app.jinja_env.globals["asset_url"] = assets.url
+
+    # Credentials and access token live in memory; the file is read once and
+    # written atomically (see credentials.py).
+    credentials = CredentialStore(CONFIG_PATH)
+
+    # Shared pooled client — every route goes through this instead of calling
+    # `http_requests` directly, so connections are kept alive and the
+    # 401 → auto_login() → retry logic lives in one place.
+    upstream = UpstreamClient(
+        API_BASE_URL, auth_header=get_auth_header, relogin=auto_login,
+        limiter=AdaptiveRateLimiter(rate=UPSTREAM_RATE, burst=max(10, int(UPSTREAM_RATE * 2)),
+                                    max_rate=max(50.0, UPSTREAM_RATE * 2)),
+    )
+
+    # Every completed generation is mirrored into the local gallery (see gallery.py)
+    gallery = GalleryStore(GALLERY_DIR, upstream, max_bytes=GALLERY_MAX_BYTES)
+
+    # Credit history is mirrored locally and queried there (see ledger.py)
+    ledger = TransactionLedger(LEDGER_PATH, upstream, characters_for=gallery.characters_for)
+
+    # One background poller for every in-flight generation, shared by all tabs
+    poller = PollScheduler(upstream, on_complete=lambda gid, url: gallery.add(gid, url))
+
+    # Image compression runs in worker processes (see compression.py)
+    compressor = CompressionEngine()
+
+    # Upload-ready (compressed, base64) reference images, keyed by path/mtime/size
+    ref_cache = RefPayloadCache(disk_dir=REF_CACHE_DIR)
+
+    # Seed images uploaded as files, normalised once and referenced by handle
+    seeds = SeedStore(SEED_DIR, compressor, max_upload_bytes=MAX_BODY_BYTES)
+
+    # Resized (webp) copies of reference images for the character cards and previews
+    thumbnails = ThumbnailCache(THUMB_CACHE_DIR)
+
+    # Picks the most distinct references to upload (perceptual hash + colour histogram)
+    ref_selector = RefSelector(CHARACTERS_DIR, REF_INDEX_DIR)
+
+    # Background executor for work that would otherwise hold a request for minutes
+    jobs = JobManager(max_workers=4)
+
+    batches = BatchManager(JobManager(max_workers=BATCH_CONCURRENCY), statuses=poller.snapshot, track=poller.track)
+
+    # TTL + stale-while-revalidate cache for read-mostly endpoints (see respcache.py)
+    response_cache = ResponseCache(RESPONSE_CACHE_POLICIES)
+
+    # In-memory registry with incremental folder scanning (see registry.py)
+    registry = CharacterRegistry(
+        CHARACTERS_DIR,
+        on_folder_changed=_character_folder_changed,
+        store=(SqliteRegistryStore(REGISTRY_DB_PATH, migrate_from=CHARACTERS_DIR / "registry.json")
+               if REGISTRY_BACKEND == "sqlite" else None),
+    )
+    pack_importer = PackImporter(CHARACTERS_DIR, registry, on_folder_changed=_character_folder_changed)
+
+
 # ──────────────────────────────────────────────
 # Startup
 # ──────────────────────────────────────────────
@@ -933,5 +1612,6 @@ if __name__ == "__main__":
     ║   http://localhost:5777                           ║
     ╚══════════════════════════════════════════════════╝
     """)
+    gallery.resume()
     threading.Thread(target=open_browser, daemon=True).start()
     app.run(host="127.0.0.1", port=PORT, debug=False)
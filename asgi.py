@@ -0,0 +1,378 @@
+"""
+Character Image Studio — async (ASGI) serving mode.
+
+    python asgi.py              (or: uvicorn asgi:application --port 5777)
+
+Serves the same UI and API as `python app.py`. The routes that spend their
+time waiting on the NeukoAI API — generate submissions, asset status and
+download polls, and the status event stream — run as coroutines on one event
+loop with an async HTTP client, so hundreds of in-flight calls don't need
+hundreds of threads. If the browser disconnects while such a call is in
+flight, the upstream call is cancelled. Every other route is the Flask app,
+mounted as a WSGI app behind these.
+
+Needs the optional packages: pip install starlette httpx uvicorn
+(a2wsgi is used for the WSGI mount if installed).
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import re
+import sys
+import threading
+import time
+
+try:
+    import httpx
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Mount, Route
+except ImportError as e:
+    MISSING = e.name
+else:
+    MISSING = None
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    try:
+        from starlette.middleware.wsgi import WSGIMiddleware
+    except ImportError:
+        WSGIMiddleware = None
+
+# A compression worker started with "spawn" re-runs this file as "__mp_main__"
+# when it is the main script; it must not build the app (see app.py)
+SPAWNED_WORKER = __name__ == "__mp_main__"
+if not SPAWNED_WORKER:
+    import app as cis
+from upstream import AsyncUpstreamClient, StreamingJSON
+
+# How often the status event stream checks the poller for changes
+EVENTS_CHECK_INTERVAL = 0.25
+EVENTS_KEEPALIVE = 15.0
+
+upstream = None         # AsyncUpstreamClient, created on startup
+
+log = logging.getLogger(__name__)
+# httpx logs every request at INFO; the [STATUS]/[DOWNLOAD] lines already cover them
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+# ──────────────────────────────────────────────
+# Helpers
+# ──────────────────────────────────────────────
+
+class ClientGone(Exception):
+    """The browser disconnected before the upstream call finished."""
+
+
+async def _wait_for_disconnect(request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _unless_disconnected(request, coro):
+    """Await `coro`, cancelling it if the client disconnects first (raises ClientGone)."""
+    call = asyncio.ensure_future(coro)
+    gone = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({call, gone}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        gone.cancel()
+        if not call.done():
+            call.cancel()
+    if not call.done():
+        await asyncio.wait({call})      # let the cancelled call close its connection
+    if call.cancelled():
+        raise ClientGone()
+    return call.result()
+
+
+def _error(message, status):
+    return JSONResponse({"error": message}, status)
+
+
+async def _json_body(request):
+    """Parsed JSON body ({} if absent or invalid), capped at MAX_BODY_BYTES like the Flask app."""
+    limit = cis.MAX_BODY_BYTES
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limit:
+        return None
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+    try:
+        body = json.loads(b"".join(chunks) or b"{}")
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+def _too_large():
+    return _error(f"Request body too large (max {cis.MAX_BODY_BYTES // (1024 * 1024)} MB)", 413)
+
+
+async def _relay_generation(resp, kind, **meta):
+    """Async version of app._relay_generation for an httpx response."""
+    cis._invalidate_balance()
+    try:
+        data = resp.json()
+    except ValueError:
+        if resp.status_code in (402, 429):
+            return _error(f"HTTP {resp.status_code}", resp.status_code)
+        return _error(f"API returned non-JSON (HTTP {resp.status_code})", 502)
+    if resp.is_success:
+        await run_in_threadpool(cis._note_generations, data, kind, **meta)
+    return JSONResponse(data, resp.status_code)
+
+
+async def _submit_generation(request, kind, payload, timeout, **meta):
+    """POST a generate/* payload and relay the response. If the browser goes
+    away first the call is cancelled — the API may still have accepted (and
+    charged for) the submission, so the cached balance is dropped either way."""
+    try:
+        resp = await _unless_disconnected(request, upstream.post(
+            f"/api/v1/generate/{kind}",
+            endpoint=kind,
+            data=StreamingJSON(payload),
+            timeout=timeout,
+        ))
+        return await _relay_generation(resp, kind, **meta)
+    except ClientGone:
+        log.info("[ASGI] Client disconnected — cancelled %s submission", kind)
+        cis._invalidate_balance()
+        return _error("client disconnected", 499)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+# ──────────────────────────────────────────────
+# Routes — Image Generation
+# ──────────────────────────────────────────────
+
+async def generate_seed(request):
+    body = await _json_body(request)
+    if body is None:
+        return _too_large()
+    payload = {"prompt": body.get("prompt", ""), "aspect_ratio": body.get("aspect_ratio", "1:1")}
+    return await _submit_generation(request, "seed", payload, None, prompt=body.get("prompt"))
+
+
+async def _references(body):
+    """(reference URLs, timeout) — local references as base64 when only a slug is given."""
+    ref_urls = body.get("reference_image_urls", [])
+    char_slug = body.get("character_slug", "")
+    if not ref_urls and char_slug:
+        # Reading and compressing files is blocking work
+        return await run_in_threadpool(cis._get_local_refs_as_base64, char_slug), 120
+    return ref_urls, 60
+
+
+async def generate_create(request):
+    body = await _json_body(request)
+    if body is None:
+        return _too_large()
+    ref_urls, timeout = await _references(body)
+    if not ref_urls and body.get("character_slug"):
+        return _error("Character has no reference images (local or remote)", 400)
+    try:
+        input_image_url = await run_in_threadpool(cis._input_image_url, body)
+    except LookupError as e:
+        return _error(str(e), 404)
+    payload = {
+        "prompt": body.get("prompt", ""),
+        "reference_image_urls": ref_urls,
+        "input_image_url": input_image_url,
+    }
+    return await _submit_generation(request, "create", payload, timeout,
+                                    character=body.get("character_slug", ""), prompt=payload["prompt"])
+
+
+async def generate_random(request):
+    body = await _json_body(request)
+    if body is None:
+        return _too_large()
+    ref_urls, timeout = await _references(body)
+    if not ref_urls and body.get("character_slug"):
+        return _error("Character has no reference images (local or remote)", 400)
+    payload = {
+        "reference_image_urls": ref_urls,
+        "character_description": body.get("character_description", ""),
+    }
+    return await _submit_generation(request, "random", payload, timeout,
+                                    character=body.get("character_slug", ""),
+                                    prompt=payload["character_description"])
+
+
+# ──────────────────────────────────────────────
+# Routes — Asset Status & Download
+# ──────────────────────────────────────────────
+
+async def asset_status(request):
+    generation_id = request.path_params["generation_id"]
+    try:
+        resp = await _unless_disconnected(request, upstream.get(
+            f"/api/v1/asset/status/{generation_id}", endpoint="status"))
+    except ClientGone:
+        return _error("client disconnected", 499)
+    except httpx.TimeoutException:
+        log.warning("[STATUS] %s... TIMEOUT", generation_id[:8])
+        return JSONResponse({"data": {"status": "pending"}, "_retry": True})
+    except Exception as e:
+        log.warning("[STATUS] %s... ERROR: %s", generation_id[:8], e)
+        return JSONResponse({"data": {"status": "pending"}, "_retry": True})
+    # Pass 429 through to frontend for rate-limit backoff
+    if resp.status_code == 429:
+        log.info("[STATUS] %s... RATE LIMITED (429)", generation_id[:8])
+        return _error("rate_limited", 429)
+    try:
+        data = resp.json()
+    except ValueError:
+        log.warning("[STATUS] %s... non-JSON response (HTTP %d): %s", generation_id[:8], resp.status_code, resp.text[:200])
+        return JSONResponse({"data": {"status": "pending"}, "_retry": True})
+    inner = data.get("data", data) if isinstance(data, dict) else {}
+    log.debug("[STATUS] %s... → %s", generation_id[:8], inner.get("status", "?"))
+    return JSONResponse(data, resp.status_code)
+
+
+async def asset_download(request):
+    generation_id = request.path_params["generation_id"]
+    try:
+        resp = await _unless_disconnected(request, upstream.get(
+            f"/api/v1/asset/download/{generation_id}", endpoint="download"))
+    except ClientGone:
+        return _error("client disconnected", 499)
+    except httpx.TimeoutException:
+        log.warning("[DOWNLOAD] %s... TIMEOUT", generation_id[:8])
+        return JSONResponse({"error": "temporary", "_retry": True}, 503)
+    except Exception as e:
+        log.warning("[DOWNLOAD] %s... ERROR: %s", generation_id[:8], e)
+        return JSONResponse({"error": str(e), "_retry": True}, 503)
+    # Pass 429 (rate limit) and 409 (not ready) through to frontend
+    if resp.status_code == 429:
+        log.info("[DOWNLOAD] %s... RATE LIMITED (429)", generation_id[:8])
+        return _error("rate_limited", 429)
+    if resp.status_code == 409:
+        log.debug("[DOWNLOAD] %s... NOT READY (409)", generation_id[:8])
+        return _error("not_ready", 409)
+    try:
+        data = resp.json()
+    except ValueError:
+        log.warning("[DOWNLOAD] %s... non-JSON response (HTTP %d): %s", generation_id[:8], resp.status_code, resp.text[:200])
+        return JSONResponse({"error": "temporary", "_retry": True}, 503)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("[DOWNLOAD] %s... → HTTP %d, body: %s", generation_id[:8], resp.status_code, str(data)[:200])
+    if resp.status_code == 200 and isinstance(data, dict):
+        inner = data.get("data", data)
+        await run_in_threadpool(cis.gallery.add, generation_id, inner.get("download_url") or inner.get("url"))
+    return JSONResponse(data, resp.status_code)
+
+
+async def asset_events(request):
+    """Server-Sent Events stream of status changes for ?ids=a,b,c (see app.asset_events).
+    Waits on the poller's version counter with short sleeps instead of a blocked thread."""
+    ids = [i.strip() for i in request.query_params.get("ids", "").split(",") if i.strip()][:200]
+    if not ids:
+        return _error("ids required", 400)
+    cis.poller.track(ids)
+
+    async def stream():
+        version = -1
+        idle = 0.0
+        while True:
+            current = cis.poller.version
+            if current != version:
+                version, idle = current, 0.0
+                yield f"event: status\ndata: {json.dumps(cis.poller.snapshot(ids))}\n\n"
+                if cis.poller.all_terminal(ids):
+                    yield "event: done\ndata: {}\n\n"
+                    return
+            elif idle >= EVENTS_KEEPALIVE:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(EVENTS_CHECK_INTERVAL)
+            idle += EVENTS_CHECK_INTERVAL
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ──────────────────────────────────────────────
+# Application
+# ──────────────────────────────────────────────
+
+def _route(path, endpoint, methods):
+    """A Route whose requests land in the same metrics as the Flask routes,
+    labelled with the Flask-style rule so both serving modes share series."""
+    rule = re.sub(r"\{(\w+)\}", r"<\1>", path)
+
+    async def timed(request):
+        start = time.perf_counter()
+        cis.HTTP_IN_FLIGHT.inc()
+        try:
+            response = await endpoint(request)
+        finally:
+            cis.HTTP_IN_FLIGHT.dec()
+        sent = response.headers.get("content-length")
+        cis.observe_request(rule, request.method, response.status_code, start,
+                            int(request.headers.get("content-length") or 0), int(sent) if sent else None)
+        return response
+
+    return Route(path, timed, methods=methods)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global upstream
+    upstream = AsyncUpstreamClient(cis.upstream)
+    cis.gallery.resume()
+    try:
+        yield
+    finally:
+        await upstream.aclose()
+
+
+def create_app():
+    if WSGIMiddleware is None:
+        raise ImportError("no WSGI middleware available (pip install a2wsgi)")
+    return Starlette(
+        routes=[
+            _route("/api/generate/seed", generate_seed, ["POST"]),
+            _route("/api/generate/create", generate_create, ["POST"]),
+            _route("/api/generate/random", generate_random, ["POST"]),
+            _route("/api/asset/status/{generation_id}", asset_status, ["GET"]),
+            _route("/api/asset/download/{generation_id}", asset_download, ["GET"]),
+            _route("/api/asset/events", asset_events, ["GET"]),
+            Mount("/", app=WSGIMiddleware(cis.app)),  # everything else: the Flask app
+        ],
+        lifespan=lifespan,
+    )
+
+
+application = create_app() if MISSING is None and not SPAWNED_WORKER else None
+
+
+if __name__ == "__main__":
+    if MISSING is not None:
+        print(f"[ASGI] Async mode needs starlette, httpx and uvicorn ({MISSING} is not installed).")
+        print("[ASGI] Install them with: pip install starlette httpx uvicorn  — or run app.py instead.")
+        sys.exit(1)
+    print(r"""
+    ╔══════════════════════════════════════════════════╗
+    ║   ★ CHARACTER IMAGE STUDIO ★                     ║
+    ║   ─────────────────────────────────────────────   ║
+    ║   Retro UI for NeukoAI Image Generation          ║
+    ║   http://localhost:5777  (async mode)             ║
+    ╚══════════════════════════════════════════════════╝
+    """)
+    threading.Thread(target=cis.open_browser, daemon=True).start()
+    uvicorn.run(application, host="127.0.0.1", port=cis.PORT, log_level="warning")
@@ -0,0 +1,171 @@
+"""
+Fingerprinted, precompressed static assets.
+
+On startup every file under static/ is hashed, and text assets are
+compressed once — gzip, plus brotli if the `brotli` package is installed —
+into a content-addressed cache (`characters/.cache/static/<hash>.js.br`).
+Templates link to `asset_url("js/app.js")`, which gives
+`/static/js/app.<hash>.js`; the URL changes whenever the content does, so
+those responses are marked immutable for a year and a repeat visit or a new
+tab loads no static bytes at all. Plain URLs still work and are revalidated
+on every use.
+
+Responses are built with `send_file` from the file on disk, which lets the
+WSGI server's file wrapper use sendfile where it supports it. A file edited
+while the app runs is re-hashed on its next lookup.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+HASH_LENGTH = 12
+COMPRESSIBLE = {".css", ".js", ".html", ".json", ".map", ".svg", ".txt"}
+# Preferred encoding first: (Content-Encoding, cache file suffix)
+ENCODINGS = (("br", "br"), ("gzip", "gz"))
+
+_FINGERPRINTED = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)$" % HASH_LENGTH)
+
+
+def _compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class Asset:
+    """One static file: its content hash and any precompressed copies."""
+
+    def __init__(self, name, path, digest, mtime_ns, size, variants):
+        self.name = name
+        self.path = path
+        self.digest = digest
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.variants = variants        # {encoding: Path}
+
+    @property
+    def url(self):
+        stem, ext = os.path.splitext(self.name)
+        return f"/static/{stem}.{self.digest}{ext}"
+
+
+class AssetManifest:
+    """Content hashes and compressed variants for the files under `static_dir`."""
+
+    def __init__(self, static_dir, cache_dir):
+        self.static_dir = Path(static_dir)
+        self.cache_dir = Path(cache_dir)
+        self._assets = {}
+        self._lock = threading.Lock()
+        self.served = {"identity": 0, "gzip": 0, "br": 0}
+
+    def build(self):
+        """Hash and precompress every static file, and drop compressed copies
+        of content that no longer exists."""
+        for path in sorted(self.static_dir.rglob("*")):
+            if path.is_file():
+                self.get(path.relative_to(self.static_dir).as_posix())
+        with self._lock:
+            keep = {p.name for a in self._assets.values() for p in a.variants.values()}
+        if self.cache_dir.is_dir():
+            for stale in self.cache_dir.iterdir():
+                if stale.name not in keep:
+                    stale.unlink(missing_ok=True)
+        log.info("[ASSETS] %d static files fingerprinted (%s)", len(self._assets),
+                 "gzip + brotli" if brotli else "gzip; pip install brotli for br")
+
+    def get(self, name):
+        """The current `Asset` for a path relative to static/, or None."""
+        if not name or name.startswith("/") or ".." in name.split("/"):
+            return None
+        path = self.static_dir / name
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        with self._lock:
+            asset = self._assets.get(name)
+        if asset and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size:
+            return asset
+        if not path.is_file():
+            return None
+        asset = self._load(name, path, st)
+        with self._lock:
+            self._assets[name] = asset
+        return asset
+
+    def url(self, name):
+        """Fingerprinted URL for templates; the plain URL if the file is missing."""
+        asset = self.get(name)
+        return asset.url if asset else f"/static/{name}"
+
+    def resolve(self, filename):
+        """Map a requested path to (asset, immutable). A fingerprinted path
+        whose hash is out of date still gets the current content, but not the
+        immutable caching."""
+        match = _FINGERPRINTED.match(filename)
+        if match:
+            asset = self.get(match["stem"] + match["ext"])
+            if asset is not None:
+                return asset, asset.digest == match["hash"]
+        return self.get(filename), False
+
+    def variant(self, asset, accept_encodings):
+        """Pick (path, Content-Encoding or None) for a request's Accept-Encoding."""
+        for encoding, _ in ENCODINGS:
+            path = asset.variants.get(encoding)
+            if path is not None and accept_encodings[encoding]:
+                self.served[encoding] += 1
+                return path, encoding
+        self.served["identity"] += 1
+        return asset.path, None
+
+    def stats(self):
+        with self._lock:
+            assets = list(self._assets.values())
+        return {
+            "files": len(assets),
+            "bytes": sum(a.size for a in assets),
+            "compressed_bytes": {enc: sum(a.variants[enc].stat().st_size for a in assets if enc in a.variants)
+                                 for enc, _ in ENCODINGS},
+            "served": dict(self.served),
+        }
+
+    # ── Internals ─────────────────────────────
+
+    def _load(self, name, path, st):
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        variants = {}
+        if path.suffix.lower() in COMPRESSIBLE:
+            for encoding, suffix in ENCODINGS:
+                if encoding == "br" and brotli is None:
+                    continue
+                target = self.cache_dir / f"{digest}{path.suffix}.{suffix}"
+                try:
+                    if not target.exists():
+                        packed = _compress(data, encoding)
+                        if len(packed) >= len(data):
+                            continue
+                        self.cache_dir.mkdir(parents=True, exist_ok=True)
+                        tmp = target.with_name(target.name + ".tmp")
+                        tmp.write_bytes(packed)
+                        os.replace(tmp, target)
+                    variants[encoding] = target
+                except OSError as e:
+                    log.warning("[ASSETS] Could not write %s variant of %s: %s", encoding, name, e)
+        return Asset(name, path, digest, st.st_mtime_ns, st.st_size, variants)
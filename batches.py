@@ -0,0 +1,147 @@
+"""
+Batch generation.
+
+A batch is one character and many prompts. The character's references are
+encoded once and the same list of data URIs is shared by every submission.
+Each prompt is submitted by its own job on a dedicated `JobManager`, whose
+worker count bounds how many submissions are in flight at once; the
+admission control in upstream.py still paces them against the API's rate
+limit, and items that hit 429s or gateway errors retry on the job timer.
+
+Progress is aggregated from the item jobs and, once an item is submitted,
+from the poller's status for its generation ID. The poller forgets finished
+IDs sooner than batches are kept, so an item's final status is copied onto
+the batch the first time it is seen.
+"""
+
+import threading
+import time
+import uuid
+
+from poller import TERMINAL
+
+
+class Batch:
+    """One batch: prompts for a character and the item jobs submitting them."""
+
+    def __init__(self, character, prompts):
+        self.id = uuid.uuid4().hex
+        self.character = character
+        self.prompts = list(prompts)
+        self.jobs = []
+        self.cancelled = None       # reason, once cancelled
+        self.created_at = time.time()
+        self.final = {}             # index -> {status, download_url} once terminal
+
+
+class BatchManager:
+    """Creates batches on top of a `JobManager` and reports their progress.
+
+    `statuses(ids)` returns the poller's {gid: {status, ...}} view of the
+    generation IDs the items produced; `track(ids)` asks the poller to
+    (re)start polling IDs it no longer knows.
+    """
+
+    def __init__(self, jobs, statuses=None, track=None, retain_seconds=3600):
+        self.jobs = jobs
+        self._statuses = statuses
+        self._track = track
+        self.retain_seconds = retain_seconds
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def submit(self, character, prompts, fn, *args):
+        """Queue `fn(job, batch, index, *args)` for every prompt. Item jobs
+        return {"generation_id": ...}; raising fails (or RetryLater retries) that item."""
+        batch = Batch(character, prompts)
+        with self._lock:
+            self._evict()
+            self._batches[batch.id] = batch
+            batch.jobs = [
+                self.jobs.submit("batch-item", fn, batch, i, *args, meta={"batch": batch.id, "index": i})
+                for i in range(len(batch.prompts))
+            ]
+        return batch
+
+    def get(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def cancel(self, batch, reason="cancelled"):
+        """Stop submitting the batch's remaining items (already submitted ones still run)."""
+        if batch.cancelled is None:
+            batch.cancelled = reason
+
+    def to_dict(self, batch, items=True):
+        with self._lock:
+            jobs = list(batch.jobs)
+            final = dict(batch.final)
+        gids = {}
+        for i, job in enumerate(jobs):
+            if job.state == "completed" and isinstance(job.result, dict) and job.result.get("generation_id"):
+                gids[i] = job.result["generation_id"]
+        open_gids = [gid for i, gid in gids.items() if i not in final]
+        statuses = self._statuses(open_gids) if self._statuses and open_gids else {}
+        for i, gid in gids.items():
+            s = statuses.get(gid)
+            if i not in final and s and s.get("status") in TERMINAL:
+                final[i] = {"status": s["status"], "download_url": s.get("download_url")}
+        with self._lock:
+            batch.final.update(final)
+        forgotten = [gid for gid in open_gids if gid not in statuses]
+        if forgotten and self._track:
+            self._track(forgotten)   # polled again; "unknown" until the poller has a status
+
+        submissions = {}
+        generations = {"pending": 0, "completed": 0, "failed": 0, "unknown": 0}
+        listed = []
+        for i, job in enumerate(jobs):
+            submissions[job.state] = submissions.get(job.state, 0) + 1
+            status = download_url = None
+            if i in gids:
+                known = final.get(i) or statuses.get(gids[i])
+                status = known.get("status") if known else "unknown"
+                download_url = known.get("download_url") if known else None
+                generations[status if status in generations else "pending"] += 1
+            if items:
+                listed.append({
+                    "index": i,
+                    "prompt": batch.prompts[i],
+                    "job_id": job.id,
+                    "state": job.state,
+                    "attempts": job.attempts,
+                    "error": job.error,
+                    "generation_id": gids.get(i),
+                    "status": status,
+                    "download_url": download_url,
+                })
+
+        submitted_all = all(job.done for job in jobs)
+        # Forgotten IDs that are being polled again still count as unfinished
+        waiting = generations["pending"] + (generations["unknown"] if self._track else 0)
+        done = submitted_all and waiting == 0
+        out = {
+            "id": batch.id,
+            "character": batch.character,
+            "total": len(batch.prompts),
+            "state": "cancelled" if batch.cancelled and done else ("done" if done else "running"),
+            "cancelled": batch.cancelled,
+            "submissions": submissions,
+            "generations": generations,
+            "done": done,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch.created_at)),
+        }
+        if items:
+            out["items"] = listed
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {"batches": len(self._batches), "items": self.jobs.stats()}
+
+    def _evict(self):
+        cutoff = time.time() - self.retain_seconds
+        stale = [b.id for b in self._batches.values()
+                 if b.created_at < cutoff and all(j.done for j in b.jobs)]
+        for batch_id in stale:
+            del self._batches[batch_id]
@@ -0,0 +1,384 @@
+"""
+Local stand-in for the NeukoAI API.
+
+    python bench/fake_upstream.py --port 5800 --latency 40 --rate-429 0.02
+
+Implements the endpoints app.py calls — auth (register/login/me), credits,
+payments, generate/{seed,create,random,turnaround}, asset/status and
+asset/download — plus `/files/<name>.png` for the images behind download and
+reference URLs. Point the app at it with CIS_API_BASE_URL=http://127.0.0.1:5800.
+
+Everything that matters for performance work is configurable: per-request
+latency (with jitter), how long generations take to complete, access-token
+lifetime (expired tokens get 401), the share of calls answered with 429 or
+502, the size of served images, and how much credit history the account
+starts with (every submission adds a charge to it). Only the standard library is used.
+`GET /_fake/stats` returns what the fake has served.
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+IMAGE_VARIANTS = 16
+
+
+def _png(size_bytes, seed=0):
+    """A valid RGB PNG of roughly `size_bytes` (noise, so it doesn't compress)."""
+    side = max(8, int((size_bytes / 3) ** 0.5))
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(side * 3) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 1))
+            + chunk(b"IEND", b""))
+
+
+def _token(ttl):
+    """An unsigned JWT-shaped token whose `exp` the app can read (see credentials.py)."""
+    def part(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+    return f"{part({'alg': 'none'})}.{part({'sub': 'bench', 'exp': int(time.time() + ttl)})}.x"
+
+
+class FakeUpstream:
+    """The fake API server. `start()` runs it on a background thread."""
+
+    def __init__(self, host="127.0.0.1", port=5800, latency_ms=30.0, jitter=0.5,
+                 submit_latency_ms=300.0, generate_seconds=5.0, token_ttl=3600.0,
+                 rate_429=0.0, rate_502=0.0, image_kb=512, history=2000, seed=1):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms            # typical latency of every call
+        self.jitter = jitter                    # ± share of the latency
+        self.submit_latency_ms = submit_latency_ms  # generate/* submissions
+        self.generate_seconds = generate_seconds    # submission → completed
+        self.token_ttl = token_ttl
+        self.rate_429 = rate_429
+        self.rate_502 = rate_502
+        self.image_kb = image_kb
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = {}                       # token -> expiry
+        self._generations = {}                  # gid -> completes_at
+        self._images = {}                       # (size, variant) -> png bytes
+        self._ids = itertools.count(1)
+        self._transactions = self._history(history)  # oldest first
+        self.counts = {}                        # "METHOD /route" -> calls
+        self.injected = {"401": 0, "429": 0, "502": 0}
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"fake": self})
+        ThreadingHTTPServer.request_queue_size = 1024
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="fake-upstream", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {"counts": dict(self.counts), "injected": dict(self.injected),
+                    "generations": len(self._generations), "tokens": len(self._tokens)}
+
+    # ── Behaviour ─────────────────────────────
+
+    def image(self, name):
+        """Image bytes for a file name; a handful of variants, so content-addressed
+        stores see a mix of new and duplicate images."""
+        key = (self.image_kb, zlib.crc32(name.encode()) % IMAGE_VARIANTS)
+        with self._lock:
+            data = self._images.get(key)
+        if data is None:
+            data = _png(self.image_kb * 1024, seed=key[1])
+            with self._lock:
+                self._images[key] = data
+        return data
+
+    def delay(self, submit=False):
+        base = (self.submit_latency_ms if submit else self.latency_ms) / 1000
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, base * factor))
+
+    def fault(self):
+        """An injected error status (429 / 502) for this call, or None."""
+        with self._lock:
+            roll = self._rng.random()
+            if roll < self.rate_429:
+                self.injected["429"] += 1
+                return 429
+            if roll < self.rate_429 + self.rate_502:
+                self.injected["502"] += 1
+                return 502
+        return None
+
+    def login(self):
+        token = _token(self.token_ttl)
+        with self._lock:
+            self._tokens[token] = time.time() + self.token_ttl
+        return token
+
+    def authorized(self, header):
+        token = (header or "").removeprefix("Bearer ").strip()
+        with self._lock:
+            ok = self._tokens.get(token, 0) > time.time()
+            if not ok:
+                self.injected["401"] += 1
+        return ok
+
+    def new_generation(self):
+        gid = f"gen-{next(self._ids):06d}-{uuid.uuid4().hex[:8]}"
+        with self._lock:
+            self._generations[gid] = time.time() + self.generate_seconds
+            self._add_transaction("generation", -10, time.time(), generation_id=gid)
+        return gid
+
+    def transactions(self, page, limit):
+        """One page of the history, newest first."""
+        with self._lock:
+            total = len(self._transactions)
+            end = max(0, total - (page - 1) * limit)
+            items = self._transactions[max(0, end - limit):end][::-1]
+        return items, total
+
+    def _history(self, count):
+        """`count` transactions over the past days: a purchase now and then,
+        generation charges otherwise."""
+        self._transactions = []
+        now = time.time()
+        for i in range(count):
+            ts = now - (count - i) * 1800
+            if i % 100 == 0:
+                self._add_transaction("purchase", 1000, ts)
+            else:
+                self._add_transaction("generation", -10, ts, generation_id=f"hist-{i:06d}")
+        return self._transactions
+
+    def _add_transaction(self, kind, amount, ts, **extra):
+        balance = (self._transactions[-1]["balance_after"] if self._transactions else 0) + amount
+        self._transactions.append({
+            "id": len(self._transactions) + 1,
+            "type": kind,
+            "amount": amount,
+            "balance_after": balance,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)),
+            **extra,
+        })
+
+    def generation_state(self, gid):
+        """"pending" / "completed"; unknown IDs are adopted as new generations."""
+        with self._lock:
+            done_at = self._generations.setdefault(gid, time.time() + self.generate_seconds)
+        return "completed" if time.time() >= done_at else "pending"
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+# Route table: (method, pattern, handler name, needs auth, is a generate submission)
+_ROUTES = [
+    ("POST", r"/api/v1/auth/register", "register", False, False),
+    ("POST", r"/api/v1/auth/login", "login", False, False),
+    ("GET", r"/api/v1/auth/me", "me", True, False),
+    ("GET", r"/api/v1/credits/balance", "balance", True, False),
+    ("GET", r"/api/v1/credits/pricing", "pricing", False, False),
+    ("GET", r"/api/v1/credits/transactions", "transactions", True, False),
+    ("GET", r"/api/v1/payments/bundles", "bundles", False, False),
+    ("POST", r"/api/v1/payments/checkout", "checkout", True, False),
+    ("GET", r"/api/v1/payments/status/(?P<pid>\d+)", "payment_status", True, False),
+    ("POST", r"/api/v1/generate/(?P<kind>seed|create|random)", "generate", True, True),
+    ("POST", r"/api/v1/generate/turnaround", "turnaround", True, True),
+    ("GET", r"/api/v1/asset/status/(?P<gid>[^/]+)", "status", True, False),
+    ("GET", r"/api/v1/asset/download/(?P<gid>[^/]+)", "download", True, False),
+    ("GET", r"/files/(?P<name>[^/]+)", "file", False, False),
+    ("GET", r"/_fake/stats", "fake_stats", False, False),
+]
+_ROUTES = [(m, re.compile(p + r"$"), name, auth, submit) for m, p, name, auth, submit in _ROUTES]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        path = url.path
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        for m, pattern, name, auth, submit in _ROUTES:
+            match = pattern.match(path)
+            if m != method or not match:
+                continue
+            self.fake.count(f"{method} {pattern.pattern[:-1]}")
+            if name in ("file", "fake_stats"):
+                return getattr(self, f"_{name}")(**match.groupdict())
+            self.fake.delay(submit)
+            if auth and not self.fake.authorized(self.headers.get("Authorization")):
+                return self._json({"error": "token expired"}, 401)
+            status = self.fake.fault() if name not in ("register", "login") else None
+            if status == 429:
+                return self._json({"error": "rate limited"}, 429, {"Retry-After": "1"})
+            if status == 502:
+                return self._send(502, b"<html>Bad Gateway</html>", "text/html")
+            try:
+                body = json.loads(raw) if raw else {}
+            except ValueError:
+                return self._json({"error": "invalid JSON"}, 400)
+            return getattr(self, f"_{name}")(body, **match.groupdict())
+        self._json({"error": "not found"}, 404)
+
+    # ── Responses ─────────────────────────────
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _json(self, obj, status=200, headers=None):
+        self._send(status, json.dumps(obj).encode(), "application/json", headers)
+
+    # ── Endpoints ─────────────────────────────
+
+    def _register(self, body):
+        self._json({"client_id": f"bench-{uuid.uuid4().hex[:12]}", "client_secret": uuid.uuid4().hex,
+                    "message": "Account created!"}, 201)
+
+    def _login(self, body):
+        if not body.get("client_id") or not body.get("client_secret"):
+            return self._json({"error": "invalid credentials"}, 401)
+        self._json({"access_token": self.fake.login(), "token_type": "bearer",
+                    "expires_in": int(self.fake.token_ttl)})
+
+    def _me(self, body):
+        self._json({"data": {"client_id": "bench", "credits": 1_000_000}})
+
+    def _balance(self, body):
+        self._json({"data": {"balance": 1_000_000}})
+
+    def _pricing(self, body):
+        self._json({"data": {"seed": 10, "create": 10, "random": 10, "turnaround": 10}})
+
+    def _transactions(self, body):
+        try:
+            page = max(1, int(self.query.get("page", 1)))
+            limit = max(1, min(int(self.query.get("limit", 50)), 100))
+        except ValueError:
+            return self._json({"error": "invalid paging"}, 400)
+        items, total = self.fake.transactions(page, limit)
+        self._json({"data": {"transactions": items, "page": page, "limit": limit, "total": total}})
+
+    def _bundles(self, body):
+        self._json({"data": [{"id": 1, "credits": 1000, "price_usd": 10}]})
+
+    def _checkout(self, body):
+        self._json({"data": {"payment_id": 1, "checkout_url": f"{self.fake.base_url}/checkout/1"}})
+
+    def _payment_status(self, body, pid):
+        self._json({"data": {"payment_id": int(pid), "status": "completed"}})
+
+    def _generate(self, body, kind):
+        self._json({"success": True, "data": {"generation_id": self.fake.new_generation(), "status": "pending"}})
+
+    def _turnaround(self, body):
+        prompts = body.get("prompts") or [""]
+        images = [{"generation_id": self.fake.new_generation(), "prompt": p} for p in prompts]
+        self._json({"success": True, "data": {"images": images}})
+
+    def _status(self, body, gid):
+        self._json({"data": {"generation_id": gid, "status": self.fake.generation_state(gid)}})
+
+    def _download(self, body, gid):
+        if self.fake.generation_state(gid) != "completed":
+            return self._json({"error": "not ready"}, 409)
+        self._json({"data": {"download_url": f"{self.fake.base_url}/files/{gid}.png"}})
+
+    def _file(self, name):
+        self._send(200, self.fake.image(name), "image/png")
+
+    def _fake_stats(self):
+        self._json(self.fake.stats())
+
+
+def add_arguments(parser):
+    """Options shared with bench/run.py."""
+    parser.add_argument("--latency", type=float, default=30.0, help="per-call latency, ms (default 30)")
+    parser.add_argument("--jitter", type=float, default=0.5, help="± share of the latency (default 0.5)")
+    parser.add_argument("--submit-latency", type=float, default=300.0,
+                        help="generate/* submission latency, ms (default 300)")
+    parser.add_argument("--generate-seconds", type=float, default=5.0,
+                        help="time until a generation completes (default 5)")
+    parser.add_argument("--token-ttl", type=float, default=3600.0,
+                        help="access token lifetime, s — then 401 (default 3600)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of calls answered 429")
+    parser.add_argument("--rate-502", type=float, default=0.0, help="share of calls answered 502")
+    parser.add_argument("--image-kb", type=int, default=512, help="size of served images, KB (default 512)")
+    parser.add_argument("--history", type=int, default=2000,
+                        help="credit transactions the account starts with (default 2000)")
+
+
+def from_arguments(args, port=0):
+    return FakeUpstream(port=port, latency_ms=args.latency, jitter=args.jitter,
+                        submit_latency_ms=args.submit_latency, generate_seconds=args.generate_seconds,
+                        token_ttl=args.token_ttl, rate_429=args.rate_429, rate_502=args.rate_502,
+                        image_kb=args.image_kb, history=args.history)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5800)
+    add_arguments(parser)
+    args = parser.parse_args()
+    fake = from_arguments(args, port=args.port)
+    fake.host = args.host
+    fake.start()
+    print(f"[FAKE] NeukoAI stand-in on {fake.base_url} — start the app with CIS_API_BASE_URL={fake.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
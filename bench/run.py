@@ -0,0 +1,390 @@
+"""
+Proxy benchmark suite.
+
+    python bench/run.py                              # every scenario, Flask server
+    python bench/run.py --server asgi -c 64          # asgi.py entry point, 64 clients
+    python bench/run.py --json out.json --baseline bench/baseline.json
+
+Runs the NeukoAI stand-in (fake_upstream.py) in this process and the app in
+a child process with a scratch data directory, registers an account, creates
+a character from the stand-in's images, then drives each scenario with
+`--concurrency` client threads:
+
+    generate     POST /api/generate/create with the character's local references
+    turnaround   POST /api/generate/turnaround, then follow the job until it finishes
+    status       GET  /api/asset/status/<id> for generations made by `generate`
+    characters   GET  /api/characters
+    transactions GET  /api/transactions pages and a per-day summary (local ledger)
+
+Reported per scenario: throughput, p50/p99 latency, errors, the app
+process's peak RSS and its CPU time per request. With --baseline, any metric
+more than --tolerance worse than the baseline run is listed and the exit
+status is 1, so the suite can gate performance changes.
+"""
+
+import argparse
+import base64
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent))
+from fake_upstream import add_arguments, from_arguments  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ("generate", "turnaround", "status", "characters", "transactions")
+# metric -> True if higher is better
+METRICS = {"throughput": True, "p50_ms": False, "p99_ms": False,
+           "cpu_ms_per_request": False, "peak_rss_mb": False}
+
+
+# ──────────────────────────────────────────────
+# App process
+# ──────────────────────────────────────────────
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(server, port, env, log_path):
+    if server == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application",
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "-c",
+               f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    log = open(log_path, "wb")
+    return subprocess.Popen(cmd, cwd=REPO_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(base, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app exited with status {proc.returncode} during startup")
+        try:
+            if requests.get(f"{base}/api/credentials", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("app did not start in time")
+
+
+class ProcessSampler:
+    """CPU time and peak RSS of a process (psutil, or /proc on Linux)."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._proc = psutil.Process(pid) if psutil else None
+
+    def rss(self):
+        if self._proc:
+            return self._proc.memory_info().rss
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def cpu_seconds(self):
+        if self._proc:
+            t = self._proc.cpu_times()
+            return t.user + t.system
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def __enter__(self):
+        self.peak = self.rss() or 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.rss() or 0)
+
+
+# ──────────────────────────────────────────────
+# Scenarios
+# ──────────────────────────────────────────────
+
+class Bench:
+    def __init__(self, base, fake, args):
+        self.base = base
+        self.fake = fake
+        self.args = args
+        self.slug = None
+        self.generation_ids = []
+        self.seed_url = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def setup(self):
+        s = self.session
+        r = s.post(f"{self.base}/api/register", timeout=30)
+        if not r.ok:
+            raise RuntimeError(f"register failed: HTTP {r.status_code} {r.text[:200]}")
+        refs = [f"{self.fake.base_url}/files/ref-{i:02d}.png" for i in range(self.args.refs)]
+        r = s.post(f"{self.base}/api/characters", json={"name": "Bench Character", "reference_urls": refs},
+                   timeout=30)
+        self.slug = r.json()["character"]["slug"]
+        job = r.json()["job"]
+        while job["state"] not in ("completed", "failed"):
+            time.sleep(0.2)
+            job = s.get(f"{self.base}/api/jobs/{job['id']}", timeout=10).json()
+        if job["state"] != "completed":
+            raise RuntimeError(f"character download failed: {job.get('error')}")
+        seed = self.fake.image("seed.png")
+        self.seed_url = "data:image/png;base64," + base64.b64encode(seed).decode("ascii")
+
+    def generate(self, i):
+        r = self.session.post(f"{self.base}/api/generate/create",
+                              json={"character_slug": self.slug, "prompt": f"bench scene {i}"}, timeout=180)
+        if r.status_code != 200:
+            return False
+        gid = r.json().get("data", {}).get("generation_id")
+        if gid:
+            with self._lock:
+                self.generation_ids.append(gid)
+        return True
+
+    def turnaround(self, i):
+        r = self.session.post(f"{self.base}/api/generate/turnaround",
+                              json={"seed_image_url": self.seed_url, "prompts": [f"view {i}"]}, timeout=180)
+        if r.status_code != 202:
+            return False
+        job_id = r.json()["job"]["id"]
+        state = None
+        with self.session.get(f"{self.base}/api/jobs/{job_id}/events", stream=True, timeout=300) as events:
+            for line in events.iter_lines(decode_unicode=True):
+                if line and line.startswith("data: "):
+                    state = json.loads(line[6:]).get("state")
+        return state == "completed"
+
+    def status(self, i):
+        with self._lock:
+            gid = self.generation_ids[i % len(self.generation_ids)] if self.generation_ids else f"bench-{i}"
+        return self.session.get(f"{self.base}/api/asset/status/{gid}", timeout=60).status_code == 200
+
+    def characters(self, i):
+        return self.session.get(f"{self.base}/api/characters", timeout=30).status_code == 200
+
+    def transactions(self, i):
+        if i % 2:
+            url = f"{self.base}/api/transactions/summary?group=day"
+        else:
+            url = f"{self.base}/api/transactions?page={i % 20 + 1}&limit=50"
+        return self.session.get(url, timeout=60).status_code == 200
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def run_scenario(bench, name, sampler, args):
+    call = getattr(bench, name)
+    for i in range(args.warmup):
+        call(-1 - i)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = call(i)
+        except requests.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            errors += not ok
+
+    cpu_before = sampler.cpu_seconds()
+    with sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(one, range(args.requests)))
+        wall = time.perf_counter() - start
+    cpu_after = sampler.cpu_seconds()
+
+    latencies.sort()
+    cpu = (cpu_after - cpu_before) if cpu_before is not None and cpu_after is not None else None
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "throughput": round(args.requests / wall, 2),
+        "p50_ms": round(_percentile(latencies, 50), 1),
+        "p99_ms": round(_percentile(latencies, 99), 1),
+        "max_ms": round(latencies[-1], 1) if latencies else 0.0,
+        "peak_rss_mb": round(sampler.peak / (1024 * 1024), 1) if sampler.peak else None,
+        "cpu_ms_per_request": round(cpu * 1000 / args.requests, 2) if cpu is not None else None,
+    }
+
+
+# ──────────────────────────────────────────────
+# Reporting
+# ──────────────────────────────────────────────
+
+def print_table(results):
+    print(f"\n{'scenario':<14}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}"
+          f"{'peak RSS MB':>13}{'CPU ms/req':>12}")
+    for name, r in results.items():
+        def fmt(value):
+            return "-" if value is None else value
+        print(f"{name:<14}{r['throughput']:>9}{r['p50_ms']:>10}{r['p99_ms']:>10}{r['errors']:>8}"
+              f"{fmt(r['peak_rss_mb']):>13}{fmt(r['cpu_ms_per_request']):>12}")
+
+
+def compare(results, baseline, tolerance):
+    """Metrics that are more than `tolerance` (relative) worse than the baseline."""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base.get(metric), r.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name}.{metric}: {old} → {new} ({change:+.0%})")
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the proxy against a local NeukoAI stand-in.")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-n", "--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--refs", type=int, default=20, help="reference images for the character")
+    parser.add_argument("--upstream-rate", type=float, default=1000.0,
+                        help="app's starting upstream request rate (CIS_UPSTREAM_RATE)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against results written by an earlier --json run")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch data directory")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    fake = from_arguments(args).start()
+    scratch = Path(tempfile.mkdtemp(prefix="cis-bench-"))
+    port = _free_port()
+    env = {"CIS_API_BASE_URL": fake.base_url, "CIS_DATA_DIR": str(scratch),
+           "CIS_UPSTREAM_RATE": str(args.upstream_rate), "PYTHONUNBUFFERED": "1"}
+    proc = start_app(args.server, port, env, scratch / "server.log")
+    base = f"http://127.0.0.1:{port}"
+    results = {}
+    try:
+        wait_ready(base, proc)
+        bench = Bench(base, fake, args)
+        bench.setup()
+        sampler = ProcessSampler(proc.pid)
+        print(f"[BENCH] {args.server} server, {args.concurrency} clients, {args.requests} requests per scenario, "
+              f"fake latency {args.latency:.0f}ms / submit {args.submit_latency:.0f}ms")
+        for name in scenarios:
+            results[name] = run_scenario(bench, name, sampler, args)
+            print(f"[BENCH] {name}: {results[name]['throughput']} req/s, p99 {results[name]['p99_ms']} ms")
+        print_table(results)
+        print(f"\nfake upstream: {json.dumps(fake.stats()['injected'])} injected")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.stop()
+        if args.keep:
+            print(f"[BENCH] Scratch directory kept: {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "server": args.server, "concurrency": args.concurrency, "requests": args.requests,
+            "commit": _commit(), "python": sys.version.split()[0],
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "fake": {k: getattr(args, k) for k in ("latency", "jitter", "submit_latency", "generate_seconds",
+                                                  "token_ttl", "rate_429", "rate_502", "image_kb")},
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n[BENCH] {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n[BENCH] No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
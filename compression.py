@@ -0,0 +1,204 @@
+"""
+Image compression engine.
+
+Shrinks reference and seed images to fit the API's upload limits. Works on
+raw bytes (no base64 round-trips), decodes JPEGs in draft mode so large
+photos are scaled down by the decoder itself, and finds the highest JPEG
+quality that fits with a bracketed search instead of re-encoding at every
+10-point step. Work runs in a process pool, so concurrent requests use
+several cores instead of queueing on the GIL, and every call reports how
+long each stage took.
+
+The workers are always started with "spawn", on every platform, and only
+need this module (and Pillow): `compress_bytes` is their entry point.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import RATIO_BUCKETS, Counter, Histogram
+
+MAX_DIM = 2048
+MAX_QUALITY = 85
+MIN_QUALITY = 30
+MAX_ENCODES = 5
+
+COMPRESS_SECONDS = Histogram("cis_compression_seconds", "Wall time of one image compression, by stage",
+                             ("stage",))
+COMPRESS_RATIO = Histogram("cis_compression_ratio", "Compressed size / original size", buckets=RATIO_BUCKETS)
+COMPRESS_BYTES = Counter("cis_compression_bytes_total", "Image bytes into and out of compression",
+                         ("direction",))
+
+
+def _encode(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=False)
+    return buf.getvalue()
+
+
+def compress_bytes(data, max_bytes, max_dim=MAX_DIM):
+    """Re-encode `data` as a JPEG of at most `max_bytes` (best effort).
+
+    Returns (jpeg_bytes, timings) where timings holds milliseconds per stage
+    (decode, resize, encode) plus the number of encodes and chosen quality.
+    Raises ImportError if Pillow is missing and PIL errors for bad input.
+    """
+    from PIL import Image
+
+    timings = {"decode": 0.0, "resize": 0.0, "encode": 0.0, "encodes": 0, "quality": None}
+    t = time.perf_counter()
+    img = Image.open(io.BytesIO(data))
+    # For JPEGs the decoder scales by 1/2, 1/4 or 1/8 while decoding
+    img.draft("RGB", (max_dim, max_dim))
+    img.load()
+    t, timings["decode"] = time.perf_counter(), (time.perf_counter() - t) * 1000
+
+    if max(img.size) > max_dim:
+        img.thumbnail((max_dim, max_dim), Image.LANCZOS, reducing_gap=2.0)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    t, timings["resize"] = time.perf_counter(), (time.perf_counter() - t) * 1000
+
+    def encode(quality):
+        nonlocal t
+        out = _encode(img, quality)
+        now = time.perf_counter()
+        timings["encode"] += (now - t) * 1000
+        timings["encodes"] += 1
+        t = now
+        return out
+
+    # Try the top quality first — most images fit straight away
+    best = encode(MAX_QUALITY)
+    best_q = MAX_QUALITY
+    if len(best) > max_bytes:
+        # Bracket [lo, hi] with known sizes and pick the next quality by
+        # interpolating on size (regula falsi), keeping the best fit found.
+        hi_q, hi_size = MAX_QUALITY, len(best)
+        low = encode(MIN_QUALITY)
+        best, best_q = low, MIN_QUALITY
+        lo_q, lo_size = MIN_QUALITY, len(low)
+        while lo_size <= max_bytes and hi_q - lo_q > 2 and timings["encodes"] < MAX_ENCODES:
+            frac = (max_bytes - lo_size) / max(1, hi_size - lo_size)
+            q = int(lo_q + frac * (hi_q - lo_q))
+            q = max(lo_q + 1, min(hi_q - 1, q))
+            out = encode(q)
+            if len(out) <= max_bytes:
+                best, best_q = out, q
+                lo_q, lo_size = q, len(out)
+            else:
+                hi_q, hi_size = q, len(out)
+        if len(best) > max_bytes:
+            # Even the lowest quality is too big — shrink the pixels instead
+            scale = (max_bytes / len(best)) ** 0.5 * 0.9
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                             Image.LANCZOS)
+            now = time.perf_counter()
+            timings["resize"] += (now - t) * 1000
+            t = now
+            best = encode(MIN_QUALITY)
+
+    timings["quality"] = best_q
+    timings["decode"] = round(timings["decode"], 1)
+    timings["resize"] = round(timings["resize"], 1)
+    timings["encode"] = round(timings["encode"], 1)
+    return best, timings
+
+
+class CompressionEngine:
+    """Runs `compress_bytes` in a lazily started process pool.
+
+    Falls back to compressing in the calling thread if worker processes
+    can't be started (or the pool breaks), so a pool problem never fails a
+    call. Images that can't be decoded raise Pillow's error to the caller.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or max(1, min(4, os.cpu_count() or 1))
+        self._pool = None
+        self._lock = threading.Lock()
+        self._totals = {"calls": 0, "skipped": 0, "inline": 0, "encodes": 0,
+                        "decode_ms": 0.0, "resize_ms": 0.0, "encode_ms": 0.0, "wall_ms": 0.0}
+
+    def compress(self, data, max_bytes):
+        """Return (bytes, mime, timings). Data already under `max_bytes` is
+        returned unchanged with mime None (keep the original type). Raises
+        ImportError without Pillow and Pillow's errors for undecodable input."""
+        if len(data) <= max_bytes:
+            with self._lock:
+                self._totals["skipped"] += 1
+            return data, None, {}
+        start = time.perf_counter()
+        inline = False
+        pool = None
+        try:
+            pool = self._get_pool()
+            future = pool.submit(compress_bytes, data, max_bytes)
+        except (BrokenProcessPool, OSError, RuntimeError):
+            # Workers can't be started (or the pool was shut down meanwhile)
+            future = None
+        if future is not None:
+            try:
+                out, timings = future.result()
+            except BrokenProcessPool:
+                future = None
+        if future is None:
+            # Errors from decoding the image itself are not caught: they would
+            # only fail again here
+            self._discard_pool(pool)
+            inline = True
+            out, timings = compress_bytes(data, max_bytes)
+        timings["wall"] = round((time.perf_counter() - start) * 1000, 1)
+        for stage in ("decode", "resize", "encode", "wall"):
+            COMPRESS_SECONDS.observe(timings[stage] / 1000, stage=stage)
+        COMPRESS_RATIO.observe(len(out) / len(data))
+        COMPRESS_BYTES.inc(len(data), direction="in")
+        COMPRESS_BYTES.inc(len(out), direction="out")
+        with self._lock:
+            s = self._totals
+            s["calls"] += 1
+            s["inline"] += inline
+            s["encodes"] += timings["encodes"]
+            s["decode_ms"] += timings["decode"]
+            s["resize_ms"] += timings["resize"]
+            s["encode_ms"] += timings["encode"]
+            s["wall_ms"] += timings["wall"]
+        return out, "image/jpeg", timings
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Not fork: the server has threads and open SQLite connections.
+                # Spawned workers re-import the main script as "__mp_main__",
+                # which app.py and asgi.py keep free of side effects.
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """Drop a broken pool (unless another thread already replaced it)."""
+        with self._lock:
+            if pool is not None and self._pool is pool:
+                self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._totals)
+        calls = s["calls"]
+        for key in ("decode_ms", "resize_ms", "encode_ms", "wall_ms"):
+            s[key.replace("_ms", "_avg_ms")] = round(s.pop(key) / calls, 1) if calls else 0.0
+        s["workers"] = self.workers
+        return s
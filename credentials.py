@@ -0,0 +1,185 @@
+"""
+Credential store.
+
+Holds `user_credentials.json` in memory so proxied requests don't re-read it
+from disk, and coordinates token refresh:
+
+* the access token is refreshed proactively (in the background) shortly
+  before it expires, when its expiry is known;
+* concurrent 401s are coalesced into a single login ("single-flight") —
+  the other callers wait for that login and reuse its token, or its failure;
+* after a failed login, further attempts back off for a few seconds;
+* file writes are atomic (temp file + rename).
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+def _jwt_expiry(token):
+    """`exp` claim of a JWT access token, or None if it isn't a readable JWT."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+
+
+class CredentialStore:
+    """Thread-safe, in-memory view of the credentials file."""
+
+    def __init__(self, path, refresh_margin=120, login_backoff=5):
+        self.path = Path(path)
+        self.refresh_margin = refresh_margin    # refresh this many seconds before expiry
+        self.login_backoff = login_backoff      # no new login this soon after a failed one
+        self._lock = threading.Lock()
+        self._login_lock = threading.Lock()
+        self._data = None
+        self._expires_at = None
+        self._refreshing = False
+        self._failed_at = None                  # monotonic time of the last failed login
+        self.logins = 0
+        self.login_failures = 0
+        self.coalesced = 0
+
+    # ── Credentials file ──────────────────────
+
+    def load(self):
+        """Return a copy of the stored credentials (read from disk once)."""
+        with self._lock:
+            if self._data is None:
+                self._data = self._read()
+                self._expires_at = self._data.get("token_expires_at") or _jwt_expiry(
+                    self._data.get("access_token", ""))
+            return dict(self._data)
+
+    def save(self, data):
+        """Merge `data` into the stored credentials and persist atomically."""
+        self.load()
+        with self._lock:
+            if ("access_token" in data and "token_expires_at" not in data
+                    and data["access_token"] != self._data.get("access_token")):
+                # The stored expiry belonged to the previous token
+                self._data.pop("token_expires_at", None)
+            if "client_id" in data or "client_secret" in data:
+                self._failed_at = None          # new credentials deserve a fresh attempt
+            self._data.update(data)
+            if "access_token" in data:
+                self._expires_at = self._data.get("token_expires_at") or _jwt_expiry(data["access_token"])
+            self._write(self._data)
+
+    def clear(self):
+        """Forget all credentials (logout)."""
+        with self._lock:
+            self._data = {}
+            self._expires_at = None
+            self._failed_at = None
+            if self.path.exists():
+                self.path.unlink()
+
+    def _read(self):
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, IOError):
+                return {}
+        return {}
+
+    def _write(self, data):
+        tmp = self.path.with_suffix(f".tmp{threading.get_ident()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    # ── Tokens ────────────────────────────────
+
+    @property
+    def access_token(self):
+        return self.load().get("access_token", "")
+
+    def expires_in(self):
+        """Seconds until the access token expires, or None if unknown."""
+        self.load()
+        return None if self._expires_at is None else self._expires_at - time.time()
+
+    def refresh(self, login, stale_token=None):
+        """Log in again, single-flight. Returns the token data, or None.
+
+        `login(client_id, client_secret)` performs the actual login and returns
+        the API's token response (a dict with `access_token`) or None.
+        If `stale_token` is given and another caller already replaced it while
+        we waited, that caller's token is reused without a second login.
+        Likewise, if a login failed while we waited (or within the last
+        `login_backoff` seconds), that failure is returned instead of trying
+        again, so an unreachable API costs one login attempt, not one per
+        queued request.
+        """
+        started = time.monotonic()
+        with self._login_lock:
+            creds = self.load()
+            current = creds.get("access_token")
+            if stale_token is not None and current and current != stale_token:
+                self.coalesced += 1
+                return {"access_token": current}
+            failed_at = self._failed_at
+            if failed_at is not None and (failed_at >= started
+                                          or time.monotonic() - failed_at < self.login_backoff):
+                self.coalesced += 1
+                return None
+            cid = creds.get("client_id")
+            csecret = creds.get("client_secret")
+            if not cid or not csecret:
+                return None
+            data = login(cid, csecret)
+            if not data or not data.get("access_token"):
+                self._failed_at = time.monotonic()
+                self.login_failures += 1
+                return None
+            self._failed_at = None
+            self.logins += 1
+            update = {"access_token": data["access_token"]}
+            if data.get("expires_in"):
+                update["token_expires_at"] = time.time() + float(data["expires_in"])
+            self.save(update)
+            return data
+
+    def refresh_soon(self, login):
+        """Proactively refresh in the background if the token is close to expiry.
+
+        Blocks (single-flight) only if the token has already expired.
+        """
+        remaining = self.expires_in()
+        if remaining is None or remaining > self.refresh_margin:
+            return
+        if remaining <= 0:
+            self.refresh(login, stale_token=self.access_token)
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh(login, stale_token=self.access_token)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="token-refresh", daemon=True).start()
+
+    def stats(self):
+        remaining = self.expires_in()
+        return {
+            "logins": self.logins,
+            "login_failures": self.login_failures,
+            "coalesced": self.coalesced,
+            "expires_in": None if remaining is None else round(remaining),
+        }
@@ -0,0 +1,145 @@
+"""
+Parallel, resumable reference downloads.
+
+Fetches a character's reference images with bounded concurrency. Each file is
+retried with exponential backoff, written to a `.part` temp file and renamed
+into place only once complete, and recorded in a small manifest so a second
+run (e.g. re-finalizing the same SetChar) skips files that are already on
+disk and verified.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+MANIFEST_NAME = ".downloads.json"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _ext_for(content_type):
+    if 'jpeg' in content_type or 'jpg' in content_type:
+        return '.jpg'
+    if 'webp' in content_type:
+        return '.webp'
+    return '.png'
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(dest_dir):
+    try:
+        with open(Path(dest_dir) / MANIFEST_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _save_manifest(dest_dir, manifest):
+    target = Path(dest_dir) / MANIFEST_NAME
+    tmp = target.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, target)
+
+
+def _verified(dest_dir, entry, url):
+    """True if a manifest entry still matches the file on disk."""
+    if not entry or entry.get("url") != url:
+        return False
+    path = Path(dest_dir) / entry.get("filename", "")
+    try:
+        return path.stat().st_size == entry.get("size") and _sha256(path) == entry.get("sha256")
+    except OSError:
+        return False
+
+
+def _download_one(client, index, url, dest_dir, retries, backoff):
+    """Download a single reference with retries. Returns a report dict."""
+    report = {"index": index, "url": url, "filename": None, "ok": False,
+              "skipped": False, "bytes": 0, "attempts": 0, "error": None}
+    for attempt in range(1, retries + 1):
+        report["attempts"] = attempt
+        tmp = None
+        try:
+            resp = client.get(url, endpoint="asset_fetch", auth=False, stream=True)
+            with resp:
+                if resp.status_code != 200:
+                    report["error"] = f"HTTP {resp.status_code}"
+                    if resp.status_code not in RETRY_STATUSES:
+                        return report
+                    raise IOError(report["error"])
+                filename = f"ref_{index + 1:02d}{_ext_for(resp.headers.get('content-type', ''))}"
+                final = Path(dest_dir) / filename
+                tmp = final.with_name(filename + ".part")
+                h = hashlib.sha256()
+                size = 0
+                with open(tmp, "wb") as f:
+                    for chunk in resp.iter_content(65536):
+                        f.write(chunk)
+                        h.update(chunk)
+                        size += len(chunk)
+                expected = resp.headers.get("content-length")
+                if expected and expected.isdigit() and int(expected) != size and not resp.headers.get("content-encoding"):
+                    raise IOError(f"truncated download ({size}/{expected} bytes)")
+                os.replace(tmp, final)
+            report.update(filename=filename, ok=True, bytes=size, sha256=h.hexdigest(), error=None)
+            return report
+        except Exception as e:
+            report["error"] = report["error"] or str(e)
+            if tmp is not None and tmp.exists():
+                tmp.unlink()
+            if attempt < retries:
+                time.sleep(backoff * (2 ** (attempt - 1)))
+                report["error"] = None
+    return report
+
+
+def download_references(client, urls, dest_dir, workers=6, retries=3, backoff=1.0, on_file=None):
+    """Download `urls` into `dest_dir` as ref_01.png, ref_02.jpg, ...
+
+    Returns one report per URL, in input order:
+    {index, url, filename, ok, skipped, bytes, attempts, error}.
+    `on_file(report)` is called as each file finishes (or is skipped).
+    """
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(dest_dir)
+
+    reports = [None] * len(urls)
+    todo = []
+    for i, url in enumerate(urls):
+        entry = manifest.get(str(i))
+        if _verified(dest_dir, entry, url):
+            reports[i] = {"index": i, "url": url, "filename": entry["filename"], "ok": True,
+                          "skipped": True, "bytes": entry["size"], "attempts": 0, "error": None}
+            if on_file:
+                on_file(reports[i])
+        else:
+            todo.append((i, url))
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo))),
+                                thread_name_prefix="ref-download") as pool:
+            futures = [pool.submit(_download_one, client, i, url, dest_dir, retries, backoff)
+                       for i, url in todo]
+            for fut in as_completed(futures):
+                r = fut.result()
+                reports[r["index"]] = r
+                if on_file:
+                    on_file(r)
+
+    for r in reports:
+        if r["ok"] and not r["skipped"]:
+            manifest[str(r["index"])] = {"url": r["url"], "filename": r["filename"],
+                                         "size": r["bytes"], "sha256": r.pop("sha256")}
+    _save_manifest(dest_dir, manifest)
+    return reports
@@ -0,0 +1,406 @@
+"""
+Gallery store.
+
+Every completed generation is mirrored into a local, content-addressed store
+(`<root>/blobs/ab/<sha256>.png`), so gallery images survive the upstream
+download URLs expiring and identical images are kept once. Metadata lives in
+a small SQLite index that backs the paged, filterable `/api/gallery`
+endpoint. Once the blobs grow past the size quota, the least recently viewed
+images are evicted.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from thumbnails import ThumbnailCache
+
+log = logging.getLogger(__name__)
+
+MIMETYPES = {".png": "image/png", ".jpg": "image/jpeg", ".webp": "image/webp"}
+
+
+def _ext_for(content_type):
+    if 'jpeg' in content_type or 'jpg' in content_type:
+        return '.jpg'
+    if 'webp' in content_type:
+        return '.webp'
+    return '.png'
+
+
+def _timestamp(value):
+    """Epoch seconds from an ISO date string or a number (None → now)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class GalleryStore:
+    """Local mirror of generated images plus a queryable metadata index.
+
+    `client` is the shared `UpstreamClient`, used to fetch download URLs.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS items (
+        id          TEXT PRIMARY KEY,
+        kind        TEXT,
+        character   TEXT,
+        prompt      TEXT,
+        source_url  TEXT,
+        sha256      TEXT,
+        state       TEXT NOT NULL,
+        error       TEXT,
+        created_at  REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_items_created ON items(created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_items_kind ON items(kind, created_at);
+    CREATE INDEX IF NOT EXISTS idx_items_character ON items(character, created_at);
+    CREATE INDEX IF NOT EXISTS idx_items_sha256 ON items(sha256);
+    CREATE TABLE IF NOT EXISTS blobs (
+        sha256       TEXT PRIMARY KEY,
+        ext          TEXT NOT NULL,
+        bytes        INTEGER NOT NULL,
+        width        INTEGER,
+        height       INTEGER,
+        last_access  REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_blobs_last_access ON blobs(last_access);
+    """
+
+    def __init__(self, root, client, max_bytes=2 * 1024 ** 3, workers=2, retries=3):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.client = client
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.thumbnails = ThumbnailCache(self.root / ".thumbs")
+
+        self._conn = sqlite3.connect(str(self.root / "gallery.sqlite3"), timeout=30,
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._touched = {}          # sha256 -> last access, flushed in batches
+        self._inflight = set()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gallery-mirror")
+        self.mirrored = 0
+        self.dedup_hits = 0
+        self.evicted = 0
+
+    # ── Writes ────────────────────────────────
+
+    def resume(self):
+        """Restart mirrors that were interrupted by a shutdown."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, source_url FROM items WHERE state = 'pending' AND source_url IS NOT NULL"
+            ).fetchall()
+        for gid, url in rows:
+            self._schedule(gid, url)
+
+    def add(self, gid, url=None, kind=None, character=None, prompt=None, created_at=None):
+        """Record a generation; once `url` is known the image is mirrored in the background.
+
+        Calling again for a known ID only fills in missing fields, so the
+        generate routes (metadata) and the poller (URL) can each report what
+        they know.
+        """
+        if not gid:
+            return
+        with self._transaction() as cur:
+            cur.execute(
+                "INSERT INTO items (id, kind, character, prompt, source_url, state, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?) "
+                "ON CONFLICT(id) DO UPDATE SET kind = COALESCE(items.kind, excluded.kind), "
+                "character = COALESCE(items.character, excluded.character), "
+                "prompt = COALESCE(items.prompt, excluded.prompt), "
+                "source_url = COALESCE(excluded.source_url, items.source_url)",
+                (gid, kind, character or None, prompt or None, url, _timestamp(created_at)),
+            )
+            state, source_url = cur.execute(
+                "SELECT state, source_url FROM items WHERE id = ?", (gid,)).fetchone()
+        if state == "pending" and source_url:
+            self._schedule(gid, source_url)
+
+    def delete(self, gid):
+        with self._transaction() as cur:
+            row = cur.execute("SELECT sha256 FROM items WHERE id = ?", (gid,)).fetchone()
+            if row is None:
+                return False
+            cur.execute("DELETE FROM items WHERE id = ?", (gid,))
+            orphan = row[0] and not cur.execute(
+                "SELECT 1 FROM items WHERE sha256 = ? LIMIT 1", (row[0],)).fetchone()
+            removed = self._drop_blob(cur, row[0]) if orphan else None
+        if removed:
+            self._unlink_blob(*removed)
+        return True
+
+    def clear(self):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM items")
+            cur.execute("DELETE FROM blobs")
+            self._touched.clear()
+        shutil.rmtree(self.blob_dir, ignore_errors=True)
+        shutil.rmtree(self.thumbnails.cache_dir, ignore_errors=True)
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+
+    # ── Reads ─────────────────────────────────
+
+    def page(self, limit=60, cursor=None, kind=None, character=None, q=None):
+        """One page of items, newest first.
+
+        `cursor` is the `next_cursor` of the previous page (keyset paging, so
+        deep pages cost the same as the first). Returns
+        {items, total, next_cursor}.
+        """
+        where = ["(i.sha256 IS NOT NULL OR i.source_url IS NOT NULL)"]
+        params = []
+        if kind:
+            where.append("i.kind = ?")
+            params.append(kind)
+        if character:
+            where.append("i.character = ?")
+            params.append(character)
+        if q:
+            where.append("i.prompt LIKE ? ESCAPE '\\'")
+            params.append("%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        count_sql = f"SELECT COUNT(*) FROM items i WHERE {' AND '.join(where)}"
+        count_params = list(params)
+        if cursor:
+            try:
+                ts, cid = cursor.split(":", 1)
+                where.append("(i.created_at < ? OR (i.created_at = ? AND i.id < ?))")
+                params += [float(ts), float(ts), cid]
+            except ValueError:
+                pass
+        sql = (
+            "SELECT i.id, i.kind, i.character, i.prompt, i.source_url, i.state, i.created_at, "
+            "b.sha256, b.ext, b.bytes, b.width, b.height "
+            "FROM items i LEFT JOIN blobs b ON b.sha256 = i.sha256 "
+            f"WHERE {' AND '.join(where)} ORDER BY i.created_at DESC, i.id DESC LIMIT ?"
+        )
+        with self._lock:
+            total = self._conn.execute(count_sql, count_params).fetchone()[0]
+            rows = self._conn.execute(sql, params + [limit + 1]).fetchall()
+
+        items = [self._public(r) for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f"{last[6]!r}:{last[0]}"
+        return {"items": items, "total": total, "next_cursor": next_cursor}
+
+    def open_blob(self, sha256, width=None, fmt="webp"):
+        """(path, mimetype) of a stored image, or of a thumbnail when `width` is
+        given. None if the blob isn't in the store."""
+        with self._lock:
+            row = self._conn.execute("SELECT ext FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                return None
+            self._touched[sha256] = time.time()
+        path = self._blob_path(sha256, row[0])
+        if not path.exists():
+            return None
+        if width:
+            thumb = self.thumbnails.get(sha256[:2], path, width, fmt)
+            if thumb:
+                return thumb
+        return path, MIMETYPES.get(row[0], "application/octet-stream")
+
+    def characters_for(self, gids):
+        """{generation ID: character slug} for those of `gids` made with a character."""
+        gids = [g for g in gids if g]
+        found = {}
+        with self._lock:
+            for i in range(0, len(gids), 500):
+                chunk = gids[i:i + 500]
+                found.update(self._conn.execute(
+                    f"SELECT id, character FROM items WHERE character IS NOT NULL "
+                    f"AND id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return found
+
+    def stats(self):
+        with self._lock:
+            items, pending = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(state = 'pending'), 0) FROM items").fetchone()
+            blobs, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM blobs").fetchone()
+        return {
+            "items": items,
+            "pending": pending,
+            "blobs": blobs,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "mirrored": self.mirrored,
+            "dedup_hits": self.dedup_hits,
+            "evicted": self.evicted,
+        }
+
+    # ── Mirroring ─────────────────────────────
+
+    def _schedule(self, gid, url):
+        with self._lock:
+            if gid in self._inflight:
+                return
+            self._inflight.add(gid)
+        self._pool.submit(self._mirror, gid, url)
+
+    def _mirror(self, gid, url):
+        try:
+            error = None
+            for attempt in range(1, self.retries + 1):
+                try:
+                    sha, ext, size = self._fetch(gid, url)
+                    break
+                except Exception as e:
+                    error = str(e)
+                    if attempt < self.retries:
+                        time.sleep(2 ** attempt)
+            else:
+                log.warning("[GALLERY] Could not mirror %s...: %s", gid[:8], error)
+                with self._transaction() as cur:
+                    cur.execute("UPDATE items SET state = 'failed', error = ? WHERE id = ?", (error, gid))
+                return
+
+            width = height = None
+            try:
+                from PIL import Image
+                with Image.open(self._blob_path(sha, ext)) as img:
+                    width, height = img.size
+            except Exception:
+                pass
+            with self._transaction() as cur:
+                cur.execute(
+                    "INSERT OR IGNORE INTO blobs (sha256, ext, bytes, width, height, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (sha, ext, size, width, height, time.time()))
+                cur.execute("UPDATE items SET sha256 = ?, state = 'ready', error = NULL WHERE id = ?",
+                            (sha, gid))
+            self.mirrored += 1
+            self._evict()
+        finally:
+            with self._lock:
+                self._inflight.discard(gid)
+
+    def _fetch(self, gid, url):
+        """Download `url` into the blob store. Returns (sha256, ext, bytes)."""
+        tmp = self.blob_dir / f".{gid}.part"
+        try:
+            resp = self.client.get(url, endpoint="asset_fetch", auth=False, stream=True)
+            with resp:
+                if resp.status_code != 200:
+                    raise IOError(f"HTTP {resp.status_code}")
+                ext = _ext_for(resp.headers.get("content-type", ""))
+                h = hashlib.sha256()
+                size = 0
+                with open(tmp, "wb") as f:
+                    for chunk in resp.iter_content(65536):
+                        f.write(chunk)
+                        h.update(chunk)
+                        size += len(chunk)
+            sha = h.hexdigest()
+            final = self._blob_path(sha, ext)
+            if final.exists():
+                self.dedup_hits += 1
+                tmp.unlink()
+            else:
+                final.parent.mkdir(exist_ok=True)
+                os.replace(tmp, final)
+            return sha, ext, size
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    # ── Eviction ──────────────────────────────
+
+    def _evict(self):
+        """Drop least recently viewed blobs (and their items) until the store
+        is back under 90% of its quota."""
+        removed = []
+        with self._transaction() as cur:
+            total = cur.execute("SELECT COALESCE(SUM(bytes), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            target = self.max_bytes * 0.9
+            for sha, size in cur.execute(
+                    "SELECT sha256, bytes FROM blobs ORDER BY last_access").fetchall():
+                if total <= target:
+                    break
+                cur.execute("DELETE FROM items WHERE sha256 = ?", (sha,))
+                removed.append(self._drop_blob(cur, sha))
+                total -= size
+        for sha, ext in removed:
+            self._unlink_blob(sha, ext)
+        self.evicted += len(removed)
+        log.info("[GALLERY] Evicted %d image(s) to stay under the size quota", len(removed))
+
+    def _drop_blob(self, cur, sha):
+        ext = cur.execute("SELECT ext FROM blobs WHERE sha256 = ?", (sha,)).fetchone()[0]
+        cur.execute("DELETE FROM blobs WHERE sha256 = ?", (sha,))
+        self._touched.pop(sha, None)
+        return sha, ext
+
+    def _unlink_blob(self, sha, ext):
+        try:
+            self._blob_path(sha, ext).unlink()
+        except OSError:
+            pass
+        self.thumbnails.invalidate_file(sha[:2], f"{sha}{ext}")
+
+    # ── Internals ─────────────────────────────
+
+    def _blob_path(self, sha, ext):
+        return self.blob_dir / sha[:2] / f"{sha}{ext}"
+
+    def _public(self, row):
+        gid, kind, character, prompt, source_url, state, created_at, sha, ext, size, w, h = row
+        local = f"/api/gallery/blobs/{sha}" if sha else None
+        return {
+            "id": gid,
+            "kind": kind,
+            "character": character,
+            "prompt": prompt,
+            "state": state,
+            "created_at": _iso(created_at),
+            "url": local or source_url,
+            "thumb_url": f"{local}?w=256&fmt=webp" if local else source_url,
+            "source_url": source_url,
+            "bytes": size,
+            "width": w,
+            "height": h,
+        }
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._conn.cursor()
+                if self._touched:
+                    cur.executemany("UPDATE blobs SET last_access = ? WHERE sha256 = ?",
+                                    [(ts, sha) for sha, ts in self._touched.items()])
+                    self._touched.clear()
+                yield cur
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
@@ -0,0 +1,184 @@
+"""
+Background jobs.
+
+Long-running work (downloading a character's references, and anything else
+that would otherwise hold a Flask worker for minutes) runs on a small thread
+pool. Routes get a job handle back immediately; progress and the final result
+are queryable via `JobManager.get()` and streamable via `wait_for_change()`.
+
+A job function can raise `RetryLater(delay)` to be run again after a delay.
+The job then sits in the "retrying" state on a timer queue, so waiting for a
+retry never occupies a pool thread.
+"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Counter, Histogram
+
+log = logging.getLogger(__name__)
+
+TERMINAL_STATES = {"completed", "failed"}
+
+JOB_SECONDS = Histogram("cis_job_attempt_seconds", "Run time of one job attempt, by kind and outcome",
+                        ("kind", "outcome"))
+JOB_RETRIES = Counter("cis_job_retries_total", "Job attempts that asked to be retried later", ("kind",))
+
+
+class RetryLater(Exception):
+    """Raised by a job function to be called again in `delay` seconds."""
+
+    def __init__(self, delay, reason=""):
+        super().__init__(reason)
+        self.delay = delay
+        self.reason = reason
+
+
+def backoff_delay(attempt, base=5.0, cap=60.0):
+    """Exponential backoff with jitter: a random delay in the upper half of
+    min(cap, base × 2^(attempt-1)), so simultaneous retries spread out."""
+    ceiling = min(cap, base * 2 ** (attempt - 1))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class Job:
+    """State of one background job. Mutate only through its methods."""
+
+    def __init__(self, manager, kind, meta=None):
+        self._manager = manager
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.state = "queued"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self.next_attempt_at = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+
+    def set_progress(self, **progress):
+        self._manager._change(self, progress=dict(self.progress, **progress))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "meta": self.meta,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "attempts": self.attempts,
+            "next_attempt_at": (time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.next_attempt_at))
+                                if self.next_attempt_at else None),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.created_at)),
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.updated_at)),
+        }
+
+    @property
+    def done(self):
+        return self.state in TERMINAL_STATES
+
+
+class JobManager:
+    """Runs `fn(job, *args)` on a thread pool and tracks its state."""
+
+    def __init__(self, max_workers=4, retain_seconds=3600):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self.retain_seconds = retain_seconds
+        self._delayed = []          # heap of (due, seq, job, fn, args)
+        self._seq = 0
+        self._timer = None
+
+    def submit(self, kind, fn, *args, meta=None):
+        job = Job(self, kind, meta)
+        with self._cond:
+            self._evict()
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list(self, kind=None):
+        with self._cond:
+            return [j for j in self._jobs.values() if kind is None or j.kind == kind]
+
+    def wait_for_change(self, job, since_version, timeout):
+        """Block until `job.version` moves past `since_version` or timeout."""
+        with self._cond:
+            if job.version == since_version:
+                self._cond.wait(timeout)
+            return job.version
+
+    def stats(self):
+        with self._cond:
+            counts = {}
+            for j in self._jobs.values():
+                counts[j.state] = counts.get(j.state, 0) + 1
+            return counts
+
+    # ── Internals ─────────────────────────────
+
+    def _change(self, job, **fields):
+        with self._cond:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+            job.version += 1
+            self._cond.notify_all()
+
+    def _run(self, job, fn, args):
+        self._change(job, state="running", attempts=job.attempts + 1, next_attempt_at=None)
+        start = time.perf_counter()
+        try:
+            result = fn(job, *args)
+        except RetryLater as r:
+            JOB_SECONDS.observe(time.perf_counter() - start, kind=job.kind, outcome="retry")
+            JOB_RETRIES.inc(kind=job.kind)
+            due = time.time() + r.delay
+            self._change(job, state="retrying", next_attempt_at=due, error=r.reason or None)
+            self._schedule(due, job, fn, args)
+        except Exception as e:
+            JOB_SECONDS.observe(time.perf_counter() - start, kind=job.kind, outcome="failed")
+            log.error("[JOBS] %s %s failed: %s", job.kind, job.id[:8], e, exc_info=True)
+            self._change(job, state="failed", error=str(e))
+        else:
+            JOB_SECONDS.observe(time.perf_counter() - start, kind=job.kind, outcome="completed")
+            self._change(job, state="completed", result=result, error=None)
+
+    def _schedule(self, due, job, fn, args):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._delayed, (due, self._seq, job, fn, args))
+            if self._timer is None or not self._timer.is_alive():
+                self._timer = threading.Thread(target=self._timer_loop, name="job-timer", daemon=True)
+                self._timer.start()
+            self._cond.notify_all()
+
+    def _timer_loop(self):
+        """Hand delayed jobs back to the pool when they're due."""
+        while True:
+            with self._cond:
+                while not self._delayed or self._delayed[0][0] > time.time():
+                    timeout = self._delayed[0][0] - time.time() if self._delayed else 60
+                    self._cond.wait(max(0.05, timeout))
+                _, _, job, fn, args = heapq.heappop(self._delayed)
+            self._pool.submit(self._run, job, fn, args)
+
+    def _evict(self):
+        cutoff = time.time() - self.retain_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.updated_at < cutoff]:
+            del self._jobs[job_id]
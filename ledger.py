@@ -0,0 +1,355 @@
+"""
+Local ledger of credit transactions.
+
+The API only pages through transaction history, newest first. This module
+mirrors it into SQLite so history views, filters and usage reports are local
+queries. A sync walks the newest pages until it reaches a transaction it
+already has, so a routine sync is one or two upstream calls. The first sync
+of an account backfills the older history a bounded number of pages at a
+time; where to resume is kept in the database, so an interrupted backfill
+carries on from there on the next sync.
+
+Charges for generations are attributed to a character by looking the
+generation ID up in the gallery, which records the character at submission.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from gallery import _iso, _timestamp
+
+log = logging.getLogger(__name__)
+
+# Aggregations `summary()` can group by: name -> SQL expression
+GROUPS = {
+    "day": "strftime('%Y-%m-%d', created_at, 'unixepoch')",
+    "month": "strftime('%Y-%m', created_at, 'unixepoch')",
+    "type": "COALESCE(type, '')",
+    "character": "COALESCE(character, '')",
+}
+
+
+def _tx_id(tx):
+    tx_id = tx.get("id") or tx.get("transaction_id")
+    if tx_id is not None:
+        return str(tx_id)
+    # No ID from the API: the content is the identity
+    return "sha256:" + hashlib.sha256(json.dumps(tx, sort_keys=True).encode()).hexdigest()
+
+
+def _filter_time(value):
+    """Epoch seconds for a `since`/`until` filter: a number, or an ISO date or
+    datetime. Dates without a zone are UTC, like the day and month groups.
+    Raises ValueError for anything else."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        ts = float(value)
+    else:
+        text = str(value).strip()
+        try:
+            ts = float(text)
+        except ValueError:
+            try:
+                dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+            except ValueError:
+                raise ValueError(f"not a date or epoch seconds: {value!r}") from None
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            ts = dt.timestamp()
+    if not math.isfinite(ts):
+        raise ValueError(f"not a date or epoch seconds: {value!r}")
+    return ts
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _generation_id(tx):
+    meta = tx.get("metadata") if isinstance(tx.get("metadata"), dict) else {}
+    return tx.get("generation_id") or meta.get("generation_id") or tx.get("reference_id")
+
+
+class TransactionLedger:
+    """SQLite mirror of the account's credit transactions.
+
+    `client` is the shared `UpstreamClient`; `characters_for(ids)` maps
+    generation IDs to character slugs (the gallery's lookup).
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS transactions (
+        id            TEXT PRIMARY KEY,
+        created_at    REAL NOT NULL,
+        type          TEXT,
+        amount        REAL NOT NULL,
+        balance_after REAL,
+        generation_id TEXT,
+        character     TEXT,
+        raw           TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_tx_created ON transactions(created_at, id);
+    CREATE INDEX IF NOT EXISTS idx_tx_type ON transactions(type, created_at);
+    CREATE INDEX IF NOT EXISTS idx_tx_character ON transactions(character, created_at);
+    CREATE TABLE IF NOT EXISTS meta (
+        key   TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """
+
+    def __init__(self, path, client, characters_for=None, page_size=100, max_pages=20, min_sync_interval=60.0):
+        self.client = client
+        self.characters_for = characters_for
+        self.page_size = page_size
+        self.max_pages = max_pages              # upstream pages per sync
+        self.min_sync_interval = min_sync_interval
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._last_sync = 0.0
+        self.last_error = None
+        self.upstream_pages = 0
+
+    # ── Sync ──────────────────────────────────
+
+    def sync_if_stale(self, account):
+        """Sync unless one ran in the last `min_sync_interval` seconds for the
+        same account (or one is running)."""
+        if time.monotonic() - self._last_sync < self.min_sync_interval and self._meta("account") == account:
+            return None
+        return self.sync(account, wait=False)
+
+    def sync(self, account, wait=True):
+        """Fetch transactions newer than the newest stored one, then continue
+        an unfinished backfill. Returns {added, pages, complete}, or None if
+        another sync was running and `wait` is False.
+
+        `account` identifies whose history is stored; a different account
+        starts a fresh ledger.
+        """
+        if not self._sync_lock.acquire(blocking=wait):
+            return None
+        try:
+            self._reset_if_other(account)
+            # Page where not yet fetched history may start (None: nothing is
+            # missing), and whether the oldest transaction was ever reached —
+            # after that, a backfill only has to close one gap below the head
+            resume = self._meta("resume_page")
+            resume = int(resume) if resume else None
+            complete = self._meta("oldest_reached") == "1"
+            page, pages, added, head, seen_new = 1, 0, 0, True, False
+            try:
+                while pages < self.max_pages:
+                    txs = self._fetch(page)
+                    pages += 1
+                    if not txs:
+                        resume, complete = None, True
+                        break
+                    fresh = self._insert(txs)
+                    added += sum(fresh)
+                    if head:
+                        if all(fresh):
+                            page += 1
+                            continue
+                        # Caught up with stored history; continue the backfill, if any
+                        if resume is None:
+                            break
+                        head = False
+                        page = max(resume, page + 1)
+                        continue
+                    if complete and self._closes_gap(fresh, seen_new):
+                        resume = None
+                        break
+                    seen_new = seen_new or any(fresh)
+                    page += 1
+                    resume = page
+                else:
+                    resume, complete = self._stopped(page, resume, head, complete)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                log.warning("[LEDGER] Sync stopped at page %d: %s", page, e)
+                if page > 1:
+                    resume, complete = self._stopped(page, resume, head, complete)
+            self._set_meta("resume_page", "" if resume is None else str(resume))
+            self._set_meta("oldest_reached", "1" if complete else "")
+            self._set_meta("synced_at", str(time.time()))
+            self._last_sync = time.monotonic()
+            self.upstream_pages += pages
+            if added:
+                log.info("[LEDGER] %d new transactions (%d pages)", added, pages)
+            return {"added": added, "pages": pages, "complete": complete and resume is None}
+        finally:
+            self._sync_lock.release()
+
+    # ── Queries ───────────────────────────────
+
+    def query(self, limit=50, offset=0, since=None, until=None, type=None, character=None):
+        """Transactions newest first: {transactions, total}. `since` is
+        inclusive and `until` exclusive (epoch seconds or ISO dates, UTC
+        unless they say otherwise). Raises ValueError for an invalid date."""
+        where, params = self._filters(since, until, type, character)
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM transactions {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT raw, character FROM transactions {where} "
+                "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+        items = []
+        for raw, character in rows:
+            tx = json.loads(raw)
+            if character:
+                tx["character"] = character
+            items.append(tx)
+        return {"transactions": items, "total": total}
+
+    def summary(self, group="day", since=None, until=None, type=None, character=None):
+        """Counts and credit sums per group (see GROUPS), newest/largest key
+        first. Raises ValueError for an unknown group or an invalid date."""
+        if group not in GROUPS:
+            raise ValueError(f"unknown group: {group}")
+        where, params = self._filters(since, until, type, character)
+        key = GROUPS[group]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {key} AS k, COUNT(*), "
+                "COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0), "
+                "COALESCE(-SUM(CASE WHEN amount < 0 THEN amount END), 0), COALESCE(SUM(amount), 0) "
+                f"FROM transactions {where} GROUP BY k ORDER BY k DESC", params).fetchall()
+        return [{"key": k, "count": n, "credits_in": cin, "credits_out": cout, "net": net}
+                for k, n, cin, cout, net in rows]
+
+    def stats(self):
+        with self._lock:
+            count, oldest, newest = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at), MAX(created_at) FROM transactions").fetchone()
+        synced_at = self._meta("synced_at")
+        return {
+            "transactions": count,
+            "oldest": _iso(oldest) if oldest is not None else None,
+            "newest": _iso(newest) if newest is not None else None,
+            "complete": self._meta("oldest_reached") == "1" and self._meta("resume_page") == "",
+            "synced_at": _iso(float(synced_at)) if synced_at else None,
+            "upstream_pages": self.upstream_pages,
+            "last_error": self.last_error,
+        }
+
+    # ── Internals ─────────────────────────────
+
+    @staticmethod
+    def _stopped(page, resume, head, complete):
+        """(resume, complete) when a sync stops before fetching `page`.
+
+        While still on the head, every page fetched was entirely new, so there
+        may be unseen transactions between `page` and the stored history.
+        Pages only shift towards higher numbers as transactions arrive, so the
+        lower of two resume points is always safe — but with two gaps pending,
+        the backfill can no longer stop at the end of the first one.
+        """
+        if not head:
+            return page, complete
+        if resume is None:
+            return page, complete
+        return min(page, resume), False
+
+    @staticmethod
+    def _closes_gap(fresh, seen_new):
+        """True once a known transaction follows new ones: below it, history
+        was already stored."""
+        for is_new in fresh:
+            if is_new:
+                seen_new = True
+            elif seen_new:
+                return True
+        return False
+
+    def _fetch(self, page):
+        resp = self.client.get("/api/v1/credits/transactions", endpoint="transactions",
+                               params={"page": page, "limit": self.page_size})
+        if resp.status_code != 200:
+            raise RuntimeError(f"HTTP {resp.status_code}")
+        data = resp.json()
+        inner = data.get("data", data) if isinstance(data, dict) else data
+        if isinstance(inner, dict):
+            inner = inner.get("transactions") or inner.get("items") or []
+        return [tx for tx in inner if isinstance(tx, dict)] if isinstance(inner, list) else []
+
+    def _insert(self, txs):
+        """Store unknown transactions; returns, per transaction, whether it was new."""
+        characters = self.characters_for([_generation_id(tx) for tx in txs]) if self.characters_for else {}
+        rows = []
+        for tx in txs:
+            gid = _generation_id(tx)
+            rows.append((_tx_id(tx), _timestamp(tx.get("created_at")), tx.get("type") or tx.get("kind"),
+                         _number(tx.get("amount", tx.get("credits"))) or 0,
+                         _number(tx.get("balance_after", tx.get("balance"))),
+                         gid, characters.get(gid), json.dumps(tx)))
+        fresh = []
+        with self._transaction() as cur:
+            for row in rows:
+                cur.execute("INSERT OR IGNORE INTO transactions "
+                            "(id, created_at, type, amount, balance_after, generation_id, character, raw) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+                fresh.append(cur.rowcount == 1)
+        return fresh
+
+    def _filters(self, since, until, type, character):
+        where, params = [], []
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(_filter_time(since))
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(_filter_time(until))
+        if type:
+            where.append("type = ?")
+            params.append(type)
+        if character:
+            where.append("character = ?")
+            params.append(character)
+        return ("WHERE " + " AND ".join(where) if where else ""), params
+
+    def _reset_if_other(self, account):
+        stored = self._meta("account")
+        if stored == account:
+            return
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM transactions")
+            cur.execute("DELETE FROM meta")
+            cur.execute("INSERT INTO meta (key, value) VALUES ('account', ?)", (account,))
+        if stored is not None:
+            log.info("[LEDGER] Account changed — starting a new ledger")
+
+    def _meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        with self._transaction() as cur:
+            cur.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn.cursor()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
@@ -0,0 +1,492 @@
+"""
+Character packs: characters moved between machines as one archive.
+
+A pack holds each character's images as `characters/<slug>/<file>` and, as
+its last member, `pack.json` — the registry entries with the size and
+SHA-256 of every file. Export writes the archive (zip or tar) into the
+response while the files are read, hashing them on the way, so a pack of
+any size needs neither memory nor scratch space.
+
+Import reads a tar as it arrives; a zip is spooled to disk first, because
+its member index is at the end. Every file is hashed into a staging folder
+under characters/.cache, where content that occurs more than once is kept
+once. Nothing is moved into place until the whole archive has been checked
+against pack.json; files the library already has with the same content are
+left alone, and the entries are merged into the registry with one write.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+from registry import IMAGE_EXTS
+
+log = logging.getLogger(__name__)
+
+PACK_FORMAT = "cis-character-pack"
+PACK_VERSION = 1
+MANIFEST = "pack.json"
+MANIFEST_MAX_BYTES = 64 * 1024 * 1024
+CHUNK_BYTES = 1024 * 1024
+FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
+CONFLICT_POLICIES = ("skip", "replace")
+# Entry fields that only describe the machine that wrote them
+LOCAL_FIELDS = ("local_dir", "local_files")
+
+
+class PackError(ValueError):
+    """The archive is not a valid character pack."""
+
+
+def _safe_name(name):
+    """A single path component that can't escape or hide in its folder."""
+    return (isinstance(name, str) and 0 < len(name) <= 255 and not name.startswith(".")
+            and not any(c in name for c in "/\\\0") and name != "__pycache__")
+
+
+def _image_name(name):
+    return _safe_name(name) and os.path.splitext(name)[1].lower() in IMAGE_EXTS
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ──────────────────────────────────────────────
+# Export
+# ──────────────────────────────────────────────
+
+class _Sink:
+    """Write-only file object that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _ZipWriter:
+    """Zip to a non-seekable stream: sizes and CRCs go in data descriptors.
+    Images are stored as they are; only pack.json is deflated."""
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w", allowZip64=True)
+        self._member = None
+
+    def begin(self, name, size, mtime):
+        # Zip can't date anything before 1980 (a day's margin for local time)
+        info = zipfile.ZipInfo(name, time.localtime(max(mtime, 315619200))[:6])
+        info.external_attr = 0o644 << 16
+        info.file_size = size  # decides whether the member needs zip64
+        info.compress_type = zipfile.ZIP_DEFLATED if name == MANIFEST else zipfile.ZIP_STORED
+        self._member = self._zip.open(info, "w")
+        return self._sink.drain()
+
+    def write(self, chunk):
+        self._member.write(chunk)
+        return self._sink.drain()
+
+    def end(self):
+        self._member.close()
+        return self._sink.drain()
+
+    def close(self):
+        self._zip.close()
+        return self._sink.drain()
+
+
+class _TarWriter:
+    """POSIX (pax) tar, written block by block."""
+
+    def __init__(self):
+        self._offset = 0
+        self._size = 0
+
+    def begin(self, name, size, mtime):
+        info = tarfile.TarInfo(name)
+        info.size, info.mtime, info.mode = size, int(mtime), 0o644
+        self._size = size
+        return self._count(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+
+    def write(self, chunk):
+        return self._count(chunk)
+
+    def end(self):
+        return self._count(b"\0" * (-self._size % tarfile.BLOCKSIZE))
+
+    def close(self):
+        # End-of-archive marker, then padding to a whole record like tarfile
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(self._offset + end) % tarfile.RECORDSIZE
+        return self._count(b"\0" * end)
+
+    def _count(self, data):
+        self._offset += len(data)
+        return data
+
+
+def export_pack(characters_dir, entries, fmt="zip"):
+    """Generator of the pack's bytes for `entries` (registry entries), in
+    chunks of at most CHUNK_BYTES plus headers.
+
+    Files that can't be read are left out of the pack (and out of its
+    manifest). A file that shrinks while it is being sent aborts the export,
+    as its size is already in the archive.
+    """
+    for chunk in _pack_chunks(Path(characters_dir), entries, fmt):
+        if chunk:
+            yield chunk
+
+
+def _pack_chunks(characters_dir, entries, fmt):
+    writer = _ZipWriter() if fmt == "zip" else _TarWriter()
+    listed = []
+    for entry in entries:
+        slug = entry["slug"]
+        files = []
+        for name in entry.get("local_files") or []:
+            if not _image_name(name):
+                continue
+            try:
+                f = open(characters_dir / slug / name, "rb")
+            except OSError as e:
+                log.warning("[PACK] Skipping %s/%s: %s", slug, name, e)
+                continue
+            with f:
+                st = os.fstat(f.fileno())
+                digest = hashlib.sha256()
+                yield writer.begin(f"characters/{slug}/{name}", st.st_size, st.st_mtime)
+                remaining = st.st_size
+                while remaining:
+                    chunk = f.read(min(CHUNK_BYTES, remaining))
+                    if not chunk:
+                        raise PackError(f"{slug}/{name} changed while it was being exported")
+                    remaining -= len(chunk)
+                    digest.update(chunk)
+                    yield writer.write(chunk)
+                yield writer.end()
+            files.append({"name": name, "size": st.st_size, "sha256": digest.hexdigest()})
+        listed.append({"entry": {k: v for k, v in entry.items() if k not in LOCAL_FIELDS},
+                       "files": files})
+
+    manifest = json.dumps({
+        "format": PACK_FORMAT,
+        "version": PACK_VERSION,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "characters": listed,
+    }, ensure_ascii=False, indent=1).encode()
+    yield writer.begin(MANIFEST, len(manifest), time.time())
+    yield writer.write(manifest)
+    yield writer.end()
+    yield writer.close()
+
+
+# ──────────────────────────────────────────────
+# Import
+# ──────────────────────────────────────────────
+
+class _Prefixed:
+    """A read stream with bytes that were already read put back in front."""
+
+    def __init__(self, head, stream):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size=-1):
+        if self._head:
+            if size is None or size < 0:
+                data, self._head = self._head + self._stream.read(), b""
+                return data
+            data, self._head = self._head[:size], self._head[size:]
+            return data
+        return self._stream.read(size)
+
+
+class PackImporter:
+    """Imports packs into `characters_dir` and `registry` (a `CharacterRegistry`).
+
+    `on_folder_changed(folder)` is called for every character folder that
+    received files, so caches keyed on its contents can be dropped.
+    """
+
+    def __init__(self, characters_dir, registry, on_folder_changed=None,
+                 max_file_bytes=512 * 1024 * 1024):
+        self.characters_dir = Path(characters_dir)
+        self.staging_root = self.characters_dir / ".cache" / "imports"
+        self.registry = registry
+        self.on_folder_changed = on_folder_changed
+        self.max_file_bytes = max_file_bytes
+        self._lock = threading.Lock()   # one import places files at a time
+        self.imports = 0
+        self.characters = 0
+        self.files_written = 0
+        self.files_unchanged = 0        # already in the library with the same content
+        self._remove_stale_staging()
+
+    def import_pack(self, stream, on_conflict="skip"):
+        """Import the zip or tar read from `stream`. `on_conflict` says what
+        happens to characters the library already has: "skip" keeps the local
+        one, "replace" takes the pack's entry and images (local images the
+        pack doesn't have stay). Returns a report; raises PackError."""
+        if on_conflict not in CONFLICT_POLICIES:
+            raise PackError(f"on_conflict must be one of {', '.join(CONFLICT_POLICIES)}")
+        self.staging_root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix="pack-", dir=self.staging_root))
+        try:
+            head = stream.read(4)
+            if head.startswith(b"PK\x03\x04"):
+                members = self._zip_members(_Prefixed(head, stream), staging)
+            else:
+                members = self._tar_members(_Prefixed(head, stream))
+            blobs, received, manifest = self._receive(members, staging)
+            plan = self._check(manifest, received)
+            with self._lock:
+                report = self._place(plan, blobs, on_conflict)
+            report["duplicates_in_pack"] = len(received) - len(blobs)
+            return report
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def stats(self):
+        return {"imports": self.imports, "characters": self.characters,
+                "files_written": self.files_written, "files_unchanged": self.files_unchanged}
+
+    # ── Reading ───────────────────────────────
+
+    @staticmethod
+    def _tar_members(stream):
+        """(name, file object) per regular file, reading `stream` once."""
+        try:
+            tar = tarfile.open(fileobj=stream, mode="r|*")
+        except tarfile.TarError as e:
+            raise PackError(f"not a zip or tar archive ({e})") from None
+        with tar:
+            while True:
+                try:
+                    member = tar.next()
+                except tarfile.TarError as e:
+                    raise PackError(f"damaged tar archive ({e})") from None
+                if member is None:
+                    return
+                tar.members.clear()  # stream mode: nothing to look back at
+                if member.isdir():
+                    continue
+                if not member.isfile():
+                    raise PackError(f"{member.name}: only regular files are allowed")
+                yield member.name, tar.extractfile(member)
+
+    @staticmethod
+    def _zip_members(stream, staging):
+        """Spool the zip to disk (its index is at the end), then yield
+        (name, file object) per file."""
+        path = staging / "upload.zip"
+        with open(path, "wb") as f:
+            shutil.copyfileobj(stream, f, CHUNK_BYTES)
+        try:
+            archive = zipfile.ZipFile(path)
+        except zipfile.BadZipFile as e:
+            raise PackError(f"damaged zip archive ({e})") from None
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                try:
+                    member = archive.open(info)
+                except (zipfile.BadZipFile, NotImplementedError) as e:
+                    raise PackError(f"{info.filename}: {e}") from None
+                with member:
+                    yield info.filename, member
+
+    def _receive(self, members, staging):
+        """Stage every file by content. Returns (blobs {sha256: path},
+        received {(slug, name): (sha256, size)}, manifest)."""
+        blobs, received, manifest = {}, {}, None
+        for name, member in members:
+            if name == MANIFEST:
+                data = member.read(MANIFEST_MAX_BYTES + 1)
+                if len(data) > MANIFEST_MAX_BYTES:
+                    raise PackError("pack.json is too large")
+                try:
+                    manifest = json.loads(data)
+                except ValueError as e:
+                    raise PackError(f"pack.json is not valid JSON ({e})") from None
+                continue
+            parts = name.split("/")
+            if len(parts) != 3 or parts[0] != "characters" or not _safe_name(parts[1]) \
+                    or not _image_name(parts[2]):
+                raise PackError(f"{name}: not a character image")
+            key = (parts[1], parts[2])
+            if key in received:
+                raise PackError(f"{name} appears twice")
+            received[key] = self._stage(member, staging, blobs, name)
+        if manifest is None:
+            raise PackError("pack.json is missing")
+        return blobs, received, manifest
+
+    def _stage(self, member, staging, blobs, name):
+        fd, tmp = tempfile.mkstemp(dir=staging, suffix=".part")
+        digest, size = hashlib.sha256(), 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while chunk := member.read(CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise PackError(f"{name} is larger than {self.max_file_bytes // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    f.write(chunk)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+            os.unlink(tmp)
+            raise PackError(f"{name}: {e}") from None
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        sha = digest.hexdigest()
+        if sha in blobs:
+            os.unlink(tmp)      # same content as an earlier member
+        else:
+            blobs[sha] = staging / sha
+            os.replace(tmp, blobs[sha])
+        return sha, size
+
+    def _check(self, manifest, received):
+        """Validate pack.json against the files that arrived and the library
+        it goes into. Returns [(entry, files)] in pack order."""
+        if not isinstance(manifest, dict) or manifest.get("format") != PACK_FORMAT:
+            raise PackError("pack.json is not a character pack manifest")
+        version = manifest.get("version")
+        if not isinstance(version, int) or version > PACK_VERSION:
+            raise PackError(f"pack version {version} is not supported (newest: {PACK_VERSION})")
+        items = manifest.get("characters")
+        if not isinstance(items, list):
+            raise PackError("pack.json has no character list")
+        reserved = {n.casefold() for n in self.registry.reserved_names()}
+        plan, slugs, listed = [], set(), set()
+        for item in items:
+            entry = item.get("entry") if isinstance(item, dict) else None
+            files = item.get("files") if isinstance(item, dict) else None
+            slug = entry.get("slug") if isinstance(entry, dict) else None
+            if not _safe_name(slug) or not isinstance(files, list):
+                raise PackError(f"invalid character in pack.json: {str(slug or item)[:80]}")
+            if slug in slugs:
+                raise PackError(f"character {slug} appears twice")
+            # Checked case-insensitively for case-insensitive file systems
+            if slug.casefold() in reserved:
+                raise PackError(f"{slug} is a reserved name and can't be a character")
+            folder = self.characters_dir / slug
+            if os.path.lexists(folder) and not folder.is_dir():
+                raise PackError(f"{slug} can't be imported: characters/{slug} exists and is not a folder")
+            slugs.add(slug)
+            for f in files:
+                name = f.get("name") if isinstance(f, dict) else None
+                if not _image_name(name):
+                    raise PackError(f"{slug}: invalid file entry {str(name or f)[:80]}")
+                got = received.get((slug, name))
+                if got is None:
+                    raise PackError(f"{slug}/{name} is listed in pack.json but not in the archive")
+                if got != (f.get("sha256"), f.get("size")):
+                    raise PackError(f"{slug}/{name} does not match its size or hash in pack.json")
+                listed.add((slug, name))
+            plan.append((entry, files))
+        extra = set(received) - listed
+        if extra:
+            slug, name = sorted(extra)[0]
+            raise PackError(f"{slug}/{name} is in the archive but not in pack.json")
+        return plan
+
+    # ── Placing ───────────────────────────────
+
+    def _place(self, plan, blobs, on_conflict):
+        placed = {}     # sha256 -> first file it was moved to
+        entries, skipped = [], []
+        written = unchanged = 0
+        for entry, files in plan:
+            slug = entry["slug"]
+            if on_conflict == "skip" and self.registry.get(slug) is not None:
+                skipped.append(slug)
+                continue
+            folder = self.characters_dir / slug
+            folder.mkdir(parents=True, exist_ok=True)
+            changed = False
+            for f in files:
+                target, sha = folder / f["name"], f["sha256"]
+                if self._has_content(target, f["size"], sha):
+                    unchanged += 1
+                    continue
+                if sha in placed:
+                    # Content the pack had more than once: copy the placed file
+                    tmp = target.with_name(target.name + ".part")
+                    shutil.copyfile(placed[sha], tmp)
+                    os.replace(tmp, target)
+                else:
+                    os.replace(blobs[sha], target)
+                    placed[sha] = target
+                written += 1
+                changed = True
+            names = [f["name"] for f in files]
+            local = sorted(e.name for e in os.scandir(folder)
+                           if e.is_file() and _image_name(e.name) and e.name not in names)
+            local_files = names + local
+            entries.append({
+                **{k: v for k, v in entry.items() if k not in LOCAL_FIELDS},
+                "local_files": local_files,
+                "local_dir": str(folder),
+                "reference_count": max(len(local_files), len(entry.get("reference_urls") or [])),
+                "status": "ready",
+            })
+            if changed and self.on_folder_changed:
+                self.on_folder_changed(folder)
+        self.registry.merge(entries)
+
+        self.imports += 1
+        self.characters += len(entries)
+        self.files_written += written
+        self.files_unchanged += unchanged
+        return {
+            "imported": [e["slug"] for e in entries],
+            "skipped": skipped,
+            "files_written": written,
+            "files_unchanged": unchanged,
+        }
+
+    def _remove_stale_staging(self, max_age=86400):
+        """Staging folders left behind by imports that were interrupted."""
+        if not self.staging_root.is_dir():
+            return
+        for folder in self.staging_root.glob("pack-*"):
+            try:
+                if folder.stat().st_mtime < time.time() - max_age:
+                    shutil.rmtree(folder, ignore_errors=True)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _has_content(path, size, sha):
+        try:
+            if path.stat().st_size != size:
+                return False
+            return _file_digest(path) == sha
+        except OSError:
+            return False
@@ -0,0 +1,228 @@
+"""
+Generation poll scheduler.
+
+Tracks every in-flight generation ID on the server and polls the upstream
+`asset/status` endpoint from a single background thread, instead of every
+browser tab polling each ID through its own Flask request. As soon as an ID
+completes its `asset/download` URL is fetched, and subscribers (the SSE
+stream and the batch status endpoint in app.py) are woken up.
+
+The poll interval adapts: it backs off on 429s (honouring `Retry-After`)
+and drifts back to the base interval while upstream is healthy.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DONE_STATES = {"completed", "succeeded", "done"}
+FAILED_STATES = {"failed", "error"}
+TERMINAL = {"completed", "failed"}
+
+
+class PollScheduler:
+    """Background poller shared by all clients of this process."""
+
+    def __init__(self, client, base_interval=2.5, max_interval=30.0, min_gap=0.2,
+                 task_timeout=300, download_retries=5, retain_seconds=1800, on_complete=None):
+        self.client = client
+        self.on_complete = on_complete          # called with (gid, download_url)
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.min_gap = min_gap                  # spacing between two upstream calls
+        self.task_timeout = task_timeout        # per-ID give-up time (5 min per SKILL.md)
+        self.download_retries = download_retries
+        self.retain_seconds = retain_seconds    # keep finished IDs around for late subscribers
+
+        self.interval = base_interval
+        self._paused_until = 0.0
+        self._tasks = {}                        # gid -> state dict
+        self._cond = threading.Condition()
+        self._version = 0
+        self._thread = None
+        self.upstream_calls = 0
+        self.rate_limited = 0
+
+    # ── Public API ────────────────────────────
+
+    def track(self, ids):
+        """Start tracking generation IDs (already-known IDs are left alone)."""
+        now = time.time()
+        with self._cond:
+            for gid in ids:
+                if gid and gid not in self._tasks:
+                    self._tasks[gid] = {
+                        "status": "pending",
+                        "download_url": None,
+                        "error": None,
+                        "first_seen": now,
+                        "next_check": now,
+                        "updated_at": now,
+                        "dl_attempts": 0,
+                    }
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def snapshot(self, ids):
+        """Public view of the given IDs: {gid: {status, download_url, error}}."""
+        with self._cond:
+            return {gid: self._public(gid) for gid in ids if gid in self._tasks}
+
+    def wait_for_change(self, since_version, timeout):
+        """Block until the state version moves past `since_version` or timeout.
+        Returns the current version."""
+        with self._cond:
+            if self._version == since_version:
+                self._cond.wait(timeout)
+            return self._version
+
+    @property
+    def version(self):
+        with self._cond:
+            return self._version
+
+    def all_terminal(self, ids):
+        with self._cond:
+            return all(self._tasks.get(gid, {}).get("status") in TERMINAL for gid in ids)
+
+    def stats(self):
+        with self._cond:
+            pending = sum(1 for t in self._tasks.values() if t["status"] not in TERMINAL)
+            return {
+                "tracked": len(self._tasks),
+                "pending": pending,
+                "interval": round(self.interval, 2),
+                "upstream_calls": self.upstream_calls,
+                "rate_limited": self.rate_limited,
+            }
+
+    # ── Internals ─────────────────────────────
+
+    def _public(self, gid):
+        t = self._tasks[gid]
+        return {"status": t["status"], "download_url": t["download_url"], "error": t["error"]}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="poll-scheduler", daemon=True)
+            self._thread.start()
+
+    def _update(self, gid, **changes):
+        """Apply changes to a task; subscribers are only woken when a public
+        field (status, download_url, error) actually changed."""
+        with self._cond:
+            t = self._tasks.get(gid)
+            if t is None:
+                return
+            visible = any(k in ("status", "download_url", "error") and t.get(k) != v
+                          for k, v in changes.items())
+            t.update(changes)
+            if visible:
+                t["updated_at"] = time.time()
+                self._version += 1
+                self._cond.notify_all()
+
+    def _due(self):
+        """IDs that need an upstream call now; also expires and evicts old IDs."""
+        now = time.time()
+        due = []
+        with self._cond:
+            for gid, t in list(self._tasks.items()):
+                if t["status"] in TERMINAL:
+                    if now - t["updated_at"] > self.retain_seconds:
+                        del self._tasks[gid]
+                    continue
+                if now - t["first_seen"] > self.task_timeout:
+                    t.update(status="failed", error="timed out", updated_at=now)
+                    self._version += 1
+                    self._cond.notify_all()
+                    continue
+                if t["next_check"] <= now:
+                    due.append(gid)
+        return due
+
+    def _has_pending(self):
+        with self._cond:
+            return any(t["status"] not in TERMINAL for t in self._tasks.values())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not any(t["status"] not in TERMINAL for t in self._tasks.values()):
+                    self._cond.wait(60)
+            wait = self._paused_until - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            for gid in self._due():
+                if time.time() < self._paused_until:
+                    break
+                self._poll_one(gid)
+                time.sleep(self.min_gap)
+            # Recover towards the base interval after a clean round
+            if time.time() >= self._paused_until:
+                self.interval = max(self.base_interval, self.interval * 0.8)
+            time.sleep(min(self.interval, 1.0) if self._has_pending() else 0)
+
+    def _rate_limited(self, resp):
+        self.rate_limited += 1
+        try:
+            retry_after = float(resp.headers.get("Retry-After", ""))
+        except ValueError:
+            retry_after = 15.0
+        self.interval = min(self.max_interval, self.interval * 2)
+        self._paused_until = time.time() + max(retry_after, self.interval)
+        log.info("[POLLER] Rate limited — pausing %.0fs", max(retry_after, self.interval))
+
+    def _poll_one(self, gid):
+        self._update(gid, next_check=time.time() + self.interval)
+        try:
+            self.upstream_calls += 1
+            resp = self.client.get(f"/api/v1/asset/status/{gid}", endpoint="status")
+            if resp.status_code == 429:
+                self._rate_limited(resp)
+                return
+            data = resp.json()
+        except Exception:
+            return  # network error / non-JSON — retry next round
+        inner = data.get("data", data) if isinstance(data, dict) else {}
+        status = str(inner.get("status", "pending"))
+        if status in FAILED_STATES:
+            self._update(gid, status="failed",
+                         error=inner.get("error_message") or inner.get("error") or "generation failed")
+        elif status in DONE_STATES:
+            if inner.get("download_available") is False:
+                self._update(gid, status="processing")
+                return
+            self._fetch_download(gid)
+        else:
+            self._update(gid, status=status)
+
+    def _fetch_download(self, gid):
+        with self._cond:
+            attempts = self._tasks[gid]["dl_attempts"] + 1
+        self._update(gid, dl_attempts=attempts)
+        try:
+            self.upstream_calls += 1
+            resp = self.client.get(f"/api/v1/asset/download/{gid}", endpoint="download")
+            if resp.status_code == 429:
+                self._rate_limited(resp)
+                return
+            if resp.status_code == 409:
+                return  # not ready yet
+            data = resp.json()
+            inner = data.get("data", data)
+            url = inner.get("download_url") or inner.get("url")
+        except Exception:
+            url = None
+        if url:
+            log.debug("[POLLER] %s... → completed", gid[:8])
+            self._update(gid, status="completed", download_url=url)
+            if self.on_complete:
+                try:
+                    self.on_complete(gid, url)
+                except Exception as e:
+                    log.warning("[POLLER] on_complete failed for %s...: %s", gid[:8], e)
+        elif attempts >= self.download_retries:
+            self._update(gid, status="failed", error="no download URL")
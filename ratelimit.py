@@ -0,0 +1,226 @@
+"""
+Admission control for upstream API calls.
+
+`AdaptiveRateLimiter` is a token bucket shared by every call to the API.
+Its refill rate adapts to what the API tells us (AIMD): each 429 halves
+the rate and honours `Retry-After`, and each success nudges the rate back
+up, more cautiously near the rate at which the last 429 happened. Callers
+have a priority, so generate submissions get the next token ahead of
+interactive reads, and both go ahead of background status polls.
+
+`CircuitBreaker` fails fast while the API is down. After a run of
+consecutive failures (connection errors, timeouts, 502/503/504) it opens
+for a cool-down period, then lets a single probe through before closing
+again.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Lower number = served first
+PRIORITY_GENERATE = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_POLL = 2
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with an adaptive rate and per-priority waiting."""
+
+    def __init__(self, rate=5.0, burst=10, min_rate=0.2, max_rate=50.0, poll_reserve=2.0):
+        self.rate = rate                    # tokens per second
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.poll_reserve = poll_reserve    # polls leave this many tokens for others
+        self.ceiling = None                 # rate at which we last saw a 429
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0           # Retry-After pause
+        self._last_decrease = float("-inf")
+        self._waiting = [0, 0, 0]           # callers waiting per priority
+        self._cond = threading.Condition()
+        self.admitted = 0
+        self.throttled = 0                  # callers that had to wait
+        self.rejected = 0                   # callers that gave up waiting
+        self.rate_limited = 0               # 429s seen
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=30.0):
+        """Take one token, waiting up to `timeout` seconds. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        waited = False
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._take(priority, now)
+                    if wait is None:
+                        self.throttled += waited
+                        return True
+                    if now >= deadline:
+                        self.rejected += 1
+                        return False
+                    waited = True
+                    self._cond.wait(max(0.01, min(wait, deadline - now)))
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    async def acquire_async(self, priority=PRIORITY_INTERACTIVE, timeout=30.0):
+        """`acquire` for coroutines: waits with asyncio.sleep, not on the condition."""
+        deadline = time.monotonic() + timeout
+        waited = False
+        with self._cond:
+            self._waiting[priority] += 1
+        try:
+            while True:
+                now = time.monotonic()
+                with self._cond:
+                    wait = self._take(priority, now)
+                    if wait is None:
+                        self.throttled += waited
+                        return True
+                    if now >= deadline:
+                        self.rejected += 1
+                        return False
+                waited = True
+                await asyncio.sleep(max(0.01, min(wait, deadline - now)))
+        finally:
+            with self._cond:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def _take(self, priority, now):
+        """Take a token if `priority` may have one now (returns None);
+        otherwise return roughly how long to wait before trying again."""
+        self._refill(now)
+        ahead = any(self._waiting[p] for p in range(priority))
+        reserve = self.poll_reserve if priority == PRIORITY_POLL else 0.0
+        if now >= self._blocked_until and not ahead and self._tokens >= 1.0 + reserve:
+            self._tokens -= 1.0
+            self.admitted += 1
+            return None
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        return (1.0 + reserve - self._tokens) / self.rate
+
+    def on_response(self, status_code, retry_after=None):
+        """Adapt the rate to an API response."""
+        with self._cond:
+            if status_code == 429:
+                self.rate_limited += 1
+                now = time.monotonic()
+                # 429s for calls already in flight when we slowed down don't
+                # count again — at most one decrease per second
+                if now - self._last_decrease >= 1.0:
+                    self._last_decrease = now
+                    self.ceiling = self.rate
+                    self.rate = max(self.min_rate, self.rate / 2)
+                self._tokens = min(self._tokens, 0.0)
+                pause = retry_after if retry_after is not None else 1.0 / self.rate
+                self._blocked_until = max(self._blocked_until, now + pause)
+            elif status_code < 500:
+                # Additive increase; creep up slowly near the last known limit
+                near_ceiling = self.ceiling is not None and self.rate >= 0.9 * self.ceiling
+                self.rate = min(self.max_rate, self.rate + (0.01 if near_ceiling else 0.1))
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def stats(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "rate": round(self.rate, 2),
+                "ceiling": round(self.ceiling, 2) if self.ceiling else None,
+                "tokens": round(self._tokens, 2),
+                "paused_for": round(max(0.0, self._blocked_until - time.monotonic()), 1),
+                "waiting": list(self._waiting),
+                "admitted": self.admitted,
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "rate_limited": self.rate_limited,
+            }
+
+
+class CircuitBreaker:
+    """Closed → open after `threshold` consecutive failures → half-open after
+    `reset_timeout` (one probe) → closed on success, open again on failure."""
+
+    def __init__(self, threshold=5, reset_timeout=15.0, max_reset_timeout=120.0):
+        self.threshold = threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.short_circuited = 0
+
+    def allow(self):
+        """True if a call may go out now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                self._probing = False
+            if self.state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def retry_after(self):
+        """Seconds until the breaker will let a probe through."""
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def abandon(self):
+        """A call that was let through was cancelled before it got an answer —
+        if it was the half-open probe, let the next call probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.state = "closed"
+                self._failures = 0
+                self._probing = False
+                self.reset_timeout = self.base_reset_timeout
+                return
+            self._failures += 1
+            if self.state == "half-open":
+                # The probe failed — stay open for longer
+                self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+                self._trip()
+            elif self.state == "closed" and self._failures >= self.threshold:
+                self._trip()
+
+    def _trip(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self.opened += 1
+        log.warning("[UPSTREAM] Circuit open — failing fast for %.0fs", self.reset_timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "short_circuited": self.short_circuited,
+            }
@@ -0,0 +1,144 @@
+"""
+Reference payload cache.
+
+Generating with a saved character uploads the same (compressed, base64)
+reference images over and over. This module keeps the upload-ready data URIs
+in a bounded in-memory LRU, with an optional on-disk tier that survives
+restarts. Entries are keyed by file path, mtime, size and the `max_bytes`
+compression target, so editing a reference image simply misses the cache.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+class RefPayloadCache:
+    """Bounded LRU of data URIs, optionally backed by a directory on disk."""
+
+    def __init__(self, max_entries=256, max_total_bytes=128_000_000, disk_dir=None, warm_workers=2):
+        self.max_entries = max_entries
+        self.max_total_bytes = max_total_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries = OrderedDict()   # key -> data URI
+        self._total = 0
+        self._lock = threading.Lock()
+        self._warm_pool = ThreadPoolExecutor(max_workers=warm_workers, thread_name_prefix="ref-warm")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(path, max_bytes):
+        """Cache key for a file, or None if it doesn't exist."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (str(path), st.st_mtime_ns, st.st_size, max_bytes)
+
+    def get(self, path, max_bytes, build):
+        """Return the cached payload for `path`, calling `build()` on a miss."""
+        key = self.key_for(path, max_bytes)
+        if key is None:
+            return build()
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self._disk_read(key)
+        if value is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            with self._lock:
+                self.misses += 1
+            value = build()
+            self._disk_write(key, value)
+        self._put(key, value)
+        return value
+
+    def warm(self, paths, max_bytes, build_for):
+        """Fill the cache for `paths` in the background. `build_for(path)`
+        produces the payload for one file."""
+        for path in paths:
+            self._warm_pool.submit(self.get, path, max_bytes, lambda p=path: build_for(p))
+
+    def invalidate_dir(self, directory):
+        """Drop every entry (memory and disk) for files inside `directory`."""
+        prefix = str(Path(directory)) + os.sep
+        with self._lock:
+            for key in [k for k in self._entries if k[0].startswith(prefix)]:
+                self._total -= len(self._entries.pop(key))
+        if self.disk_dir and self.disk_dir.exists():
+            for f in self.disk_dir.glob("*.uri"):
+                try:
+                    with open(f, "r", encoding="utf-8") as fh:
+                        if fh.readline().startswith(prefix):
+                            f.unlink()
+                except (OSError, UnicodeDecodeError):
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    # ── Internals ─────────────────────────────
+
+    def _put(self, key, value):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= len(old)
+            self._entries[key] = value
+            self._total += len(value)
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self._total > self.max_total_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._total -= len(evicted)
+
+    def _disk_path(self, key):
+        # One file per (path, max_bytes); the header line records mtime/size so
+        # a changed source overwrites its slot instead of piling up new files.
+        name = hashlib.sha1(f"{key[0]}|{key[3]}".encode("utf-8")).hexdigest()
+        return self.disk_dir / f"{name}.uri"
+
+    @staticmethod
+    def _header(key):
+        return f"{key[0]}\t{key[1]}\t{key[2]}\t{key[3]}\n"
+
+    def _disk_read(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                if f.readline() != self._header(key):
+                    return None
+                return f.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def _disk_write(self, key, value):
+        if not self.disk_dir:
+            return
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            target = self._disk_path(key)
+            tmp = target.with_suffix(f".tmp{threading.get_ident()}")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self._header(key))
+                f.write(value)
+            os.replace(tmp, target)
+        except OSError:
+            pass
@@ -0,0 +1,258 @@
+"""
+Diversity-aware reference selection.
+
+Only a handful of a character's reference images can be uploaded per
+generation. Instead of always sending the first few files, this module keeps
+a per-character index of image features — a 64-bit perceptual hash (DCT of a
+32×32 grayscale copy) and a coarse RGB colour histogram — and picks the
+references that differ most from each other (greedy farthest-point
+selection). When the references are highly redundant fewer are sent.
+
+Features are computed in the background when a character is ingested or its
+folder changes, and persisted under `characters/.cache/refindex`, so
+selection at request time is an in-memory lookup. NumPy and Pillow are
+optional: without them (or before a character is indexed) the first files in
+name order are used, as before.
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+HIST_BINS = 4           # per channel → 64-bin joint histogram
+HASH_WEIGHT = 0.6       # distance = 0.6 × hash distance + 0.4 × colour distance
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+_DCT32 = _dct_matrix(32) if np is not None else None
+
+
+def image_features(path):
+    """(phash as a list of 64 bools, normalised colour histogram) for one image."""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.draft("RGB", (64, 64))
+        rgb = img.convert("RGB")
+    gray = np.asarray(rgb.convert("L").resize((32, 32), Image.BILINEAR), dtype=np.float64)
+    dct = _DCT32 @ gray @ _DCT32.T
+    low = dct[:HASH_SIZE, :HASH_SIZE].flatten()[1:]         # drop the DC term
+    bits = np.concatenate([[False], low > np.median(low)])
+
+    small = np.asarray(rgb.resize((64, 64), Image.BILINEAR), dtype=np.uint8) // (256 // HIST_BINS)
+    codes = (small[..., 0].astype(np.int64) * HIST_BINS + small[..., 1]) * HIST_BINS + small[..., 2]
+    hist = np.bincount(codes.ravel(), minlength=HIST_BINS ** 3).astype(np.float64)
+    return bits.tolist(), (hist / hist.sum()).tolist()
+
+
+def _distances(hashes, hists):
+    """Pairwise distance matrix in [0, 1]."""
+    ham = (hashes[:, None, :] != hashes[None, :, :]).mean(axis=2)
+    colour = 0.5 * np.abs(hists[:, None, :] - hists[None, :, :]).sum(axis=2)
+    return HASH_WEIGHT * ham + (1 - HASH_WEIGHT) * colour
+
+
+class RefSelector:
+    """Per-character feature index and selection of distinct references."""
+
+    def __init__(self, characters_dir, index_dir, min_distance=0.12, min_refs=3, workers=1):
+        self.characters_dir = Path(characters_dir)
+        self.index_dir = Path(index_dir)
+        self.min_distance = min_distance    # below this, another ref adds little
+        self.min_refs = min_refs
+        # slug -> {filename: {"mtime", "size", "hash", "hist"}}; hash and hist
+        # are None for a file that couldn't be decoded, so it isn't retried
+        # until it changes
+        self._index = {}
+        self._selections = {}               # (slug, files, k) -> selected filenames
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ref-index")
+        self.selections = 0
+        self.fallbacks = 0
+        self.selected_total = 0
+
+    @property
+    def available(self):
+        if np is None:
+            return False
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    # ── Selection ─────────────────────────────
+
+    def select(self, slug, files, k):
+        """Up to `k` of `files` (filenames in the character folder), most
+        distinct first; files that couldn't be decoded are left out. Never
+        blocks on feature extraction: if the index is missing or stale,
+        returns `files[:k]` and schedules a re-index."""
+        files = list(files)
+        if len(files) <= min(k, self.min_refs) or not self.available:
+            return files[:k]
+        entries = self._entries(slug)
+        if entries is None or not self._fresh(slug, entries, files):
+            with self._lock:
+                self.fallbacks += 1
+            self.schedule(slug, files)
+            return files[:k]
+
+        key = (slug, tuple(files), k)
+        with self._lock:
+            chosen = self._selections.get(key)
+        if chosen is None:
+            readable = [f for f in files if entries[f]["hash"] is not None]
+            chosen = self._farthest_first(readable, entries, k) if readable else files[:k]
+            with self._lock:
+                self._selections[key] = chosen
+        with self._lock:
+            self.selections += 1
+            self.selected_total += len(chosen)
+        return list(chosen)
+
+    def _farthest_first(self, files, entries, k):
+        hashes = np.array([entries[f]["hash"] for f in files], dtype=bool)
+        hists = np.array([entries[f]["hist"] for f in files], dtype=np.float64)
+        dist = _distances(hashes, hists)
+        chosen = [0]                          # ref_01 (the seed view) always goes first
+        nearest = dist[0].copy()
+        while len(chosen) < min(k, len(files)):
+            nearest[chosen] = -1.0
+            best = int(nearest.argmax())
+            if len(chosen) >= self.min_refs and nearest[best] < self.min_distance:
+                break                         # the rest are near-duplicates
+            chosen.append(best)
+            nearest = np.minimum(nearest, dist[best])
+        return [files[i] for i in chosen]
+
+    # ── Indexing ──────────────────────────────
+
+    def schedule(self, slug, files=None):
+        """Re-index a character in the background (no-op if already queued)."""
+        if not self.available:
+            return
+        with self._lock:
+            if slug in self._pending:
+                return
+            self._pending.add(slug)
+        self._pool.submit(self._index_safely, slug, files)
+
+    def index(self, slug, files=None):
+        """Compute features for new or changed files of a character (blocking)."""
+        if not self.available:
+            return
+        folder = self.characters_dir / slug
+        if files is None:
+            files = sorted(f.name for f in folder.glob("*") if f.is_file() and not f.name.startswith("."))
+        old = self._entries(slug) or {}
+        entries = {}
+        for name in files:
+            try:
+                st = (folder / name).stat()
+            except OSError:
+                continue
+            prev = old.get(name)
+            if prev and prev["mtime"] == st.st_mtime_ns and prev["size"] == st.st_size:
+                entries[name] = prev
+                continue
+            try:
+                phash, hist = image_features(folder / name)
+            except Exception as e:
+                log.warning("[REFINDEX] Skipping %s/%s: %s", slug, name, e)
+                phash = hist = None
+            entries[name] = {"mtime": st.st_mtime_ns, "size": st.st_size, "hash": phash, "hist": hist}
+        with self._lock:
+            self._index[slug] = entries
+            self._selections = {key: v for key, v in self._selections.items() if key[0] != slug}
+        self._save(slug, entries)
+
+    def forget(self, slug):
+        with self._lock:
+            self._index.pop(slug, None)
+            self._selections = {key: v for key, v in self._selections.items() if key[0] != slug}
+        try:
+            (self.index_dir / f"{slug}.json").unlink()
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "available": self.available,
+                "characters": len(self._index),
+                "selections": self.selections,
+                "fallbacks": self.fallbacks,
+                "avg_selected": round(self.selected_total / self.selections, 2) if self.selections else 0.0,
+            }
+
+    # ── Internals ─────────────────────────────
+
+    def _index_safely(self, slug, files):
+        try:
+            self.index(slug, files)
+        except Exception as e:
+            log.warning("[REFINDEX] Indexing %s failed: %s", slug, e)
+        finally:
+            with self._lock:
+                self._pending.discard(slug)
+
+    def _entries(self, slug):
+        with self._lock:
+            entries = self._index.get(slug)
+        if entries is None:
+            entries = self._load(slug)
+            if entries is not None:
+                with self._lock:
+                    self._index.setdefault(slug, entries)
+        return entries
+
+    def _fresh(self, slug, entries, files):
+        folder = self.characters_dir / slug
+        for name in files:
+            e = entries.get(name)
+            if e is None:
+                return False
+            try:
+                st = (folder / name).stat()
+            except OSError:
+                return False
+            if e["mtime"] != st.st_mtime_ns or e["size"] != st.st_size:
+                return False
+        return True
+
+    def _load(self, slug):
+        try:
+            with open(self.index_dir / f"{slug}.json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _save(self, slug, entries):
+        try:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            target = self.index_dir / f"{slug}.json"
+            tmp = target.with_suffix(f".tmp{threading.get_ident()}")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp, target)
+        except OSError as e:
+            log.warning("[REFINDEX] Could not save index for %s: %s", slug, e)
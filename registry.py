@@ -0,0 +1,467 @@
+"""
+Character registry.
+
+Keeps the character registry in memory with a slug → entry index, so
+listing and lookup don't re-read storage on every request. Folder scans
+are incremental: each character folder's mtime is remembered and only
+folders whose mtime moved are re-listed. Storage is written only when
+something actually changed, and re-read only if another process changed it.
+
+Two storage backends are available:
+
+* `JsonRegistryStore` — the classic `characters/registry.json` file.
+* `SqliteRegistryStore` — a WAL-mode SQLite database with row-level writes,
+  indexed by slug and created_at. It migrates an existing registry.json on
+  first use and can export back to JSON:
+
+      python registry.py export characters/registry.sqlite3 registry.json
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp'}
+
+# Orders `page()` can list in (prefix "-" for descending); ties break on slug
+SORT_KEYS = {
+    "name": lambda c: (c.get("name") or "").casefold(),
+    "created_at": lambda c: c.get("created_at") or "",
+    "reference_count": lambda c: c.get("reference_count") or 0,
+}
+
+
+# ──────────────────────────────────────────────
+# Storage backends
+# ──────────────────────────────────────────────
+#
+# A store exposes:
+#   load()                          -> list of entries, registry order
+#   changed_externally()            -> True if someone else wrote since load/write
+#   write(chars, upserted, deleted) -> persist; `upserted` entries are (re)written,
+#                                      `deleted` slugs removed. A slug in both
+#                                      moves to the end of the registry order.
+#   files()                         -> paths the store writes (never character folders)
+
+class JsonRegistryStore:
+    """registry.json, rewritten as a whole on every change."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._mtime = None
+
+    def _stat(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def changed_externally(self):
+        return self._stat() != self._mtime
+
+    def load(self):
+        self._mtime = self._stat()
+        if self._mtime is None:
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f).get("characters", [])
+        except (json.JSONDecodeError, IOError):
+            return []
+
+    def files(self):
+        return [self.path, self.path.with_suffix(".json.tmp")]
+
+    def write(self, chars, upserted=(), deleted=()):
+        """Write registry.json atomically."""
+        self.path.parent.mkdir(exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"characters": chars}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._mtime = self._stat()
+
+
+class SqliteRegistryStore:
+    """Characters and their reference files in SQLite (WAL mode).
+
+    Writes touch only the affected rows, inside one `BEGIN IMMEDIATE`
+    transaction, so concurrent writers (threads or processes) can't lose
+    each other's entries.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS characters (
+        slug        TEXT PRIMARY KEY,
+        seq         INTEGER NOT NULL,
+        name        TEXT NOT NULL,
+        created_at  TEXT NOT NULL,
+        status      TEXT,
+        data        TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_characters_created_at ON characters(created_at);
+    CREATE INDEX IF NOT EXISTS idx_characters_seq ON characters(seq);
+    CREATE TABLE IF NOT EXISTS reference_files (
+        slug      TEXT NOT NULL REFERENCES characters(slug) ON DELETE CASCADE,
+        position  INTEGER NOT NULL,
+        filename  TEXT NOT NULL,
+        PRIMARY KEY (slug, position)
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key    TEXT PRIMARY KEY,
+        value  TEXT
+    );
+    """
+
+    def __init__(self, path, migrate_from=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection, used under the registry lock; other processes are
+        # serialised by SQLite's own locking.
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(self.SCHEMA)
+        self._data_version = None
+        if migrate_from:
+            self.migrate_from_json(migrate_from)
+
+    def _current_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def changed_externally(self):
+        return self._current_version() != self._data_version
+
+    def load(self):
+        self._data_version = self._current_version()
+        files = {}
+        for slug, filename in self._conn.execute(
+                "SELECT slug, filename FROM reference_files ORDER BY slug, position"):
+            files.setdefault(slug, []).append(filename)
+        chars = []
+        for slug, data in self._conn.execute("SELECT slug, data FROM characters ORDER BY seq"):
+            entry = json.loads(data)
+            entry["local_files"] = files.get(slug, [])
+            chars.append(entry)
+        return chars
+
+    def files(self):
+        return [self.path] + [self.path.with_name(self.path.name + s) for s in ("-wal", "-shm", "-journal")]
+
+    def write(self, chars, upserted=(), deleted=()):
+        with self._transaction() as cur:
+            for slug in deleted:
+                cur.execute("DELETE FROM characters WHERE slug = ?", (slug,))
+            for entry in upserted:
+                self._upsert(cur, entry)
+        self._data_version = self._current_version()
+
+    def _upsert(self, cur, entry):
+        data = {k: v for k, v in entry.items() if k != "local_files"}
+        cur.execute(
+            "INSERT INTO characters (slug, seq, name, created_at, status, data) "
+            "VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM characters), ?, ?, ?, ?) "
+            "ON CONFLICT(slug) DO UPDATE SET name = excluded.name, created_at = excluded.created_at, "
+            "status = excluded.status, data = excluded.data",
+            (entry["slug"], entry.get("name", ""), entry.get("created_at", ""),
+             entry.get("status"), json.dumps(data, ensure_ascii=False)),
+        )
+        cur.execute("DELETE FROM reference_files WHERE slug = ?", (entry["slug"],))
+        cur.executemany(
+            "INSERT INTO reference_files (slug, position, filename) VALUES (?, ?, ?)",
+            [(entry["slug"], i, f) for i, f in enumerate(entry.get("local_files", []))],
+        )
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn.cursor()
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    # ── Migration / export ────────────────────
+
+    def migrate_from_json(self, json_path):
+        """Import registry.json once (only into an empty database)."""
+        json_path = Path(json_path)
+        done = self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        if done or not json_path.exists():
+            return 0
+        chars = JsonRegistryStore(json_path).load()
+        with self._transaction() as cur:
+            if cur.execute("SELECT COUNT(*) FROM characters").fetchone()[0] == 0:
+                for entry in chars:
+                    if entry.get("slug"):
+                        self._upsert(cur, entry)
+            else:
+                chars = []
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                        (str(json_path),))
+        if chars:
+            log.info("[REGISTRY] Migrated %d characters from %s to SQLite", len(chars), json_path.name)
+        return len(chars)
+
+    def export_json(self, json_path):
+        """Write the whole registry back out in registry.json format."""
+        JsonRegistryStore(json_path).write(self.load())
+
+
+# ──────────────────────────────────────────────
+# Registry
+# ──────────────────────────────────────────────
+
+
+class CharacterRegistry:
+    """Process-wide, thread-safe view of the character registry."""
+
+    def __init__(self, characters_dir, on_folder_changed=None, min_scan_interval=2.0, store=None):
+        self.characters_dir = Path(characters_dir)
+        self.store = store or JsonRegistryStore(self.characters_dir / "registry.json")
+        self.on_folder_changed = on_folder_changed  # called with the folder Path
+        self.min_scan_interval = min_scan_interval
+        self._lock = threading.RLock()
+        self._chars = []            # registry order (creation order)
+        self._index = {}            # slug -> entry
+        self._loaded = False
+        self._dir_mtimes = {}       # slug -> folder mtime_ns at last scan
+        self._last_scan = 0.0
+        self.version = 0            # bumped on every change
+        self.instance = uuid.uuid4().hex[:8]  # tells versions of different runs apart (ETags)
+        self._orders = {}           # sort -> entries in that order, for the current version
+        self._orders_version = None
+
+    # ── Reads ─────────────────────────────────
+
+    def all(self):
+        """Snapshot of all entries (shallow copies, registry order)."""
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(c) for c in self._chars]
+
+    def get(self, slug):
+        with self._lock:
+            self._ensure_loaded()
+            c = self._index.get(slug)
+            return dict(c) if c else None
+
+    def reserved_names(self):
+        """Names in the characters folder that belong to the registry's
+        storage and so can't be used as slugs. registry.json is kept out
+        with every backend: it is what SQLite migrates from."""
+        names = {p.name for p in self.store.files() if p.parent == self.characters_dir}
+        return names | {"registry.json", "registry.json.tmp"}
+
+    def as_document(self):
+        """The registry in its on-disk JSON shape."""
+        return {"characters": self.all()}
+
+    def page(self, limit=None, cursor=None, sort=None):
+        """A slice of the registry: {characters, total, next_cursor}.
+
+        `sort` is a key of SORT_KEYS, optionally prefixed with "-"; the default
+        is registry order. Sorted orders are kept until the next change, so a
+        page costs the same however large the registry is. `cursor` is the
+        `next_cursor` of the previous page. Raises ValueError for an unknown sort.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            order = self._ordered(sort)
+            try:
+                start = max(0, int(cursor)) if cursor else 0
+            except ValueError:
+                start = 0
+            end = len(order) if limit is None else start + limit
+            return {
+                "characters": [dict(c) for c in order[start:end]],
+                "total": len(order),
+                "next_cursor": str(end) if end < len(order) else None,
+            }
+
+    # ── Writes ────────────────────────────────
+
+    def upsert(self, entry):
+        """Insert or replace the entry with `entry["slug"]` (moved to the end)."""
+        return self.merge([entry])[0]
+
+    def merge(self, entries):
+        """Insert or replace several entries (moved to the end, in the given
+        order) with a single store write — one transaction for SQLite."""
+        with self._lock:
+            self._ensure_loaded()
+            entries = [dict(e) for e in entries]
+            slugs = [e["slug"] for e in entries]
+            replaced = set(slugs)
+            self._chars = [c for c in self._chars if c.get("slug") not in replaced] + entries
+            for slug, entry in zip(slugs, entries):
+                self._index[slug] = entry
+                self._dir_mtimes.pop(slug, None)
+            if entries:
+                self._changed(upserted=entries, deleted=slugs)
+            return [dict(e) for e in entries]
+
+    def update(self, slug, **fields):
+        """Update fields of one entry in place. Returns the entry, or None."""
+        with self._lock:
+            self._ensure_loaded()
+            c = self._index.get(slug)
+            if c is None:
+                return None
+            c.update(fields)
+            self._changed(upserted=[c])
+            return dict(c)
+
+    def delete(self, slug):
+        with self._lock:
+            self._ensure_loaded()
+            if self._index.pop(slug, None) is None:
+                return False
+            self._chars = [c for c in self._chars if c.get("slug") != slug]
+            self._dir_mtimes.pop(slug, None)
+            self._changed(deleted=[slug])
+            return True
+
+    # ── Folder scanning ───────────────────────
+
+    def scan(self, force=False):
+        """Register manually added folders and refresh `local_files`.
+
+        Only folders whose mtime changed since the last scan are listed.
+        Scans closer together than `min_scan_interval` are skipped unless
+        `force` is set.
+        """
+        if not self.characters_dir.exists():
+            return False
+        with self._lock:
+            self._ensure_loaded()
+            now = time.monotonic()
+            if not force and now - self._last_scan < self.min_scan_interval:
+                return False
+            self._last_scan = now
+            changed = []
+            try:
+                entries = list(os.scandir(self.characters_dir))
+            except OSError:
+                return False
+            for entry in entries:
+                slug = entry.name
+                if slug.startswith('.') or slug == '__pycache__' or not entry.is_dir():
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except OSError:
+                    continue
+                if not force and self._dir_mtimes.get(slug) == mtime:
+                    continue
+                self._dir_mtimes[slug] = mtime
+                if self._scan_folder(slug, Path(entry.path)):
+                    changed.append(self._index[slug])
+            if changed:
+                self._changed(upserted=changed)
+            return bool(changed)
+
+    def _scan_folder(self, slug, folder):
+        try:
+            image_files = sorted(
+                e.name for e in os.scandir(folder)
+                if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTS
+            )
+        except OSError:
+            return False
+        if not image_files:
+            return False  # empty folder — skip
+
+        c = self._index.get(slug)
+        if c is None:
+            # New manually-added folder — register it
+            log.info("[SCAN] Found new character folder: %s (%d images)", slug, len(image_files))
+            c = {
+                "name": slug.replace('-', ' ').replace('_', ' ').title(),
+                "slug": slug,
+                "seed_url": "",
+                "reference_urls": [],  # no remote URLs for manual imports
+                "local_files": image_files,
+                "reference_count": len(image_files),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "local_dir": str(folder),
+            }
+            self._chars.append(c)
+            self._index[slug] = c
+            return True
+        if c.get("status") == "downloading":
+            return False  # the download job sets local_files when it finishes
+        old_files = c.get("local_files", [])
+        if sorted(old_files) == image_files:
+            return False
+        # Existing entry — user added/removed images
+        log.info("[SCAN] Updated files for %s: %d → %d", slug, len(old_files), len(image_files))
+        c["local_files"] = image_files
+        c["reference_count"] = max(len(image_files), len(c.get("reference_urls", [])))
+        if self.on_folder_changed:
+            self.on_folder_changed(folder)
+        return True
+
+    def _ordered(self, sort):
+        if self._orders_version != self.version:
+            self._orders = {}
+            self._orders_version = self.version
+        if not sort:
+            return self._chars
+        order = self._orders.get(sort)
+        if order is None:
+            key = SORT_KEYS.get(sort.lstrip("-"))
+            if key is None:
+                raise ValueError(f"unknown sort: {sort}")
+            order = sorted(self._chars, key=lambda c: (key(c), c.get("slug") or ""),
+                           reverse=sort.startswith("-"))
+            self._orders[sort] = order
+        return order
+
+    # ── Persistence ───────────────────────────
+
+    def _ensure_loaded(self):
+        """(Re)load from the store if never loaded or changed by someone else."""
+        if self._loaded and not self.store.changed_externally():
+            return
+        chars = self.store.load()
+        self._chars = chars
+        self._index = {c.get("slug"): c for c in chars}
+        self._dir_mtimes.clear()
+        self._loaded = True
+        self.version += 1
+
+    def _changed(self, upserted=(), deleted=()):
+        self.version += 1
+        self.store.write(self._chars, upserted=upserted, deleted=deleted)
+
+
+def _main(argv):
+    """python registry.py migrate|export <db> <registry.json>"""
+    if len(argv) != 3 or argv[0] not in ("migrate", "export"):
+        print(_main.__doc__)
+        return 2
+    command, db_path, json_path = argv
+    store = SqliteRegistryStore(db_path)
+    if command == "migrate":
+        print(f"Imported {store.migrate_from_json(json_path)} characters")
+    else:
+        store.export_json(json_path)
+        print(f"Exported {len(store.load())} characters to {json_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,139 @@
+"""
+Response cache for read-mostly upstream endpoints.
+
+`/api/pricing` and `/api/bundles` almost never change and `/api/balance` and
+`/api/me` are fetched many times per session. Each endpoint gets a TTL; once
+an entry is older than that it is still served (stale-while-revalidate) while
+a single background refresh fetches a new copy. Bodies are serialised once,
+with a strong ETag, so the browser can revalidate with If-None-Match and get
+a 304.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("status", "body", "etag", "fetched_at")
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.fetched_at = time.monotonic()
+
+
+class ResponseCache:
+    """TTL cache of JSON upstream responses.
+
+    `policies` maps an endpoint name to `(ttl, stale_ttl)`: entries are fresh
+    for `ttl` seconds and may be served stale (while refreshing in the
+    background) for a further `stale_ttl` seconds.
+    """
+
+    def __init__(self, policies):
+        self.policies = dict(policies)
+        self._entries = {}          # (name, key) -> _Entry
+        self._inflight = {}         # (name, key) -> threading.Event
+        self._lock = threading.Lock()
+        self._generation = 0        # bumped by invalidate(); fetches that straddle it aren't stored
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, name, fetch, key=None):
+        """Return an entry for (name, key); `fetch()` returns (status, data).
+
+        Only 200 responses are stored; anything else is returned uncached.
+        Exceptions from a synchronous fetch propagate to the caller.
+        """
+        ttl, stale_ttl = self.policies[name]
+        ck = (name, key)
+        while True:
+            with self._lock:
+                entry = self._entries.get(ck)
+                age = time.monotonic() - entry.fetched_at if entry else None
+                if entry and age < ttl:
+                    self.hits += 1
+                    return entry
+                if entry and age < ttl + stale_ttl:
+                    self.stale_hits += 1
+                    if ck not in self._inflight:
+                        self._inflight[ck] = threading.Event()
+                        threading.Thread(target=self._refresh, args=(ck, fetch), daemon=True).start()
+                    return entry
+                waiter = self._inflight.get(ck)
+                if waiter is None:
+                    self.misses += 1
+                    self._inflight[ck] = threading.Event()
+                    break
+            # Another request is already fetching this entry — wait for it
+            waiter.wait(30)
+            with self._lock:
+                entry = self._entries.get(ck)
+                if entry and time.monotonic() - entry.fetched_at < ttl + stale_ttl:
+                    return entry
+                if ck in self._inflight:
+                    continue
+                self.misses += 1
+                self._inflight[ck] = threading.Event()
+                break
+        try:
+            return self._fetch_and_store(ck, fetch)
+        finally:
+            self._done(ck)
+
+    def invalidate(self, name, key=None):
+        """Drop one entry, or every entry for `name` when key is None."""
+        with self._lock:
+            self._generation += 1
+            for ck in [ck for ck in self._entries if ck[0] == name and (key is None or ck[1] == key)]:
+                del self._entries[ck]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.stale_hits) / total, 3) if total else 0.0,
+            }
+
+    # ── Internals ─────────────────────────────
+
+    def _fetch_and_store(self, ck, fetch):
+        with self._lock:
+            generation = self._generation
+        status, data = fetch()
+        entry = _Entry(status, json.dumps(data).encode("utf-8"))
+        if status == 200:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[ck] = entry
+        return entry
+
+    def _refresh(self, ck, fetch):
+        try:
+            self._fetch_and_store(ck, fetch)
+        except Exception as e:
+            log.warning("[CACHE] Background refresh of %s failed: %s", ck[0], e)  # keep serving stale
+        finally:
+            self._done(ck)
+
+    def _done(self, ck):
+        with self._lock:
+            event = self._inflight.pop(ck, None)
+        if event:
+            event.set()
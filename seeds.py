@@ -0,0 +1,228 @@
+"""
+Uploaded seed images.
+
+`POST /api/seeds` takes the seed image as a multipart file instead of a
+base64 data URL inside JSON. The file part is streamed to a spool file in
+the store's directory and hashed on the way in; the upload is then checked,
+compressed to the API's size limit once, and kept under its SHA-256, which
+is the handle turnaround and create requests refer to. Uploading the same
+image again finds the stored copy by hash and skips all of that.
+
+Seeds not used for `retain_seconds` are removed when new ones arrive.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# Leading bytes of the formats the API accepts
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+HANDLE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def sniff_mime(head):
+    """Image type from the first bytes of a file, or None."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    return None
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UnreadableImage(ValueError):
+    """The upload looks like an image but can't be decoded."""
+
+
+class SpoolFile:
+    """Writable spool for one uploaded file part: written to disk as it
+    arrives, with a running SHA-256 and size."""
+
+    def __init__(self, directory, max_bytes):
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix=".part")
+        self._file = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"seed image larger than {self.max_bytes // (1024 * 1024)} MB")
+        self._hash.update(chunk)
+        return self._file.write(chunk)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    # The form parser seeks back to the start once the part is complete
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class SeedStore:
+    """Normalised seed images on disk, keyed by the SHA-256 of the upload.
+
+    `compressor` is the app's `CompressionEngine`; images over `max_bytes`
+    are re-encoded with it once, at upload.
+    """
+
+    def __init__(self, root, compressor, max_bytes=4_000_000, max_upload_bytes=24 * 1024 * 1024,
+                 retain_seconds=7 * 86400):
+        self.root = Path(root)
+        self.spool_dir = self.root / ".spool"
+        self.compressor = compressor
+        self.max_bytes = max_bytes
+        self.max_upload_bytes = max_upload_bytes
+        self.retain_seconds = retain_seconds
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.dedup_hits = 0
+
+    def spool(self):
+        """A new spool file for an incoming upload."""
+        return SpoolFile(self.spool_dir, self.max_upload_bytes)
+
+    def ingest(self, spool, filename=None):
+        """Store a completely written spool. Returns the seed's info dict with
+        `deduplicated` set when the same image was already stored. Raises
+        ValueError if the upload is not an image, UnreadableImage if it is
+        one that can't be decoded."""
+        spool.flush()
+        handle = spool.hexdigest()
+        with self._lock:
+            self.uploads += 1
+            info = self.info(handle)
+            if info is not None:
+                self.dedup_hits += 1
+        if info is not None:
+            spool.discard()
+            self._touch(handle)
+            return {**info, "deduplicated": True}
+
+        spool.seek(0)
+        data = spool.read()
+        spool.discard()
+        mime = sniff_mime(data[:16])
+        if mime is None:
+            raise ValueError("not a PNG, JPEG, WebP or GIF image")
+        stored, stored_mime = data, mime
+        if len(data) > self.max_bytes:
+            try:
+                out, out_mime, timings = self.compressor.compress(data, self.max_bytes)
+                stored, stored_mime = out, out_mime or mime
+                log.info("[SEED] %s… compressed %.1f MB → %d bytes in %sms", handle[:8],
+                         len(data) / 1024 / 1024, len(stored), timings.get("wall"))
+            except ImportError:
+                log.warning("[SEED] PIL not available, storing as-is (may be too large)")
+            except Exception as e:
+                # Pillow reports damaged input with several exception types
+                raise UnreadableImage(f"could not decode the image ({e})") from None
+        info = {
+            "handle": handle,
+            "filename": filename,
+            "mime": stored_mime,
+            "bytes": len(data),
+            "stored_bytes": len(stored),
+            "created_at": time.time(),
+        }
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(self.root / handle, stored)
+        self._write_atomic(self.root / f"{handle}.json", json.dumps(info).encode())
+        self._evict()
+        return {**info, "deduplicated": False}
+
+    def info(self, handle):
+        if not HANDLE.match(handle or ""):
+            return None
+        try:
+            return json.loads((self.root / f"{handle}.json").read_bytes())
+        except (OSError, ValueError):
+            return None
+
+    def data_url(self, handle):
+        """The stored seed as a data URL for the API, or None for an unknown handle."""
+        info = self.info(handle)
+        if info is None:
+            return None
+        try:
+            data = (self.root / handle).read_bytes()
+        except OSError:
+            return None
+        self._touch(handle)
+        return f"data:{info['mime']};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def stats(self):
+        return {"uploads": self.uploads, "dedup_hits": self.dedup_hits}
+
+    # ── Internals ─────────────────────────────
+
+    @staticmethod
+    def _write_atomic(path, data):
+        # Per-thread temp name: identical uploads can be stored concurrently
+        tmp = path.with_name(path.name + f".tmp{threading.get_ident()}")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _touch(self, handle):
+        try:
+            os.utime(self.root / handle)
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Spools left behind by interrupted uploads
+        for part in self.spool_dir.glob("*.part"):
+            try:
+                if part.stat().st_mtime < time.time() - 3600:
+                    part.unlink()
+            except OSError:
+                pass
+        cutoff = time.time() - self.retain_seconds
+        for meta in self.root.glob("*.json"):
+            image = meta.with_suffix("")
+            try:
+                if image.stat().st_mtime >= cutoff:
+                    continue
+            except OSError:
+                pass
+            image.unlink(missing_ok=True)
+            meta.unlink(missing_ok=True)
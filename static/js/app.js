@@ -41,8 +41,10 @@ const DEFAULT_TURNAROUND_PROMPTS = [
 let selectedBundleId = null;
 let cachedCharacters = [];
 const uploadedFiles = {
-  setchar: null // single base64 data URL for seed image
+  setchar: null // preview (object URL) of the seed image
 };
+// Handles of seed images uploaded to /api/seeds, by upload key
+const uploadedSeeds = {};
 
 // ══════════ PENDING SETCHAR RECOVERY (localStorage) ══════════
 const PENDING_SETCHAR_KEY = 'cis_pending_setchar';
@@ -102,6 +104,7 @@ document.addEventListener('DOMContentLoaded', () => {
   document.getElementById('btn-gen-setchar').addEventListener('click', generateSetChar);
   document.getElementById('btn-gen-generate').addEventListener('click', generateWithCharacter);
   document.getElementById('btn-gen-random').addEventListener('click', generateRandom);
+  document.getElementById('generate-character-select').addEventListener('change', onCharacterPicked);
 
   // Credits
   document.getElementById('btn-buy').addEventListener('click', buySelected);
@@ -149,21 +152,43 @@ function handleFiles(files, storeKey, multiple, previewEl) {
       toast('Only image files are accepted', 'warning');
       return;
     }
+    if (!multiple) {
+      // Single seed image: sent to the server once as a file, used by handle
+      if (uploadedFiles[storeKey]) URL.revokeObjectURL(uploadedFiles[storeKey]);
+      uploadedFiles[storeKey] = URL.createObjectURL(file);
+      renderUploadPreview(storeKey, previewEl, multiple);
+      uploadSeed(file, storeKey);
+      return;
+    }
     const reader = new FileReader();
     reader.onload = () => {
-      const base64 = reader.result;
-      if (multiple) {
-        if (!uploadedFiles[storeKey]) uploadedFiles[storeKey] = [];
-        uploadedFiles[storeKey].push(base64);
-      } else {
-        uploadedFiles[storeKey] = base64;
-      }
+      if (!uploadedFiles[storeKey]) uploadedFiles[storeKey] = [];
+      uploadedFiles[storeKey].push(reader.result);
       renderUploadPreview(storeKey, previewEl, multiple);
     };
     reader.readAsDataURL(file);
   });
 }
 
+// Upload a seed image (multipart, no base64); resolves to its handle or null
+function uploadSeed(file, storeKey) {
+  const form = new FormData();
+  form.append('seed', file);
+  const pending = fetch('/api/seeds', { method: 'POST', body: form })
+    .then(async res => {
+      const data = await res.json();
+      if (!res.ok) throw new Error(data.error || 'HTTP ' + res.status);
+      return data.handle;
+    })
+    .catch(e => {
+      toast('Seed upload failed: ' + e.message, 'error');
+      if (uploadedSeeds[storeKey] === pending) removeUpload(storeKey, -1);
+      return null;
+    });
+  uploadedSeeds[storeKey] = pending;
+  return pending;
+}
+
 function renderUploadPreview(storeKey, previewEl, multiple) {
   if (!previewEl) return;
   let html = '';
@@ -191,7 +216,9 @@ function removeUpload(storeKey, index) {
   if (index >= 0) {
     uploadedFiles[storeKey].splice(index, 1);
   } else {
+    if (uploadedFiles[storeKey]) URL.revokeObjectURL(uploadedFiles[storeKey]);
     uploadedFiles[storeKey] = null;
+    delete uploadedSeeds[storeKey];
   }
   const previewEl = document.getElementById(storeKey + '-upload-preview');
   const multiple = index >= 0;
@@ -301,6 +328,36 @@ function enterApp(clientId) {
       }
     };
   }
+
+  // Import a character pack: the file is sent as the request body, as is
+  const importBtn = document.getElementById('btn-import-chars');
+  const importFile = document.getElementById('import-chars-file');
+  if (importBtn && importFile) {
+    importBtn.onclick = () => importFile.click();
+    importFile.onchange = async () => {
+      const file = importFile.files[0];
+      importFile.value = '';
+      if (!file) return;
+      importBtn.disabled = true;
+      importBtn.textContent = '⏳ Importing…';
+      try {
+        const res = await fetch('/api/characters/import', { method: 'POST', body: file });
+        const data = await res.json();
+        if (data.success) {
+          const skipped = data.skipped.length ? `, ${data.skipped.length} already here` : '';
+          toast(`Imported ${data.imported.length} character(s)${skipped}`, 'success');
+          await loadCharacters();
+        } else {
+          toast('Import failed: ' + (data.error || res.status), 'error');
+        }
+      } catch (e) {
+        toast('Import error: ' + e.message, 'error');
+      } finally {
+        importBtn.disabled = false;
+        importBtn.textContent = '⬆ Import';
+      }
+    };
+  }
 }
 
 async function doLogout() {
@@ -506,38 +563,117 @@ async function loadTransactions() {
 }
 
 // ══════════ CHARACTERS ══════════
+// The list only carries what the picker and cards show; the full entry (with
+// every reference URL) is fetched when a character is actually used. It is
+// loaded a page at a time, newest first; further pages load on demand.
+const CHARACTER_LIST_FIELDS = 'slug,name,status,created_at,reference_count,remote_count,local_count,thumbnail';
+const CHARACTER_PAGE_SIZE = 60;
+const LOAD_MORE_VALUE = '__more__';
+let characterCursor = null;
+let characterTotal = 0;
+let characterPageLoading = null;
+
+function characterPageUrl(cursor) {
+  const params = new URLSearchParams({ fields: CHARACTER_LIST_FIELDS, limit: CHARACTER_PAGE_SIZE, sort: '-created_at' });
+  if (cursor) params.set('cursor', cursor);
+  return '/api/characters?' + params;
+}
+
 async function loadCharacters() {
   try {
-    const res = await fetch('/api/characters');
+    const res = await fetch(characterPageUrl(null));
     const data = await res.json();
     cachedCharacters = data.characters || [];
+    characterCursor = data.next_cursor || null;
+    characterTotal = data.total || cachedCharacters.length;
     populateCharacterSelects();
     renderMyCharacters();
-  } catch { cachedCharacters = []; }
+  } catch { cachedCharacters = []; characterCursor = null; characterTotal = 0; }
+}
+
+// Append the next page (no-op when everything is loaded; concurrent calls share one request)
+function loadMoreCharacters() {
+  if (!characterCursor) return Promise.resolve();
+  if (!characterPageLoading) {
+    characterPageLoading = (async () => {
+      try {
+        const res = await fetch(characterPageUrl(characterCursor));
+        const data = await res.json();
+        const known = new Set(cachedCharacters.map(c => c.slug));
+        cachedCharacters = cachedCharacters.concat((data.characters || []).filter(c => !known.has(c.slug)));
+        characterCursor = data.next_cursor || null;
+        characterTotal = data.total || characterTotal;
+        populateCharacterSelects();
+        renderMyCharacters();
+      } catch (e) {
+        toast('Could not load more characters: ' + e.message, 'error');
+      } finally {
+        characterPageLoading = null;
+      }
+    })();
+  }
+  return characterPageLoading;
 }
 
 function populateCharacterSelects() {
   const el = document.getElementById('generate-character-select');
   if (el) {
     const current = el.value;
+    const currentOption = el.selectedOptions[0];
+    const currentLabel = currentOption ? currentOption.textContent : '';
     el.innerHTML = '<option value="">— Select a character —</option>';
     cachedCharacters.forEach(c => {
       const opt = document.createElement('option');
       opt.value = c.slug;
-      const hasRemote = c.reference_urls && c.reference_urls.length > 0;
+      const hasRemote = c.remote_count > 0;
       const label = hasRemote
         ? `${c.name} (${c.reference_count || 0} refs)`
         : `${c.name} (${c.reference_count || 0} local refs)`;
       opt.textContent = label;
       el.appendChild(opt);
     });
-    if (current) el.value = current;
+    // Keep a selection that isn't on the loaded pages any more
+    if (current && current !== LOAD_MORE_VALUE && !cachedCharacters.some(c => c.slug === current)) {
+      const opt = document.createElement('option');
+      opt.value = current;
+      opt.textContent = currentLabel;
+      el.appendChild(opt);
+    }
+    if (characterCursor) {
+      const more = document.createElement('option');
+      more.value = LOAD_MORE_VALUE;
+      more.textContent = `— Load more (${cachedCharacters.length} of ${characterTotal}) —`;
+      el.appendChild(more);
+    }
+    if (current && current !== LOAD_MORE_VALUE) el.value = current;
   }
   const hasChars = cachedCharacters.length > 0;
   const noGen = document.getElementById('generate-no-chars');
   if (noGen) noGen.style.display = hasChars ? 'none' : 'block';
 }
 
+// Picker change: the "load more" entry fetches the next page and keeps the previous choice
+let pickedCharacter = '';
+async function onCharacterPicked(e) {
+  const el = e.target;
+  if (el.value !== LOAD_MORE_VALUE) {
+    pickedCharacter = el.value;
+    warmCharacter(el.value);
+    return;
+  }
+  el.value = pickedCharacter;
+  await loadMoreCharacters();
+  el.value = pickedCharacter;
+}
+
+// Resized local reference image. The version comes from the file's mtime and
+// size (see GET /api/characters/<slug>), so a replaced image gets a new URL.
+function charImageUrl(char, filename, width) {
+  const version = (char.image_versions || {})[filename] || '';
+  const params = new URLSearchParams({ w: width, fmt: 'webp', v: version });
+  return `/api/characters/${encodeURIComponent(char.slug)}/images/${encodeURIComponent(filename)}?${params}`;
+}
+
 function renderMyCharacters() {
   const section = document.getElementById('my-characters-section');
   if (!section) return;
@@ -545,11 +681,8 @@ function renderMyCharacters() {
   section.style.display = 'block';
   const grid = document.getElementById('my-characters-grid');
   grid.innerHTML = cachedCharacters.map(c => {
-    // Use local image if available, fallback to remote URL
-    const localFiles = c.local_files || [];
-    const thumb = localFiles.length > 0
-      ? `/api/characters/${encodeURIComponent(c.slug)}/images/${localFiles[0]}`
-      : (c.reference_urls && c.reference_urls.length > 0 ? c.reference_urls[0] : (c.seed_url || ''));
+    // Resized local image if available, else the first remote URL (see the API)
+    const thumb = c.thumbnail || '';
     return `<div class="char-card">
       <div class="char-card-img-wrap">
         ${thumb ? `<img src="${esc(thumb)}" alt="${esc(c.name)}" class="char-card-img" loading="lazy">` : '<div style="width:130px;height:130px;display:flex;align-items:center;justify-content:center;color:var(--text-2);font-size:0.75rem;">No image</div>'}
@@ -561,10 +694,19 @@ function renderMyCharacters() {
       </div>
       <div class="char-card-body">
         <div class="char-card-name" title="${esc(c.name)}">${esc(c.name)}</div>
-        <div class="char-card-meta">${c.reference_count || 0} references</div>
+        <div class="char-card-meta">${c.status === 'downloading' ? 'Downloading references…' : `${c.reference_count || 0} references`}</div>
       </div>
     </div>`;
-  }).join('');
+  }).join('') + (characterCursor
+    ? `<button class="btn btn-sm" onclick="loadMoreCharacters()" style="align-self:center;">Load more (${cachedCharacters.length} of ${characterTotal})</button>`
+    : '');
+}
+
+// Ask the server to pre-encode local references so the next generate is instant
+function warmCharacter(slug) {
+  const char = cachedCharacters.find(c => c.slug === slug);
+  if (!char || !char.local_count) return;
+  fetch('/api/characters/' + encodeURIComponent(slug) + '/warm', { method: 'POST' }).catch(() => {});
 }
 
 async function deleteCharacterEntry(slug) {
@@ -592,8 +734,16 @@ async function openCharFolder(slug) {
   }
 }
 
-function viewCharacterRefs(slug) {
-  const char = cachedCharacters.find(c => c.slug === slug);
+// Full registry entry (reference URLs, local files), or null
+async function fetchCharacter(slug) {
+  try {
+    const res = await fetch('/api/characters/' + encodeURIComponent(slug));
+    return res.ok ? await res.json() : null;
+  } catch { return null; }
+}
+
+async function viewCharacterRefs(slug) {
+  const char = await fetchCharacter(slug);
   if (!char) return;
   const localFiles = char.local_files || [];
   const urls = char.reference_urls || [];
@@ -605,7 +755,7 @@ function viewCharacterRefs(slug) {
   html += '<div style="display:flex;flex-wrap:wrap;gap:10px;justify-content:center;">';
   urls.forEach((url, i) => {
     const src = localFiles[i]
-      ? `/api/characters/${encodeURIComponent(slug)}/images/${localFiles[i]}`
+      ? charImageUrl(char, localFiles[i], 384)
       : url;
     html += `<div style="width:180px;">
       <a href="${esc(url)}" target="_blank"><img src="${esc(src)}" alt="Ref ${i + 1}" style="width:180px;height:180px;object-fit:cover;border-radius:10px;border:1px solid var(--border);display:block;" loading="lazy"></a>
@@ -622,11 +772,9 @@ async function generateSetChar() {
   const name = document.getElementById('setchar-name').value.trim();
   if (!name) { toast('Enter a character name', 'warning'); return; }
 
-  let seedImageUrl = uploadedFiles.setchar || '';
-  if (!seedImageUrl) {
-    seedImageUrl = document.getElementById('setchar-seed-url').value.trim();
-  }
-  if (!seedImageUrl) { toast('Upload a seed image or enter a URL', 'warning'); return; }
+  const seedUpload = uploadedSeeds.setchar;
+  const seedImageUrl = seedUpload ? '' : document.getElementById('setchar-seed-url').value.trim();
+  if (!seedUpload && !seedImageUrl) { toast('Upload a seed image or enter a URL', 'warning'); return; }
 
   if (!confirm(`Creating "${name}" will generate 20 reference images.\nThis costs ~200 credits and takes 2-3 minutes.\n\nProceed?`)) return;
 
@@ -635,16 +783,9 @@ async function generateSetChar() {
   showGenProgress('Starting character creation — this takes 2-3 minutes...');
 
   try {
-    const res = await fetch('/api/generate/turnaround', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        seed_image_url: seedImageUrl,
-        prompts: DEFAULT_TURNAROUND_PROMPTS,
-        reference_image_urls: []
-      })
-    });
-    const data = await res.json();
+    const seedHandle = seedUpload ? await seedUpload : null;
+    if (seedUpload && !seedHandle) { hideGenProgress(); btn.disabled = false; return; }
+    const { res, data } = await submitTurnaround(seedImageUrl, seedHandle);
     if (res.status === 402) {
       toast('Insufficient credits — buy more in the Credits tab', 'error');
       hideGenProgress(); btn.disabled = false; return;
@@ -677,6 +818,34 @@ async function generateSetChar() {
   }
 }
 
+// The server queues the turnaround as a background job (retrying gateway
+// errors with backoff); follow the job, then read the API response.
+async function submitTurnaround(seedImageUrl, seedHandle) {
+  const res = await fetch('/api/generate/turnaround', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      seed_image_url: seedImageUrl,
+      seed_handle: seedHandle || undefined,
+      prompts: DEFAULT_TURNAROUND_PROMPTS,
+      reference_image_urls: []
+    })
+  });
+  const data = await res.json();
+  if (res.status !== 202 || !data.job) return { res, data };
+
+  await waitForJob(data.job.id, (job) => {
+    if (job.state === 'retrying') {
+      const wait = job.next_attempt_at ? Math.max(0, Math.round((new Date(job.next_attempt_at) - Date.now()) / 1000)) : 0;
+      setProgress(5, `API busy (${job.error || 'error'}) — retrying in ${wait}s (attempt ${job.attempts}/${(job.progress || {}).max_attempts || '?'})...`);
+    } else if (job.state === 'running' && job.attempts > 1) {
+      setProgress(5, `Submitting character creation — attempt ${job.attempts}...`);
+    }
+  });
+  const resultRes = await fetch('/api/jobs/' + encodeURIComponent(data.job.id) + '/result');
+  return { res: resultRes, data: await resultRes.json() };
+}
+
 // Finalize character save (shared between new and recovered SetChar)
 async function finalizeSetChar(name, seedImageUrl, referenceUrls) {
   clearPendingSetChar();
@@ -697,10 +866,29 @@ async function finalizeSetChar(name, seedImageUrl, referenceUrls) {
         reference_urls: referenceUrls
       })
     });
-    const saveData = await saveRes.json();
+    let saveData = await saveRes.json();
+
+    // The server registers the character immediately and downloads the
+    // references in a background job — follow it until it finishes.
+    if (saveData.success && saveData.job) {
+      const progress = document.getElementById('gen-progress-container');
+      const job = await waitForJob(saveData.job.id, (j) => {
+        const p = j.progress || {};
+        if (!p.total) return;
+        progress.classList.remove('hidden');
+        setProgress(Math.round((p.done / p.total) * 100), `Saving reference images... ${p.done}/${p.total}`);
+      });
+      saveData = job.state === 'completed'
+        ? { success: true, ...job.result }
+        : { success: false, error: job.error || 'reference download failed' };
+    }
 
     if (saveData.success) {
       toast(`Character "${name}" created with ${referenceUrls.length} reference images!`, 'success');
+      const failedDownloads = (saveData.downloads || []).filter(d => !d.ok);
+      if (failedDownloads.length) {
+        toast(`${failedDownloads.length} reference image(s) could not be saved locally`, 'warning');
+      }
       loadCharacters();
       refreshBalance();
       showSetCharResult(name, referenceUrls);
@@ -712,6 +900,33 @@ async function finalizeSetChar(name, seedImageUrl, referenceUrls) {
   }
 }
 
+// Follow a background job (see jobs.py) until it completes or fails
+function waitForJob(jobId, onUpdate) {
+  return new Promise((resolve) => {
+    const done = (job) => ['completed', 'failed'].includes(job.state);
+    const pollJob = async () => {
+      try {
+        const res = await fetch('/api/jobs/' + encodeURIComponent(jobId));
+        const job = await res.json();
+        if (res.status === 404) { resolve({ state: 'failed', error: job.error }); return; }
+        onUpdate(job);
+        if (done(job)) { resolve(job); return; }
+      } catch { /* retry */ }
+      setTimeout(pollJob, 2000);
+    };
+    if (!window.EventSource) { pollJob(); return; }
+    const source = new EventSource('/api/jobs/' + encodeURIComponent(jobId) + '/events');
+    source.addEventListener('job', (e) => {
+      const job = JSON.parse(e.data);
+      onUpdate(job);
+      if (done(job)) { source.close(); resolve(job); }
+    });
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) pollJob();
+    };
+  });
+}
+
 // Check for interrupted SetChar on page load
 async function checkPendingSetChar() {
   const pending = getPendingSetChar();
@@ -764,7 +979,7 @@ async function generateWithCharacter() {
   const prompt = document.getElementById('generate-prompt').value.trim();
   if (!prompt) { toast('Enter a scene prompt', 'warning'); return; }
 
-  const char = cachedCharacters.find(c => c.slug === slug);
+  const char = await fetchCharacter(slug);
   const hasRemoteRefs = char && char.reference_urls && char.reference_urls.length > 0;
   const hasLocalFiles = char && char.local_files && char.local_files.length > 0;
   if (!char || (!hasRemoteRefs && !hasLocalFiles)) {
@@ -814,7 +1029,7 @@ async function generateRandom() {
   const slug = select.value;
   if (!slug) { toast('Select a character first', 'warning'); return; }
 
-  const char = cachedCharacters.find(c => c.slug === slug);
+  const char = await fetchCharacter(slug);
   const hasRemoteRefs = char && char.reference_urls && char.reference_urls.length > 0;
   const hasLocalFiles = char && char.local_files && char.local_files.length > 0;
   if (!char || (!hasRemoteRefs && !hasLocalFiles)) {
@@ -877,8 +1092,63 @@ function setProgress(pct, text) {
 }
 
 // ══════════ POLLING ══════════
+// The server tracks every generation ID and polls the API from one place
+// (poller.py); the browser just subscribes to state changes for its IDs.
+const TERMINAL_STATUSES = ['completed', 'failed'];
+
+function watchGenerations(genIds, onUpdate, timeoutMs) {
+  return new Promise((resolve) => {
+    let latest = {};
+    let finished = false;
+    let source = null;
+    let fallbackTimer = null;
+
+    const finish = () => {
+      if (finished) return;
+      finished = true;
+      clearTimeout(guard);
+      clearTimeout(fallbackTimer);
+      if (source) source.close();
+      resolve(latest);
+    };
+    const apply = (statuses) => {
+      latest = { ...latest, ...statuses };
+      onUpdate(latest);
+      if (genIds.every(id => latest[id] && TERMINAL_STATUSES.includes(latest[id].status))) finish();
+    };
+    const guard = setTimeout(finish, timeoutMs);
+
+    // Fallback when the event stream is unavailable: one batch request per round
+    const pollBatch = async () => {
+      if (finished) return;
+      try {
+        const res = await fetch('/api/asset/status/batch', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ ids: genIds })
+        });
+        if (res.ok) {
+          const data = await res.json();
+          apply(data.statuses || {});
+        }
+      } catch { /* retry next round */ }
+      if (!finished) fallbackTimer = setTimeout(pollBatch, 5000);
+    };
+
+    if (window.EventSource) {
+      source = new EventSource('/api/asset/events?ids=' + genIds.map(encodeURIComponent).join(','));
+      source.addEventListener('status', e => apply(JSON.parse(e.data)));
+      source.addEventListener('done', finish);
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED && !finished) pollBatch();
+      };
+    } else {
+      pollBatch();
+    }
+  });
+}
+
 async function pollGeneration(generationId) {
-  const maxAttempts = 120;   // 120 × 2.5s = 5 min
   const startTime = Date.now();
   const timeoutMs = 5 * 60 * 1000; // 5 min per SKILL.md
   const statusMessages = [
@@ -889,202 +1159,89 @@ async function pollGeneration(generationId) {
     'Almost there...'
   ];
 
-  for (let attempts = 1; attempts <= maxAttempts; attempts++) {
-    // Per-task timeout check
-    if (Date.now() - startTime > timeoutMs) {
-      toast('Generation timed out (>5 min) — try again', 'warning');
-      hideGenProgress();
-      return;
-    }
-
-    const pct = Math.min(95, 5 + (attempts / maxAttempts) * 90);
+  const tick = setInterval(() => {
+    const pct = Math.min(95, 5 + ((Date.now() - startTime) / timeoutMs) * 90);
     const msgIndex = Math.min(statusMessages.length - 1, Math.floor((pct / 100) * statusMessages.length));
     setProgress(pct, `${statusMessages[msgIndex]} ${Math.round(pct)}%`);
+  }, 1000);
 
-    try {
-      const res = await fetch(`/api/asset/status/${generationId}`);
+  // Small grace period on top of the server-side per-task timeout
+  const statuses = await watchGenerations([generationId], () => {}, timeoutMs + 30000);
+  clearInterval(tick);
 
-      // Handle 429 rate limit
-      if (res.status === 429) {
-        console.log('[POLL] Rate limited — backing off 15s');
-        await new Promise(r => setTimeout(r, 15000));
-        continue;
-      }
-
-      const data = await res.json();
-      const st = data.data || data;
-      const status = st.status || 'pending';
-
-      if (status === 'completed' || status === 'succeeded' || status === 'done') {
-        // Check download_available if present
-        if (st.download_available === false) {
-          await new Promise(r => setTimeout(r, 2500));
-          continue;
-        }
-        setProgress(100, 'Done! Loading your image...');
-        setTimeout(() => hideGenProgress(), 800);
-        showResult(generationId);
-        refreshBalance();
-        return;
-      } else if (status === 'failed' || status === 'error') {
-        toast('Generation failed: ' + (st.error_message || st.error || 'unknown — credits auto-refunded'), 'error');
-        hideGenProgress();
-        refreshBalance();
-        return;
-      }
-    } catch { /* retry next round */ }
-
-    await new Promise(r => setTimeout(r, 2500));
+  const st = statuses[generationId] || {};
+  if (st.status === 'completed') {
+    setProgress(100, 'Done! Loading your image...');
+    setTimeout(() => hideGenProgress(), 800);
+    showResult(generationId, st.download_url);
+    refreshBalance();
+  } else if (st.status === 'failed') {
+    toast('Generation failed: ' + (st.error || 'unknown — credits auto-refunded'), 'error');
+    hideGenProgress();
+    refreshBalance();
+  } else {
+    toast('Generation timed out — try again', 'warning');
+    hideGenProgress();
   }
+}
 
-  toast('Generation timed out — try again', 'warning');
-  hideGenProgress();
-}
-
-function pollSetCharBatch(genIds, preCompleted = {}) {
-  return new Promise(async (resolve) => {
-    const maxRounds = 90;                  // 90 rounds × 10s = 15 min max
-    const perTaskTimeoutMs = 5 * 60 * 1000; // 5 min per task (per SKILL.md)
-    const completed = { ...preCompleted };  // pre-loaded from recovery
-    const failed = new Set();
-    const dlRetries = {};                   // download retry count per gid
-    const taskFirstSeen = {};               // when each task was first polled
-
-    for (let round = 1; round <= maxRounds; round++) {
-      const readyCount = Object.keys(completed).length;
-      const doneCount = readyCount + failed.size;
-      const pct = Math.min(95, 5 + (doneCount / genIds.length) * 90);
-      const phaseText = readyCount === 0 ? 'Generating reference images...' :
-                        readyCount < 10 ? 'Building character profile...' :
-                        readyCount < 18 ? 'Finishing up references...' : 'Almost done...';
-      setProgress(pct, `${phaseText} ${readyCount}/${genIds.length} ready`);
-
-      // Poll each pending ID sequentially (rate-limit safe per docs)
-      for (const gid of genIds) {
-        if (completed[gid] || failed.has(gid)) continue;
-
-        // Track when we first saw this task
-        if (!taskFirstSeen[gid]) taskFirstSeen[gid] = Date.now();
-
-        // Per-task timeout: if stuck >5 min, give up on it (per SKILL.md)
-        if (Date.now() - taskFirstSeen[gid] > perTaskTimeoutMs) {
-          console.log(`[POLL] ${gid.slice(0,8)} → TIMEOUT (>5 min stuck), giving up`);
-          failed.add(gid);
-          continue;
-        }
-
-        try {
-          const res = await fetch(`/api/asset/status/${gid}`);
-
-          // Handle 429 rate limit: back off 15 seconds (per SKILL.md)
-          if (res.status === 429) {
-            console.log(`[POLL] Rate limited (429) — backing off 15s`);
-            await new Promise(r => setTimeout(r, 15000));
-            continue;
-          }
+async function pollSetCharBatch(genIds, preCompleted = {}) {
+  const maxWaitMs = 15 * 60 * 1000;      // 15 min max for the whole batch
+  const completed = { ...preCompleted }; // pre-loaded from recovery
+  const failed = new Set();
+  const remaining = genIds.filter(gid => !completed[gid]);
 
-          const data = await res.json();
-          const st = data.data || data;
-          const status = st.status || 'pending';
-          const downloadAvailable = st.download_available;
-          console.log(`[POLL] ${gid.slice(0,8)} → status: ${status}, download_available: ${downloadAvailable}`);
-
-          if (['completed', 'succeeded', 'done'].includes(status)) {
-            // Per docs: only download when download_available is true
-            // But some API versions may not return this field — so treat missing as true
-            if (downloadAvailable === false) {
-              console.log(`[POLL] ${gid.slice(0,8)} → completed but download_available=false, retry next round`);
-              continue;
-            }
-
-            console.log(`[POLL] ${gid.slice(0,8)} → COMPLETED, fetching download...`);
-            dlRetries[gid] = (dlRetries[gid] || 0) + 1;
-
-            try {
-              const dlRes = await fetch(`/api/asset/download/${gid}`);
-
-              // Handle 409 Conflict: "generation not ready for download" (per SKILL.md)
-              if (dlRes.status === 409) {
-                console.log(`[POLL] ${gid.slice(0,8)} download 409 (not ready) — retry next round`);
-                continue;
-              }
-
-              // Handle 429 rate limit on download too
-              if (dlRes.status === 429) {
-                console.log(`[POLL] Download rate limited (429) — backing off 15s`);
-                await new Promise(r => setTimeout(r, 15000));
-                continue;
-              }
-
-              const dlData = await dlRes.json();
-
-              // Backend returned temp error (503) — retry
-              if (dlData._retry || dlRes.status === 503) {
-                console.log(`[POLL] ${gid.slice(0,8)} download temp error (try ${dlRetries[gid]}/5) — will retry`);
-                if (dlRetries[gid] >= 5) { failed.add(gid); }
-                continue;
-              }
-
-              const dd = dlData.data || dlData;
-              const url = dd.download_url || dd.url;
-              console.log(`[POLL] ${gid.slice(0,8)} download url: ${url}`);
-              if (url) {
-                completed[gid] = url;
-              } else {
-                console.log(`[POLL] ${gid.slice(0,8)} no download URL (try ${dlRetries[gid]}/5)`);
-                if (dlRetries[gid] >= 5) failed.add(gid);
-              }
-            } catch (dlErr) {
-              console.log(`[POLL] ${gid.slice(0,8)} download fetch error (try ${dlRetries[gid]}/5): ${dlErr}`);
-              if (dlRetries[gid] >= 5) failed.add(gid);
-            }
-          } else if (['failed', 'error'].includes(status)) {
-            // Credits auto-refunded on failure (per SKILL.md)
-            const errMsg = st.error_message || st.error || '';
-            console.log(`[POLL] ${gid.slice(0,8)} → FAILED: ${errMsg}`);
-            failed.add(gid);
-          }
-          // else: pending/processing — just continue to next round
-        } catch {
-          // Network error on status check — skip, retry next round
+  const render = () => {
+    const readyCount = Object.keys(completed).length;
+    const doneCount = readyCount + failed.size;
+    const pct = Math.min(95, 5 + (doneCount / genIds.length) * 90);
+    const phaseText = readyCount === 0 ? 'Generating reference images...' :
+                      readyCount < 10 ? 'Building character profile...' :
+                      readyCount < 18 ? 'Finishing up references...' : 'Almost done...';
+    setProgress(pct, `${phaseText} ${readyCount}/${genIds.length} ready`);
+  };
+  render();
+
+  if (remaining.length > 0) {
+    await watchGenerations(remaining, (statuses) => {
+      for (const [gid, st] of Object.entries(statuses)) {
+        if (st.status === 'completed' && st.download_url) {
+          completed[gid] = st.download_url;
+        } else if (st.status === 'failed' && !failed.has(gid)) {
+          // Credits auto-refunded on failure (per SKILL.md)
+          console.log(`[POLL] ${gid.slice(0,8)} → FAILED: ${st.error || ''}`);
+          failed.add(gid);
         }
       }
-
-      const totalDone = Object.keys(completed).length + failed.size;
-      console.log(`[POLL] Round ${round}: ${Object.keys(completed).length} completed, ${failed.size} failed, ${genIds.length - totalDone} pending`);
-
-      // Save progress to localStorage after each round
+      render();
+      // Save progress to localStorage so a refresh can resume
       updatePendingSetChar(completed, Array.from(failed));
+    }, maxWaitMs);
+  }
 
-      if (totalDone >= genIds.length) {
-        break;
-      }
-
-      // Wait 10 seconds before next round (per SKILL.md)
-      await new Promise(r => setTimeout(r, 10000));
-    }
-
-    const readyCount = Object.keys(completed).length;
-    const totalDone = readyCount + failed.size;
-    if (totalDone < genIds.length) {
-      toast(`Timed out — ${readyCount} of ${genIds.length} images completed.`, 'warning');
-    } else if (failed.size > 0) {
-      toast(`${readyCount} of ${genIds.length} images ready (${failed.size} failed — credits auto-refunded).`, 'warning');
-    }
-    setProgress(100, 'Character created!');
-    setTimeout(() => hideGenProgress(), 800);
-    resolve(Object.values(completed));
-  });
+  const readyCount = Object.keys(completed).length;
+  const totalDone = readyCount + failed.size;
+  if (totalDone < genIds.length) {
+    toast(`Timed out — ${readyCount} of ${genIds.length} images completed.`, 'warning');
+  } else if (failed.size > 0) {
+    toast(`${readyCount} of ${genIds.length} images ready (${failed.size} failed — credits auto-refunded).`, 'warning');
+  }
+  setProgress(100, 'Character created!');
+  setTimeout(() => hideGenProgress(), 800);
+  return Object.values(completed);
 }
 
 // ══════════ RESULTS ══════════
-async function showResult(generationId) {
+async function showResult(generationId, knownUrl) {
   const container = document.getElementById('gen-result-content');
   try {
-    const res = await fetch(`/api/asset/download/${generationId}`);
-    const data = await res.json();
-    const downloadData = data.data || data;
-    const downloadUrl = downloadData.download_url || downloadData.url;
+    let downloadUrl = knownUrl;
+    if (!downloadUrl) {
+      const res = await fetch(`/api/asset/download/${generationId}`);
+      const data = await res.json();
+      const downloadData = data.data || data;
+      downloadUrl = downloadData.download_url || downloadData.url;
+    }
     if (!downloadUrl) {
       container.innerHTML = `<p class="text-red">No download URL returned.</p>`;
       return;
@@ -1214,60 +1371,115 @@ function esc(str) {
 }
 
 // ══════════ GALLERY ══════════
-const GALLERY_KEY = 'cis_gallery';
+// The gallery lives on the server (gallery.py): completed generations are
+// mirrored locally and listed a page at a time.
+const GALLERY_KEY = 'cis_gallery';   // legacy browser-side gallery, imported once
+const GALLERY_PAGE_SIZE = 60;
+const galleryState = { items: [], total: 0, cursor: null, kind: '', loading: false };
+
+async function addToGallery(generationId, imageUrl) {
+  try {
+    await fetch('/api/gallery', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ id: generationId, url: imageUrl })
+    });
+  } catch { /* the server also mirrors completed generations on its own */ }
+  loadGallery();
+}
 
-function getGalleryItems() {
+async function importLegacyGallery() {
+  let items;
+  try {
+    items = JSON.parse(localStorage.getItem(GALLERY_KEY) || '[]');
+  } catch { items = []; }
+  if (!items.length) { localStorage.removeItem(GALLERY_KEY); return; }
   try {
-    return JSON.parse(localStorage.getItem(GALLERY_KEY) || '[]');
-  } catch { return []; }
+    const res = await fetch('/api/gallery', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ items })
+    });
+    if (res.ok) localStorage.removeItem(GALLERY_KEY);
+  } catch { /* try again next load */ }
 }
 
-function addToGallery(generationId, imageUrl) {
-  const items = getGalleryItems();
-  // Avoid duplicates
-  if (items.some(item => item.id === generationId)) return;
-  items.unshift({ id: generationId, url: imageUrl, date: new Date().toISOString() });
-  // Keep last 200
-  if (items.length > 200) items.length = 200;
-  localStorage.setItem(GALLERY_KEY, JSON.stringify(items));
-  renderGallery(items);
+async function loadGallery(append = false) {
+  if (galleryState.loading) return;
+  galleryState.loading = true;
+  if (!append && localStorage.getItem(GALLERY_KEY)) await importLegacyGallery();
+  const params = new URLSearchParams({ limit: GALLERY_PAGE_SIZE });
+  if (append && galleryState.cursor) params.set('cursor', galleryState.cursor);
+  if (galleryState.kind) params.set('kind', galleryState.kind);
+  try {
+    const res = await fetch('/api/gallery?' + params);
+    const data = await res.json();
+    galleryState.items = append ? galleryState.items.concat(data.items || []) : (data.items || []);
+    galleryState.total = data.total || 0;
+    galleryState.cursor = data.next_cursor || null;
+  } catch {
+    if (!append) galleryState.items = [];
+  } finally {
+    galleryState.loading = false;
+  }
+  renderGallery();
 }
 
-function loadGallery() {
-  renderGallery(getGalleryItems());
+function filterGallery(kind) {
+  galleryState.kind = kind;
+  galleryState.cursor = null;
+  loadGallery();
 }
 
-function renderGallery(items) {
+function renderGallery() {
   const el = document.getElementById('gallery-content');
   if (!el) return;
-  if (!items || items.length === 0) {
+  const { items, total, kind } = galleryState;
+  if (items.length === 0 && !kind) {
     el.innerHTML = '<p class="text-dim" style="text-align:center;padding:40px 0;">Your generated images will appear here. Generate something first!</p>';
     return;
   }
+  const kinds = [['', 'All'], ['seed', 'Seed'], ['create', 'Create'], ['random', 'Random'], ['turnaround', 'SetChar']];
   let html = `<div class="gallery-header">
-    <span class="gallery-count">${items.length} image${items.length !== 1 ? 's' : ''}</span>
-    <button class="btn btn-outline btn-small" onclick="clearGallery()">Clear All</button>
+    <span class="gallery-count">${total} image${total !== 1 ? 's' : ''}</span>
+    <div class="flex gap-10">
+      <select onchange="filterGallery(this.value)">
+        ${kinds.map(([v, label]) => `<option value="${v}"${v === kind ? ' selected' : ''}>${label}</option>`).join('')}
+      </select>
+      <button class="btn btn-outline btn-small" onclick="clearGallery()">Clear All</button>
+    </div>
   </div>`;
   html += '<div class="gallery-grid">';
   items.forEach(item => {
-    const date = item.date ? new Date(item.date).toLocaleDateString() : '';
+    const date = item.created_at ? new Date(item.created_at).toLocaleDateString() : '';
     html += `<div class="gallery-item">
-      <img src="${esc(item.url)}" alt="Generated" loading="lazy">
+      <img src="${esc(item.thumb_url)}" alt="Generated" loading="lazy">
       <div class="gallery-item-actions">
         <a href="${esc(item.url)}" download="gen-${esc(item.id)}.png" target="_blank">Download</a>
-        <button onclick="useInSetChar('${esc(item.url)}')">Use in SetChar</button>
+        <button onclick="useInSetChar('${esc(item.source_url || item.url)}')">Use in SetChar</button>
       </div>
       <div class="gallery-item-date">${date}</div>
     </div>`;
   });
   html += '</div>';
+  if (galleryState.cursor) {
+    html += `<div class="text-center mt-16"><button class="btn btn-outline btn-small" onclick="loadGallery(true)">Load more</button></div>`;
+  }
   el.innerHTML = html;
 }
 
-function clearGallery() {
+async function clearGallery() {
   if (!confirm('Clear all gallery images?')) return;
-  localStorage.removeItem(GALLERY_KEY);
-  renderGallery([]);
+  try {
+    await fetch('/api/gallery', { method: 'DELETE' });
+  } catch (e) {
+    toast('Error: ' + e.message, 'error');
+    return;
+  }
+  galleryState.items = [];
+  galleryState.total = 0;
+  galleryState.cursor = null;
+  renderGallery();
   toast('Gallery cleared', 'success');
 }
 
@@ -1283,6 +1495,8 @@ window.openCharFolder = openCharFolder;
 window.viewCharacterRefs = viewCharacterRefs;
 window.useInSetChar = useInSetChar;
 window.clearGallery = clearGallery;
+window.loadGallery = loadGallery;
+window.filterGallery = filterGallery;
 
 // Warn user before closing/refreshing if a SetChar is in progress
 window.addEventListener('beforeunload', (e) => {
@@ -0,0 +1,127 @@
+"""
+On-demand image derivatives for character reference images.
+
+`serve_character_image` can ask for a resized copy (`?w=256&fmt=webp`)
+instead of the full-resolution reference. Derivatives are rendered once with
+Pillow (using JPEG draft mode when possible) and written to a disk cache
+laid out as `<cache>/<slug>/<file>-<mtime>-<width>.<fmt>`, so editing a
+source file produces a new derivative and the old one is cleaned up.
+"""
+
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+# Requested widths are snapped up to one of these to keep the cache bounded
+WIDTHS = (64, 128, 256, 384, 512, 768, 1024)
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG", "jpg": "JPEG", "png": "PNG"}
+MIMETYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+# Renders of the same derivative are serialised on one of this many locks
+LOCK_STRIPES = 64
+
+
+def snap_width(width):
+    for w in WIDTHS:
+        if width <= w:
+            return w
+    return WIDTHS[-1]
+
+
+class ThumbnailCache:
+    """Renders and caches resized copies of reference images."""
+
+    def __init__(self, cache_dir, quality=82):
+        self.cache_dir = Path(cache_dir)
+        self.quality = quality
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.rendered = 0
+        self.hits = 0
+
+    def get(self, slug, source, width, fmt="webp"):
+        """Path to a derivative of `source` (a file in the slug's folder).
+
+        Returns (path, mimetype), or None if Pillow isn't available or the
+        source can't be decoded — callers should then serve the original.
+        """
+        pil_format = FORMATS.get(fmt.lower())
+        if pil_format is None:
+            return None
+        width = snap_width(width)
+        st = source.stat()
+        ext = "jpg" if pil_format == "JPEG" else pil_format.lower()
+        out_dir = self.cache_dir / slug
+        target = out_dir / f"{source.name}-{st.st_mtime_ns}-{width}.{ext}"
+        if target.exists():
+            self.hits += 1
+            return target, MIMETYPES[pil_format]
+
+        with self._lock_for(target):
+            if not target.exists():
+                if not self._render(source, target, width, pil_format):
+                    return None
+                self._remove_stale(out_dir, source.name, target)
+        return target, MIMETYPES[pil_format]
+
+    def invalidate(self, slug):
+        """Drop every derivative of a character (e.g. when it is deleted)."""
+        shutil.rmtree(self.cache_dir / slug, ignore_errors=True)
+
+    def invalidate_file(self, slug, name):
+        """Drop the derivatives of one source file."""
+        for f in (self.cache_dir / slug).glob(f"{name}-*"):
+            try:
+                f.unlink()
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"hits": self.hits, "rendered": self.rendered}
+
+    # ── Internals ─────────────────────────────
+
+    def _lock_for(self, target):
+        # A fixed set of locks, so the count doesn't grow with every width,
+        # format and image ever served; unrelated targets rarely share one
+        return self._locks[hash(str(target)) % LOCK_STRIPES]
+
+    def _render(self, source, target, width, pil_format):
+        try:
+            from PIL import Image
+        except ImportError:
+            return False
+        try:
+            with Image.open(source) as img:
+                # JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale directly
+                img.draft("RGB", (width, width))
+                img.thumbnail((width, width), Image.LANCZOS)
+                if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+                    img = img.convert("RGBA")
+                target.parent.mkdir(parents=True, exist_ok=True)
+                tmp = target.with_name(target.name + f".tmp{threading.get_ident()}")
+                if pil_format == "WEBP":
+                    img.save(tmp, format="WEBP", quality=self.quality, method=4)
+                else:
+                    img.save(tmp, format=pil_format, quality=self.quality, optimize=True)
+            os.replace(tmp, target)
+            self.rendered += 1
+            return True
+        except Exception as e:
+            log.warning("[THUMB] Could not render %s: %s", source, e)
+            return False
+
+    @staticmethod
+    def _remove_stale(out_dir, name, keep):
+        """Remove derivatives of older versions of the same source file."""
+        suffix = keep.name.split("-")[-1]   # "<width>.<ext>"
+        for f in out_dir.glob(f"{name}-*-{suffix}"):
+            if f != keep:
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
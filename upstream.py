@@ -0,0 +1,462 @@
+"""
+Upstream client — a single pooled, keep-alive HTTP client for the NeukoAI API.
+
+Every proxy route in app.py talks to the API through one shared
+`UpstreamClient`, so TCP+TLS handshakes are paid once per pooled connection
+instead of once per call. The client also owns the "call, and if 401 then
+re-login and call again" dance, per-endpoint timeouts, and counters that
+show how well connections are being reused, and records every HTTP call in
+the latency histograms served at /metrics (see metrics.py).
+
+Every call to the API also passes through one shared admission controller
+(see ratelimit.py): an adaptive token bucket that keeps the process just
+under the API's rate limit, with generate submissions ahead of status polls,
+and a circuit breaker that fails fast during outages. Calls that are turned
+away get a local 429/503 response, which routes already know how to handle.
+
+Large generation payloads (base64 reference images) are sent with
+`StreamingJSON`, which serialises the document piece by piece while it is
+being uploaded instead of building the whole JSON text in memory first.
+
+`AsyncUpstreamClient` is the asyncio counterpart used by the ASGI entry point
+(asgi.py). It shares the sync client's auth, timeouts, admission control and
+stats, and needs the optional `httpx` package.
+"""
+
+import asyncio
+import json
+import math
+import re
+import threading
+import time
+
+import requests as http_requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from metrics import Counter, Histogram
+from ratelimit import (PRIORITY_GENERATE, PRIORITY_INTERACTIVE, PRIORITY_POLL,
+                       AdaptiveRateLimiter, CircuitBreaker)
+
+# Default timeout (seconds) per logical endpoint. Routes pass `endpoint=` and
+# get the matching timeout unless they override it explicitly.
+ENDPOINT_TIMEOUTS = {
+    "auth": 15,
+    "me": 10,
+    "balance": 10,
+    "pricing": 10,
+    "transactions": 10,
+    "bundles": 10,
+    "checkout": 15,
+    "payment_status": 10,
+    "seed": 60,
+    "create": 60,
+    "random": 60,
+    "turnaround": 180,
+    "status": 30,
+    "download": 30,
+    "asset_fetch": 60,
+}
+DEFAULT_TIMEOUT = 30
+
+# Admission priority per endpoint (default: interactive)
+ENDPOINT_PRIORITY = {
+    "seed": PRIORITY_GENERATE,
+    "create": PRIORITY_GENERATE,
+    "random": PRIORITY_GENERATE,
+    "turnaround": PRIORITY_GENERATE,
+    "checkout": PRIORITY_GENERATE,
+    "status": PRIORITY_POLL,
+    "download": PRIORITY_POLL,
+}
+# How long a call may wait for a token before it gets a local 429
+ADMISSION_TIMEOUT = {PRIORITY_GENERATE: 60.0, PRIORITY_INTERACTIVE: 15.0, PRIORITY_POLL: 10.0}
+FAILURE_STATUSES = {502, 503, 504}
+
+UPSTREAM_SECONDS = Histogram("cis_upstream_request_duration_seconds",
+                             "Duration of one HTTP call to the API, by endpoint and status",
+                             ("endpoint", "status"))
+UPSTREAM_SENT = Counter("cis_upstream_sent_bytes_total",
+                        "Request body bytes sent to the API", ("endpoint",))
+UPSTREAM_RECEIVED = Counter("cis_upstream_received_bytes_total",
+                            "Response body bytes received from the API (by Content-Length)", ("endpoint",))
+UPSTREAM_REFUSED = Counter("cis_upstream_refused_total",
+                           "Calls answered locally by admission control", ("endpoint", "reason"))
+
+# Strings at least this long are streamed in slices rather than encoded whole
+STREAM_MIN_STRING = 64 * 1024
+STREAM_CHUNK = 256 * 1024
+_NEEDS_ESCAPE = re.compile(r'["\\\x00-\x1f\x80-\U0010ffff]')
+
+
+class StreamingJSON:
+    """A JSON request body generated chunk by chunk.
+
+    Pass as `data=` to `UpstreamClient.request`. Long strings (data URIs) are
+    sliced straight out of the existing str objects — typically the entries
+    of the reference cache — so no second full copy of the images is made.
+    The encoded length is computed up front, so the body goes out with a
+    Content-Length; it can be iterated more than once (e.g. after a re-login).
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        self._length = sum(self._size(part) for part in self._parts(obj))
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        buf = []
+        buffered = 0
+        for part in self._parts(self.obj):
+            if isinstance(part, str) and len(part) >= STREAM_MIN_STRING:
+                if buf:
+                    yield b"".join(buf)
+                    buf, buffered = [], 0
+                yield from self._string_chunks(part)
+            else:
+                buf.append(part)
+                buffered += len(part)
+                if buffered >= STREAM_CHUNK:
+                    yield b"".join(buf)
+                    buf, buffered = [], 0
+        if buf:
+            yield b"".join(buf)
+
+    def _parts(self, obj):
+        """Encoded bytes for structure and small values; long strings as-is."""
+        if isinstance(obj, dict):
+            yield b"{"
+            for i, (key, value) in enumerate(obj.items()):
+                yield (b", " if i else b"") + json.dumps(str(key)).encode("ascii") + b": "
+                yield from self._parts(value)
+            yield b"}"
+        elif isinstance(obj, (list, tuple)):
+            yield b"["
+            for i, value in enumerate(obj):
+                if i:
+                    yield b", "
+                yield from self._parts(value)
+            yield b"]"
+        elif isinstance(obj, str) and len(obj) >= STREAM_MIN_STRING:
+            yield obj
+        else:
+            yield json.dumps(obj).encode("ascii")
+
+    @staticmethod
+    def _size(part):
+        if isinstance(part, bytes):
+            return len(part)
+        if not _NEEDS_ESCAPE.search(part):
+            return len(part) + 2
+        return sum(len(json.dumps(part[i:i + STREAM_CHUNK]).encode("ascii")) - 2
+                   for i in range(0, len(part), STREAM_CHUNK)) + 2
+
+    @staticmethod
+    def _string_chunks(s):
+        plain = not _NEEDS_ESCAPE.search(s)
+        yield b'"'
+        for i in range(0, len(s), STREAM_CHUNK):
+            piece = s[i:i + STREAM_CHUNK]
+            yield piece.encode("ascii") if plain else json.dumps(piece).encode("ascii")[1:-1]
+        yield b'"'
+
+
+def _retry_after(resp):
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
+def _observe(endpoint, start, resp=None):
+    """Record one HTTP call (resp=None: it raised) in the upstream metrics."""
+    UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint,
+                             status=resp.status_code if resp is not None else "error")
+    if resp is None:
+        return
+    sent = resp.request.headers.get("Content-Length")
+    if sent:
+        UPSTREAM_SENT.inc(int(sent), endpoint=endpoint)
+    received = resp.headers.get("Content-Length")
+    if received:
+        UPSTREAM_RECEIVED.inc(int(received), endpoint=endpoint)
+
+
+def _local_response(url, status, message, retry_after=None):
+    """A response generated here instead of by the API (admission refused)."""
+    resp = http_requests.Response()
+    resp.status_code = status
+    resp.url = url
+    resp.reason = message
+    resp._content = json.dumps({"error": message}).encode("utf-8")
+    resp._content_consumed = True
+    resp.headers["Content-Type"] = "application/json"
+    if retry_after:
+        resp.headers["Retry-After"] = str(math.ceil(retry_after))
+    return resp
+
+
+class UpstreamClient:
+    """Thread-safe wrapper around a pooled `requests.Session`.
+
+    `auth_header` is a callable returning the headers for authenticated calls;
+    `relogin(stale_token)` is called once when an authenticated call comes back
+    401 — with the bearer token that was rejected — and should return a truthy
+    value if a fresh token is now available.
+    """
+
+    def __init__(self, base_url, auth_header=None, relogin=None,
+                 pool_connections=4, pool_maxsize=32, timeouts=None, limiter=None, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self._auth_header = auth_header
+        self._relogin = relogin
+        self.timeouts = dict(ENDPOINT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session = http_requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+        self._lock = threading.Lock()
+        self._calls = {}        # endpoint -> {"count", "errors", "reauth", "total_ms"}
+        self._reauths = 0
+
+    # ── Requests ──────────────────────────────
+
+    def request(self, method, path, *, endpoint="default", auth=True, timeout=None,
+                headers=None, **kwargs):
+        """Send a request to the API (or to an absolute URL) over the shared pool.
+
+        Authenticated calls that return 401 trigger one re-login and retry.
+        Exceptions from `requests` propagate to the caller unchanged. Calls to
+        the API (not absolute URLs elsewhere) go through admission control.
+        """
+        url = path if path.startswith(("http://", "https://")) else f"{self.base_url}{path}"
+        if timeout is None:
+            timeout = self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+
+        start = time.perf_counter()
+        reauthed = False
+        try:
+            sent = self._headers(auth, headers)
+            resp = self._send(method, url, endpoint, headers=sent, timeout=timeout, **kwargs)
+            if (auth and resp.status_code == 401 and self._relogin
+                    and self._relogin(sent.get("Authorization", "").removeprefix("Bearer "))):
+                reauthed = True
+                resp.close()
+                resp = self._send(method, url, endpoint, headers=self._headers(auth, headers),
+                                  timeout=timeout, **kwargs)
+        except Exception:
+            self._record(endpoint, start, error=True, reauthed=reauthed)
+            raise
+        self._record(endpoint, start, error=False, reauthed=reauthed)
+        return resp
+
+    def _send(self, method, url, endpoint, **kwargs):
+        if not url.startswith(self.base_url):
+            return self._call(method, url, endpoint, **kwargs)
+        priority = ENDPOINT_PRIORITY.get(endpoint, PRIORITY_INTERACTIVE)
+        if not self.limiter.acquire(priority, timeout=ADMISSION_TIMEOUT[priority]):
+            UPSTREAM_REFUSED.inc(endpoint=endpoint, reason="rate_limit")
+            return _local_response(url, 429, "rate limited (local admission control)", 5)
+        if not self.breaker.allow():
+            UPSTREAM_REFUSED.inc(endpoint=endpoint, reason="circuit_open")
+            return _local_response(url, 503, "API unavailable — failing fast while it recovers",
+                                   self.breaker.retry_after())
+        try:
+            resp = self._call(method, url, endpoint, **kwargs)
+        except Exception:
+            self.breaker.record(False)
+            raise
+        self.limiter.on_response(resp.status_code, _retry_after(resp))
+        self.breaker.record(resp.status_code not in FAILURE_STATUSES)
+        return resp
+
+    def _call(self, method, url, endpoint, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except Exception:
+            _observe(endpoint, start)
+            raise
+        _observe(endpoint, start, resp)
+        return resp
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def _headers(self, auth, extra):
+        headers = {}
+        if auth and self._auth_header:
+            headers.update(self._auth_header())
+        if extra:
+            headers.update(extra)
+        return headers
+
+    # ── Stats ─────────────────────────────────
+
+    def _record(self, endpoint, start, error, reauthed):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            s = self._calls.setdefault(endpoint, {"count": 0, "errors": 0, "reauth": 0, "total_ms": 0.0})
+            s["count"] += 1
+            s["total_ms"] += elapsed_ms
+            if error:
+                s["errors"] += 1
+            if reauthed:
+                s["reauth"] += 1
+                self._reauths += 1
+
+    def connection_stats(self):
+        """Connections opened vs requests sent, summed over all live pools."""
+        opened = sent = 0
+        pools = self._adapter.poolmanager.pools
+        with pools.lock:
+            keys = list(pools.keys())
+        for key in keys:
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            sent += pool.num_requests
+        return {
+            "connections_opened": opened,
+            "requests_sent": sent,
+            "connections_reused": max(0, sent - opened),
+        }
+
+    def stats(self):
+        with self._lock:
+            endpoints = {
+                name: {
+                    "count": s["count"],
+                    "errors": s["errors"],
+                    "reauth": s["reauth"],
+                    "avg_ms": round(s["total_ms"] / s["count"], 1) if s["count"] else 0.0,
+                }
+                for name, s in self._calls.items()
+            }
+            reauths = self._reauths
+        return {"endpoints": endpoints, "reauths": reauths, **self.connection_stats(),
+                "admission": self.limiter.stats(), "circuit": self.breaker.stats()}
+
+
+async def _aiter(body):
+    for chunk in body:
+        yield chunk
+
+
+class AsyncUpstreamClient:
+    """Coroutine version of `UpstreamClient.request` on a pooled `httpx.AsyncClient`.
+
+    Wraps an existing `UpstreamClient` so both go through the same rate
+    limiter and circuit breaker and report into the same per-endpoint stats.
+    Cancelling a call (e.g. because the browser disconnected) closes its
+    connection. The sync `relogin` hook runs in a worker thread.
+    """
+
+    def __init__(self, sync_client, max_connections=256, max_keepalive=32):
+        if httpx is None:
+            raise ImportError("AsyncUpstreamClient needs httpx (pip install httpx)")
+        self.sync = sync_client
+        self.base_url = sync_client.base_url
+        self.client = httpx.AsyncClient(
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+        )
+
+    async def request(self, method, path, *, endpoint="default", auth=True, timeout=None,
+                      headers=None, json=None, data=None):
+        """Send a request and return the (fully read) `httpx.Response`.
+
+        `data` may be bytes or a `StreamingJSON` body. Exceptions from httpx
+        propagate unchanged, as do cancellations.
+        """
+        url = path if path.startswith(("http://", "https://")) else f"{self.base_url}{path}"
+        if timeout is None:
+            timeout = self.sync.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+
+        start = time.perf_counter()
+        reauthed = False
+        try:
+            sent = self.sync._headers(auth, headers)
+            resp = await self._send(method, url, endpoint, sent, timeout, json, data)
+            if (auth and resp.status_code == 401 and self.sync._relogin
+                    and await asyncio.to_thread(self.sync._relogin,
+                                                sent.get("Authorization", "").removeprefix("Bearer "))):
+                reauthed = True
+                resp = await self._send(method, url, endpoint, self.sync._headers(auth, headers),
+                                        timeout, json, data)
+        except Exception:
+            self.sync._record(endpoint, start, error=True, reauthed=reauthed)
+            raise
+        self.sync._record(endpoint, start, error=False, reauthed=reauthed)
+        return resp
+
+    async def _send(self, method, url, endpoint, headers, timeout, json, data):
+        # httpx refuses header values with trailing whitespace ("Bearer " before login)
+        headers = {k: str(v).strip() for k, v in headers.items()}
+        if isinstance(data, StreamingJSON):
+            headers = {**headers, "Content-Type": "application/json", "Content-Length": str(len(data))}
+            data = _aiter(data)
+        kwargs = {"headers": headers, "timeout": timeout, "json": json, "content": data}
+        if not url.startswith(self.base_url):
+            return await self._call(method, url, endpoint, **kwargs)
+
+        limiter, breaker = self.sync.limiter, self.sync.breaker
+        priority = ENDPOINT_PRIORITY.get(endpoint, PRIORITY_INTERACTIVE)
+        if not await limiter.acquire_async(priority, timeout=ADMISSION_TIMEOUT[priority]):
+            UPSTREAM_REFUSED.inc(endpoint=endpoint, reason="rate_limit")
+            return self._local_response(429, "rate limited (local admission control)", 5)
+        if not breaker.allow():
+            UPSTREAM_REFUSED.inc(endpoint=endpoint, reason="circuit_open")
+            return self._local_response(503, "API unavailable — failing fast while it recovers",
+                                        breaker.retry_after())
+        try:
+            resp = await self._call(method, url, endpoint, **kwargs)
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+        except Exception:
+            breaker.record(False)
+            raise
+        limiter.on_response(resp.status_code, _retry_after(resp))
+        breaker.record(resp.status_code not in FAILURE_STATUSES)
+        return resp
+
+    async def _call(self, method, url, endpoint, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+        except Exception:
+            _observe(endpoint, start)
+            raise
+        _observe(endpoint, start, resp)
+        return resp
+
+    @staticmethod
+    def _local_response(status, message, retry_after=None):
+        headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after else None
+        return httpx.Response(status, json={"error": message}, headers=headers)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()